@@ -1,7 +1,26 @@
+from django import forms
 from django.contrib import admin
 from .models import Category, Note
 
 
+class NoteAdminForm(forms.ModelForm):
+    # The body is not a model field, see NoteBody
+    content = forms.CharField(widget=forms.Textarea)
+
+    class Meta:
+        model = Note
+        fields = ['title', 'content', 'date', 'category', 'user']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is not None:
+            self.initial.setdefault('content', self.instance.content)
+
+    def save(self, commit=True):
+        self.instance.content = self.cleaned_data['content']
+        return super().save(commit)
+
+
 # Register your models here.
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -11,6 +30,7 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Note)
 class NoteAdmin(admin.ModelAdmin):
+    form = NoteAdminForm
     list_display = ('title', 'date', 'category', 'created_at')
     list_filter = ('category', 'date')
-    search_fields = ('title', 'content')
\ No newline at end of file
+    search_fields = ('title',)
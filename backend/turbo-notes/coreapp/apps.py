@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class CoreappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'coreapp'
+
+    def ready(self):
+        # Connects the note statistics, response cache, rendered notes, shard
+        # id, title and related notes index and fingerprint signal handlers
+        # and registers the background tasks
+        from . import caching, duplicates, fragments, related, sharding, stats, suggest, tasks  # noqa: F401
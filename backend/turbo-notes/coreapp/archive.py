@@ -0,0 +1,190 @@
+"""
+Archive tier for cold notes.
+
+Notes not changed for ARCHIVE_AFTER_DAYS are moved out of the notes table,
+its indexes and the body and revision tables into ArchivedNote: one row
+per note with the body compressed and the revisions packed together. The
+`archive_notes` background job moves them in batches, user by user along
+the (user, updated_at) index, and queues its own continuation when it
+runs out of time.
+
+Archived notes keep their ids and still count in the note statistics. The
+notes list leaves them out unless asked with `include_archived`, single
+notes are served from either table, and any write to an archived note
+restores it first.
+"""
+import base64
+import time
+import zlib
+from datetime import timedelta
+
+import orjson
+from django.db import router, transaction
+from django.db.models import Value
+from django.utils import timezone
+
+from .caching import invalidate_user
+from .conf import setting
+from .deletion import delete_matching
+from .duplicates import fingerprint_many
+from .models import BODY_PLAIN, BODY_ZLIB, METADATA_FIELDS, ArchivedNote, Note, NoteActivity, NoteBody, NoteRevision
+from .related import notes_changed
+from .sharding import locate
+
+DEFAULT_ARCHIVE_AFTER_DAYS = 180
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_JOB_SECONDS = 60
+
+
+def archive_cutoff(days=None):
+    if days is None:
+        days = setting('ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS)
+    return timezone.now() - timedelta(days=days)
+
+
+def compress_body(text):
+    raw = text.encode('utf-8')
+    compressed = zlib.compress(raw, 9)
+    if len(compressed) < len(raw):
+        return BODY_ZLIB, compressed
+    return BODY_PLAIN, raw
+
+
+def pack_revisions(revisions):
+    if not revisions:
+        return b''
+    return zlib.compress(orjson.dumps([
+        [revision.version, revision.kind, revision.size, revision.saved_at, base64.b64encode(revision.data).decode()]
+        for revision in revisions
+    ]), 9)
+
+
+def unpack_revisions(note_id, data):
+    if not data:
+        return []
+    return [
+        NoteRevision(
+            note_id=note_id, version=version, kind=kind, size=size,
+            saved_at=Note._meta.get_field('updated_at').to_python(saved_at), data=base64.b64decode(encoded),
+        )
+        for version, kind, size, saved_at, encoded in orjson.loads(zlib.decompress(bytes(data)))
+    ]
+
+
+def archive_user_notes(user_id, cutoff=None, using=None, batch_size=None):
+    """Archive the notes of a user not changed since `cutoff`, return how many"""
+    cutoff = cutoff or archive_cutoff()
+    using = using or router.db_for_write(Note)
+    batch_size = batch_size or setting('ARCHIVE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    archived = 0
+    while True:
+        with transaction.atomic(using=using):
+            notes = list(
+                Note.objects.using(using).with_content()
+                # Notes being edited right now are not cold
+                .select_for_update(skip_locked=True, of=('self',))
+                .filter(user_id=user_id, updated_at__lt=cutoff)
+                .order_by('updated_at', 'id')[:batch_size]
+            )
+            if not notes:
+                break
+            revisions = {}
+            for revision in NoteRevision.objects.using(using).filter(note__in=notes).order_by('version'):
+                revisions.setdefault(revision.note_id, []).append(revision)
+
+            rows = []
+            for note in notes:
+                codec, data = compress_body(note.content)
+                rows.append(ArchivedNote(
+                    id=note.pk, title=note.title, date=note.date, category_id=note.category_id,
+                    user_id=note.user_id, version=note.version, created_at=note.created_at,
+                    updated_at=note.updated_at, archived_at=timezone.now(), codec=codec, data=data,
+                    revisions=pack_revisions(revisions.get(note.pk)),
+                    **{field: getattr(note, field) for field in METADATA_FIELDS},
+                ))
+            ArchivedNote.objects.using(using).bulk_create(rows)
+            # Set-based, so the statistics keep counting the archived notes
+            delete_matching(Note, {'pk__in': [note.pk for note in notes]}, using)
+        archived += len(notes)
+        if len(notes) < batch_size:
+            break
+    if archived:
+        invalidate_user(user_id, using=using)
+        notes_changed(user_id, using=using)
+    return archived
+
+
+def archive_cold_notes(using=None, after_user=0, days=None, seconds=None):
+    """
+    Archive the notes not changed for `days` user by user, starting after
+    the user id `after_user`, for up to `seconds`. Returns (archived, last
+    user id done, or None when every user was done).
+    """
+    deadline = time.monotonic() + (seconds or setting('ARCHIVE_JOB_SECONDS', DEFAULT_JOB_SECONDS))
+    cutoff = archive_cutoff(days)
+    archived = 0
+    # Every user with notes has an activity row
+    user_ids = (
+        NoteActivity.objects.using(using).filter(user_id__gt=after_user, last_activity__isnull=False)
+        .order_by('user_id').values_list('user_id', flat=True)
+    )
+    for user_id in user_ids.iterator():
+        placement = locate(user_id, assign=False)
+        # Users being moved to another shard are archived there afterwards
+        if placement is None or not placement.locked:
+            archived += archive_user_notes(user_id, cutoff, using=using)
+        if time.monotonic() > deadline:
+            return archived, user_id
+    return archived, None
+
+
+def restore_note(user, pk, using=None):
+    """Move an archived note of `user` back to the notes table, return whether there was one"""
+    try:
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return False
+    using = using or router.db_for_write(Note)
+    with transaction.atomic(using=using):
+        archived = ArchivedNote.objects.using(using).select_for_update().filter(user=user, pk=pk).first()
+        if archived is None:
+            return False
+        if not Note.objects.using(using).filter(pk=pk).exists():
+            note = Note(
+                id=archived.pk, title=archived.title, date=archived.date, category_id=archived.category_id,
+                user_id=archived.user_id, version=archived.version, created_at=archived.created_at,
+                updated_at=archived.updated_at, **{field: getattr(archived, field) for field in METADATA_FIELDS},
+            )
+            # raw keeps the timestamps, and no signals: the statistics never
+            # stopped counting the note
+            Note._base_manager.using(using)._insert(
+                [note], fields=Note._meta.local_concrete_fields, raw=True, using=using
+            )
+            NoteBody.objects.using(using).bulk_create([NoteBody.for_text(note, archived.content)])
+            fingerprint_many([(note, archived.content)], using=using)
+            NoteRevision.objects.using(using).bulk_create(unpack_revisions(pk, archived.revisions))
+        ArchivedNote.objects.using(using).filter(pk=pk)._raw_delete(using)
+    invalidate_user(archived.user_id, using=using)
+    notes_changed(archived.user_id, using=using)
+    return True
+
+
+def with_archived(notes, archived):
+    """
+    Merge two filtered querysets of notes and archived notes into rows of
+    (id, sort key, is archived), ordered like `notes`, for pagination.
+    """
+    ordering = notes.query.order_by
+    columns = ['id'] + [field.lstrip('-') for field in ordering if field.lstrip('-') != 'id']
+    notes = notes.order_by().annotate(from_archive=Value(False)).values_list(*columns, 'from_archive')
+    archived = archived.order_by().annotate(from_archive=Value(True)).values_list(*columns, 'from_archive')
+    return notes.union(archived, all=True).order_by(*ordering)
+
+
+def load_rows(rows, notes, archived):
+    """The notes and archived notes of a page of with_archived() rows, in order"""
+    found = {
+        False: notes.in_bulk([row[0] for row in rows if not row[-1]]),
+        True: archived.in_bulk([row[0] for row in rows if row[-1]]),
+    }
+    return [found[row[-1]][row[0]] for row in rows if row[0] in found[row[-1]]]
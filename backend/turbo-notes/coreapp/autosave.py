@@ -0,0 +1,322 @@
+"""
+Write coalescing for autosaves.
+
+Editors save a note several times a second while its owner types, each
+save a full PUT. With AUTOSAVE_COALESCE_WINDOW set, a PUT is validated as
+usual but its data is buffered in the cache instead of being written:
+the saves of a note in the following window seconds replace the buffered
+data, and one write stores the last of them when the window is over.
+
+Reads serve the buffered state: detail and list responses show the
+buffered title, content, date and category of the notes they hold. An
+entry only applies to the note row it was buffered against, identified by
+its `updated_at`, so it is ignored once the note was written by anything
+else. Other writes to a note (PATCH, content patches) flush its buffer
+first so they apply on top of it, and deleting the note discards it.
+
+Each process flushes the buffers it filled from a background thread once
+notes.wsgi enabled it, or at its next autosave otherwise, and flushes
+everything on exit (gunicorn's worker_exit hook and atexit). A process
+killed outright loses at most its last window of autosaves.
+
+Entries live in the cache so every worker reads them: like the response
+cache, coalescing is only enabled by default when the cache is shared.
+"""
+import atexit
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import close_old_connections, router, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .caching import invalidate_user
+from .conf import setting
+from .models import Category, Note
+from .sharding import for_user
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCK_TIMEOUT = 5.0
+WAIT_INTERVAL = 0.005
+
+# Deletes the lock only if it still holds the token of its owner
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def get_cache():
+    return caches[setting('AUTOSAVE_CACHE', 'default')]
+
+
+def window():
+    return setting('AUTOSAVE_COALESCE_WINDOW', 0)
+
+
+def is_enabled():
+    return window() > 0
+
+
+def entry_key(note_id):
+    return f'autosave:{note_id}'
+
+
+def entry_timeout():
+    # Long enough to outlive the window by far, entries are flushed well before
+    return max(60, int(window() * 10))
+
+
+class NoteLocked(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The note is being saved, try again in a few seconds.'
+    default_code = 'note_locked'
+    wait = 1
+
+
+def release_lock(cache, key, token):
+    """Delete the lock at `key` if it is still held with `token`"""
+    if isinstance(cache, RedisCache):
+        client = cache._cache.get_client(key, write=True)
+        client.eval(RELEASE_SCRIPT, 1, cache.make_and_validate_key(key), token)
+    elif cache.get(key) == token:
+        # Not shared between processes, the lock expiring in between is
+        # the only race left
+        cache.delete(key)
+
+
+@contextmanager
+def note_lock(note_id, cache):
+    """
+    Serialize the buffering and flushing of a note across processes.
+    Raises NoteLocked if the lock was not acquired within
+    AUTOSAVE_LOCK_TIMEOUT seconds.
+    """
+    key = f'{entry_key(note_id)}:lock'
+    timeout = setting('AUTOSAVE_LOCK_TIMEOUT', DEFAULT_LOCK_TIMEOUT)
+    deadline = time.monotonic() + timeout
+    # An integer, stored as is by the Redis cache, for RELEASE_SCRIPT
+    token = secrets.randbits(63)
+    # Left by a process that died holding it, the lock expires after timeout
+    while not cache.add(key, token, timeout=timeout):
+        if time.monotonic() >= deadline:
+            raise NoteLocked()
+        time.sleep(WAIT_INTERVAL)
+    try:
+        yield
+    finally:
+        release_lock(cache, key, token)
+
+
+class Flusher:
+    """The notes whose buffers this process filled, and when each is due"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pending = {}
+        self.enabled = False
+        self.thread = None
+        self.pid = None
+
+    def enable(self):
+        """Flush from a background thread, started by the first autosave"""
+        if not self.enabled:
+            self.enabled = True
+            atexit.register(flush_all)
+
+    def add(self, note_id, due):
+        with self.lock:
+            self.pending[note_id] = min(due, self.pending.get(note_id, due))
+        if self.enabled:
+            self.start()
+            self.wakeup.set()
+
+    def discard(self, note_id):
+        with self.lock:
+            self.pending.pop(note_id, None)
+
+    def due(self, now):
+        with self.lock:
+            return [note_id for note_id, due in self.pending.items() if due <= now]
+
+    def next_due(self):
+        with self.lock:
+            return min(self.pending.values(), default=None)
+
+    def start(self):
+        # Threads do not survive a fork, a preloaded worker starts its own
+        if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run, name='autosave-flusher', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            next_due = self.next_due()
+            timeout = None if next_due is None else max(0.0, next_due - time.time())
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+            close_old_connections()
+            try:
+                flush_due()
+            except Exception:
+                logger.exception('Flushing autosaves failed')
+            finally:
+                close_old_connections()
+
+    def clear(self):
+        with self.lock:
+            self.pending.clear()
+
+
+flusher = Flusher()
+
+
+def buffer_update(note, data):
+    """
+    Buffer the validated data of a PUT to `note` and return the note as it
+    will be once written. The buffer is flushed `window()` seconds after
+    the first of the saves it merges.
+    """
+    flush_due()
+    cache = get_cache()
+    key = entry_key(note.pk)
+    now = time.time()
+    with note_lock(note.pk, cache):
+        updated_at = Note.objects.filter(pk=note.pk).values_list('updated_at', flat=True).first()
+        if updated_at != note.updated_at:
+            # Written since it was read, by a flush for instance
+            note.refresh_from_db()
+        entry = cache.get(key)
+        if entry is None or entry['base'] != note.updated_at:
+            entry = {'user_id': note.user_id, 'base': note.updated_at, 'since': now, 'saves': 0}
+        entry.update(
+            title=data['title'],
+            content=data['content'],
+            date=data['date'],
+            category_id=data['category'].pk,
+            # The write bumps the version once, if the content changed
+            version=note.version + (data['content'] != note.content),
+            saves=entry['saves'] + 1,
+        )
+        cache.set(key, entry, timeout=entry_timeout())
+    invalidate_user(note.user_id)
+
+    due = entry['since'] + window()
+    if due <= now:
+        flush(note.pk)
+    else:
+        flusher.add(note.pk, due)
+    apply(note, entry, data['category'])
+    return note
+
+
+def apply(note, entry, category=None):
+    note.title = entry['title']
+    note.date = entry['date']
+    note.version = entry['version']
+    # Not assigned through the property, the note is not to be saved
+    note._content = entry['content']
+    note.set_metadata(entry['content'])
+    # Not the stored state, kept out of coreapp.fragments
+    note._buffered = True
+    if note.category_id != entry['category_id']:
+        note.category = category or Category.objects.get(pk=entry['category_id'])
+
+
+def pending_entry(note, entry):
+    return (
+        entry is not None and entry['user_id'] == note.user_id and entry['base'] == note.updated_at
+    )
+
+
+def overlay(note):
+    """Show the buffered state of `note`, if any"""
+    if is_enabled() and isinstance(note, Note):
+        entry = get_cache().get(entry_key(note.pk))
+        if pending_entry(note, entry):
+            apply(note, entry)
+    return note
+
+
+def overlay_many(notes):
+    """Show the buffered state of the notes of a page, with one cache read"""
+    if not is_enabled() or not notes:
+        return notes
+    keys = {entry_key(note.pk): note for note in notes if isinstance(note, Note)}
+    if not keys:
+        return notes
+    entries = get_cache().get_many(keys)
+    pending = [(note, entries.get(key)) for key, note in keys.items() if pending_entry(note, entries.get(key))]
+    if pending:
+        category_ids = {entry['category_id'] for note, entry in pending if note.category_id != entry['category_id']}
+        categories = Category.objects.in_bulk(category_ids) if category_ids else {}
+        for note, entry in pending:
+            apply(note, entry, categories.get(entry['category_id']))
+    return notes
+
+
+def flush(note_id):
+    """Write the buffered state of a note now, return whether anything was written"""
+    flusher.discard(note_id)
+    if not is_enabled():
+        return False
+    cache = get_cache()
+    key = entry_key(note_id)
+    with note_lock(note_id, cache):
+        entry = cache.get(key)
+        if entry is None:
+            return False
+        with for_user(entry['user_id'], writable=True):
+            written = write(note_id, entry)
+        cache.delete(key)
+    return written
+
+
+def write(note_id, entry):
+    with transaction.atomic(using=router.db_for_write(Note)):
+        note = Note.objects.select_for_update().filter(pk=note_id, user_id=entry['user_id']).first()
+        if note is None or note.updated_at != entry['base']:
+            # Deleted, or already written by another process
+            return False
+        note.title = entry['title']
+        note.date = entry['date']
+        note.category_id = entry['category_id']
+        note.content = entry['content']
+        note.save()
+    return True
+
+
+def discard(note_id):
+    """Drop the buffered saves of a note about to be deleted"""
+    flusher.discard(note_id)
+    if is_enabled():
+        get_cache().delete(entry_key(note_id))
+
+
+def flush_due(now=None):
+    now = time.time() if now is None else now
+    written = 0
+    for note_id in flusher.due(now):
+        try:
+            written += flush(note_id)
+        except NoteLocked:
+            # Held by another process saving the note, tried again later
+            flusher.add(note_id, time.time() + NoteLocked.wait)
+    return written
+
+
+def flush_all():
+    """Write every buffer of this process, on shutdown"""
+    return flush_due(now=float('inf'))
@@ -0,0 +1,164 @@
+"""
+Read-through cache of API responses, per user.
+
+The data of list and detail responses is cached under keys holding the
+user's cache version, which every write to one of their notes or
+categories increments, so a single increment drops all their cached pages
+without finding them. Signal handlers cover saves and deletes, and the
+set-based paths (bulk imports, fast deletion) invalidate explicitly.
+
+The version is incremented once right away, so the writing request reads
+its own write, and once more after commit, since a concurrent reader may
+have cached the state from before the commit under the first increment.
+
+Only one request computes a missing entry: the others wait for it to be
+stored, up to RESPONSE_CACHE_LOCK_TIMEOUT seconds, instead of all running
+the same queries at once.
+"""
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.response import Response
+
+from .conf import setting
+from .deletion import handles_set_based_delete
+from .models import Category, Note
+
+DEFAULT_TIMEOUT = 300
+DEFAULT_LOCK_TIMEOUT = 5.0
+WAIT_INTERVAL = 0.01
+
+MISSING = object()
+
+
+def get_cache():
+    return caches[setting('RESPONSE_CACHE', 'default')]
+
+
+def is_enabled():
+    return setting('RESPONSE_CACHE_ENABLED', False)
+
+
+def version_key(user_id):
+    return f'responses:version:{user_id}'
+
+
+def user_version(user_id, cache=None):
+    cache = cache or get_cache()
+    key = version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock, not 1, so that a version lost to eviction
+        # never comes back to entries cached under it
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(user_id):
+    cache = get_cache()
+    try:
+        cache.incr(version_key(user_id))
+    except ValueError:
+        # Not cached yet, the next reader starts a new version
+        pass
+
+
+def invalidate_user(user_id, using=None):
+    """Drop the cached responses of a user, now and once the transaction commits"""
+    if not is_enabled() or user_id is None:
+        return
+    bump_version(user_id)
+    transaction.on_commit(lambda: bump_version(user_id), using=using)
+
+
+class CacheStats:
+    """Hit and miss counts of this process, reported by the tests"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+stats = CacheStats()
+
+
+def entry_key(request, name, version):
+    # The absolute URI, since paginated responses link to the host they were requested on
+    uri = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'responses:{request.user.pk}:{version}:{name}:{uri}'
+
+
+def wait_for(cache, key, lock_key, timeout):
+    """Wait for another request to store `key`, return MISSING if it gave up"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        data = cache.get(key, MISSING)
+        if data is not MISSING:
+            return data
+        if cache.get(lock_key) is None:
+            # Finished without storing anything, such as a 404
+            break
+    return MISSING
+
+
+def cached_response(request, name, compute):
+    """
+    Return the response of `compute()` for the requesting user, serving
+    its data from the cache when possible. `name` tells apart the views
+    caching responses, such as the name of their URL. Only 200 responses
+    are cached.
+    """
+    if not is_enabled():
+        return compute()
+
+    cache = get_cache()
+    key = entry_key(request, name, user_version(request.user.pk, cache))
+    lock_key = f'{key}:lock'
+    locked = False
+    data = cache.get(key, MISSING)
+    if data is MISSING:
+        lock_timeout = setting('RESPONSE_CACHE_LOCK_TIMEOUT', DEFAULT_LOCK_TIMEOUT)
+        locked = cache.add(lock_key, 1, timeout=lock_timeout)
+        if not locked:
+            data = wait_for(cache, key, lock_key, lock_timeout)
+    if data is not MISSING:
+        stats.hits += 1
+        return Response(data)
+
+    stats.misses += 1
+    try:
+        response = compute()
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, timeout=setting('RESPONSE_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return response
+
+
+@handles_set_based_delete
+@receiver(post_delete, sender=Note)
+@receiver(post_delete, sender=Category)
+def invalidate_on_delete(sender, instance, using=None, **kwargs):
+    invalidate_user(instance.user_id, using=using)
+
+
+@receiver(post_save, sender=Note)
+@receiver(post_save, sender=Category)
+def invalidate_on_save(sender, instance, using=None, **kwargs):
+    invalidate_user(instance.user_id, using=using)
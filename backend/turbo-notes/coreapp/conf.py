@@ -0,0 +1,10 @@
+"""
+Settings of the app, all optional: each module reading one passes the
+default used when the project does not set it.
+"""
+from django.conf import settings
+
+
+def setting(name, default):
+    """The project's value of the setting `name`, or `default`"""
+    return getattr(settings, name, default)
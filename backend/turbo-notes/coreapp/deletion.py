@@ -0,0 +1,156 @@
+"""
+Set-based deletion of categories and users.
+
+Model.delete() goes through Django's collector, which loads every related
+row (all the notes of a category, with their bodies and revisions) to send
+delete signals and cascade in Python. When nothing needs that per-row
+handling, fast_delete() issues DELETE statements per related table instead,
+children first, and splits the rows hanging off the deleted object into
+primary key ranges so that no single transaction holds locks for long.
+"""
+from django.db import router, transaction
+from django.db.models import CASCADE, DO_NOTHING
+from django.db.models.deletion import get_candidate_relations_to_delete
+from django.db.models.signals import post_delete, pre_delete
+
+from .conf import setting
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_BACKGROUND_THRESHOLD = 10000
+
+# Delete signal receivers whose effect the callers of fast_delete reproduce
+set_based_receivers = set()
+
+
+def handles_set_based_delete(receiver):
+    """Mark a delete signal receiver as not requiring the collector"""
+    set_based_receivers.add(receiver)
+    return receiver
+
+
+def live_receivers(signal, sender):
+    # Signal._live_receivers returns the sync and the async receivers
+    return [receiver for receivers in signal._live_receivers(sender) for receiver in receivers]
+
+
+def cascade_relations(model):
+    """The relations whose rows are deleted along with rows of `model`"""
+    for related in get_candidate_relations_to_delete(model._meta):
+        if related.on_delete is not DO_NOTHING:
+            yield related
+
+
+def can_delete_set_based(model, seen=()):
+    """Whether deleting `model` rows needs no per-row handling anywhere in its cascade"""
+    if model in seen:
+        return False
+    if any(hasattr(field, 'bulk_related_objects') for field in model._meta.private_fields):
+        # Generic relations are cascaded by the collector only
+        return False
+    for signal in (pre_delete, post_delete):
+        if any(receiver not in set_based_receivers for receiver in live_receivers(signal, model)):
+            return False
+    return all(
+        related.on_delete is CASCADE and can_delete_set_based(related.related_model, seen + (model,))
+        for related in cascade_relations(model)
+    )
+
+
+def delete_matching(model, lookup, using):
+    """Delete the `model` rows matching `lookup` and everything cascading from them"""
+    deleted = 0
+    for related in cascade_relations(model):
+        child_lookup = {f'{related.field.name}__{key}': value for key, value in lookup.items()}
+        deleted += delete_matching(related.related_model, child_lookup, using)
+    # _raw_delete is the single DELETE statement the collector uses for
+    # its fast deletes
+    queryset = model._base_manager.using(using).filter(**lookup)
+    return deleted + queryset._raw_delete(using)
+
+
+def pk_ranges(queryset, size):
+    """Yield the inclusive (first, last) primary keys of consecutive chunks of `queryset`"""
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    last = None
+    while True:
+        chunk = list((pks if last is None else pks.filter(pk__gt=last))[:size])
+        if not chunk:
+            return
+        yield chunk[0], chunk[-1]
+        last = chunk[-1]
+
+
+def fast_delete(obj, chunk_size=None, using=None):
+    """
+    Delete `obj` and its cascade with set-based SQL, falling back to
+    obj.delete() when some model in the cascade needs per-row handling.
+
+    Each chunk of `chunk_size` directly related rows is deleted in its own
+    transaction, so a failure part way leaves `obj` with fewer related
+    rows but never with dangling ones. Returns the number of rows deleted.
+    """
+    model = type(obj)
+    using = using or router.db_for_write(model, instance=obj)
+    if not can_delete_set_based(model):
+        return obj.delete(using=using)[0]
+
+    chunk_size = chunk_size or setting('FAST_DELETE_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    deleted = 0
+    for related in cascade_relations(model):
+        name = related.field.name
+        rows = related.related_model._base_manager.using(using).filter(**{name: obj})
+        for first, last in pk_ranges(rows, chunk_size):
+            with transaction.atomic(using=using):
+                deleted += delete_matching(
+                    related.related_model, {name: obj, 'pk__gte': first, 'pk__lte': last}, using
+                )
+
+    with transaction.atomic(using=using):
+        # Rows created since the chunks were listed go here
+        deleted += delete_matching(model, {'pk': obj.pk}, using)
+    obj.pk = None
+    return deleted
+
+
+def delete_category(category, chunk_size=None):
+    """Delete a category and its notes"""
+    # Imported here, these modules register their handlers on import
+    from .caching import invalidate_user
+    from .fragments import fragments
+    from .related import notes_changed
+    from .stats import touch_activity
+    from .suggest import titles_changed
+
+    category_id = category.pk
+    deleted = fast_delete(category, chunk_size=chunk_size)
+    fragments.discard_category(category_id)
+    touch_activity(category.user_id, create=False)
+    invalidate_user(category.user_id)
+    titles_changed(category.user_id)
+    notes_changed(category.user_id)
+    return deleted
+
+
+def delete_user(user, chunk_size=None):
+    """Delete a user with all their categories and notes"""
+    from .caching import invalidate_user
+    from .related import notes_changed
+    from .sharding import locate
+    from .suggest import titles_changed
+
+    invalidate_user(user.pk)
+    titles_changed(user.pk)
+    notes_changed(user.pk)
+    deleted = 0
+    placement = locate(user.pk, assign=False)
+    if placement is not None and placement.shard != user._state.db:
+        # Their data and the copy of their user row on the shard
+        copy = type(user)._base_manager.using(placement.shard).filter(pk=user.pk).first()
+        if copy is not None:
+            deleted += fast_delete(copy, chunk_size=chunk_size, using=placement.shard)
+    return deleted + fast_delete(user, chunk_size=chunk_size)
+
+
+def is_large(count):
+    return count >= setting('FAST_DELETE_BACKGROUND_THRESHOLD', DEFAULT_BACKGROUND_THRESHOLD)
+
@@ -0,0 +1,229 @@
+"""
+Near-duplicate notes, found by MinHash.
+
+The signature of a note's content is the minimum of each of HASHES hash
+functions over its word pairs. Two notes have the same minimum for a hash
+function with a probability equal to the Jaccard similarity of their word
+pairs, so the share of equal minimums estimates it. The signature is
+computed when the content is saved and stored in NoteFingerprint.
+
+Notes are near-duplicates when their estimated similarity is at least
+SIMILARITY. The signature is split into BANDS bands of ROWS minimums, and
+each band is stored hashed in an indexed column: notes at least that
+similar share a band with a probability of 98% or more. The candidates
+are the notes sharing a band value with another note: a note written is
+looked up in the band indexes, and it and the notes sharing one of its
+bands are marked `shared`. A request only reads the marked fingerprints,
+and only compares notes sharing a band. Marks are not cleared when the
+other note changes or goes, which costs a comparison, never a cluster.
+
+Notes are fingerprinted when saved or bulk created, and restored from
+the archive. `manage.py fingerprint_notes` fingerprints the notes saved
+before the fingerprints existed.
+"""
+import hashlib
+import random
+import re
+import struct
+from collections import defaultdict
+from itertools import combinations
+
+from django.db import router
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Note, NoteFingerprint
+
+BANDS = 8
+ROWS = 4
+HASHES = BANDS * ROWS
+SIMILARITY = 0.8
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+BACKFILL_BATCH_SIZE = 500
+
+# The hash functions, (a * x + b) mod PRIME of a 64 bit hash x
+PRIME = (1 << 61) - 1
+_rng = random.Random(0)
+HASH_FUNCTIONS = [(_rng.randrange(1, PRIME), _rng.randrange(PRIME)) for _ in range(HASHES)]
+del _rng
+
+WORD_RE = re.compile(r'\w+')
+
+BAND_FIELDS = [f'band{band}' for band in range(BANDS)]
+
+
+def features(content):
+    """The word pairs of the content, or its words when it has a single one"""
+    words = WORD_RE.findall(content.casefold())
+    if len(words) < 2:
+        return set(words)
+    return {f'{first} {second}' for first, second in zip(words, words[1:])}
+
+
+def feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def signature(content):
+    """The MinHash signature of the content, a tuple of HASHES 32 bit values, empty if it has no words"""
+    hashes = [feature_hash(feature) for feature in features(content)]
+    if not hashes:
+        return ()
+    return tuple(min((a * x + b) % PRIME for x in hashes) & 0xFFFFFFFF for a, b in HASH_FUNCTIONS)
+
+
+def pack(values):
+    return struct.pack(f'>{len(values)}I', *values)
+
+
+def unpack(data):
+    data = bytes(data)
+    return struct.unpack(f'>{len(data) // 4}I', data)
+
+
+def bands(signature):
+    """The hash of each band of a signature, 31 bits to fit an integer column"""
+    digests = (hashlib.blake2b(pack(signature[start:start + ROWS]), digest_size=4).digest()
+               for start in range(0, HASHES, ROWS))
+    return [int.from_bytes(digest, 'big') & 0x7FFFFFFF for digest in digests]
+
+
+def similarity(first, second):
+    """The Jaccard similarity estimated from two signatures"""
+    return sum(a == b for a, b in zip(first, second)) / HASHES
+
+
+def fingerprint_for(note, content):
+    values = signature(content)
+    band_values = bands(values) if values else [None] * BANDS
+    return NoteFingerprint(
+        note_id=note.pk, user_id=note.user_id, signature=pack(values),
+        **dict(zip(BAND_FIELDS, band_values)),
+    )
+
+
+def mark_shared(fingerprints, using=None):
+    """
+    Mark the written fingerprints sharing a band with another note of their
+    user, and those notes, with one lookup in the band indexes per batch
+    """
+    by_user = defaultdict(list)
+    for fingerprint in fingerprints:
+        if fingerprint.band0 is not None:
+            by_user[fingerprint.user_id].append(fingerprint)
+    shared = set()
+    for user_id, written in by_user.items():
+        buckets = defaultdict(set)
+        for fingerprint in written:
+            for band, field in enumerate(BAND_FIELDS):
+                buckets[band, getattr(fingerprint, field)].add(fingerprint.note_id)
+        for start in range(0, len(written), BACKFILL_BATCH_SIZE):
+            batch = written[start:start + BACKFILL_BATCH_SIZE]
+            same_band = Q()
+            for field in BAND_FIELDS:
+                same_band |= Q(**{f'{field}__in': {getattr(fingerprint, field) for fingerprint in batch}})
+            rows = NoteFingerprint.objects.using(using).filter(same_band, user_id=user_id).values_list(
+                'note_id', *BAND_FIELDS
+            )
+            for note_id, *values in rows:
+                for key in enumerate(values):
+                    if key in buckets:
+                        buckets[key].add(note_id)
+        for note_ids in buckets.values():
+            if len(note_ids) > 1:
+                shared |= note_ids
+    shared = sorted(shared)
+    for start in range(0, len(shared), BACKFILL_BATCH_SIZE):
+        NoteFingerprint.objects.using(using).filter(
+            pk__in=shared[start:start + BACKFILL_BATCH_SIZE], shared=False
+        ).update(shared=True)
+
+
+def fingerprint_many(notes, using=None):
+    """Fingerprint new notes, given as (note, content) pairs"""
+    fingerprints = [fingerprint_for(note, content) for note, content in notes]
+    NoteFingerprint.objects.using(using).bulk_create(fingerprints, ignore_conflicts=True)
+    mark_shared(fingerprints, using=using)
+
+
+def backfill_fingerprints(user_ids=None, using=None):
+    """Fingerprint the notes that have none yet, of some users or of all, return how many"""
+    using = using or router.db_for_write(NoteFingerprint)
+    notes = Note.objects.using(using)
+    if user_ids is not None:
+        notes = notes.filter(user_id__in=user_ids)
+    # Bodies are only read for the notes missing their fingerprint
+    missing = list(notes.filter(fingerprint__isnull=True).order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(missing), BACKFILL_BATCH_SIZE):
+        batch = notes.filter(pk__in=missing[start:start + BACKFILL_BATCH_SIZE]).with_content()
+        fingerprint_many([(note, note.content) for note in batch], using=using)
+    return len(missing)
+
+
+def clusters(signatures):
+    """
+    Group (id, signature) pairs into clusters of near-duplicates, largest
+    first. Only signatures sharing a band are compared.
+    """
+    buckets = defaultdict(list)
+    for pk, values in signatures:
+        if values:
+            for band, value in enumerate(bands(values)):
+                buckets[band, value].append((pk, values))
+
+    parents = {}
+
+    def root(pk):
+        while parents[pk] != pk:
+            pk = parents[pk]
+        return pk
+
+    for bucket in buckets.values():
+        for (first, first_values), (second, second_values) in combinations(bucket, 2):
+            first_root = root(parents.setdefault(first, first))
+            second_root = root(parents.setdefault(second, second))
+            if first_root != second_root and similarity(first_values, second_values) >= SIMILARITY:
+                # The smallest id of a cluster is its root
+                parents[first_root] = parents[second_root] = min(first_root, second_root)
+
+    groups = defaultdict(list)
+    for pk in parents:
+        groups[root(pk)].append(pk)
+    return sorted(
+        (sorted(group) for group in groups.values() if len(group) > 1), key=lambda group: (-len(group), group[0])
+    )
+
+
+def candidates(user_id, using=None):
+    """The (id, signature) of the notes of a user sharing a band with another note"""
+    # Served by the (user, shared) index
+    rows = NoteFingerprint.objects.using(using).filter(user_id=user_id, shared=True).values_list(
+        'note_id', 'signature'
+    )
+    return [(pk, unpack(data)) for pk, data in rows]
+
+
+def duplicate_notes(user, limit=DEFAULT_LIMIT):
+    """The `limit` largest clusters of near-duplicate notes of `user`, as lists of {'id', 'title'}"""
+    found = clusters(candidates(user.pk))[:limit]
+    titles = dict(
+        Note.objects.filter(user=user, pk__in=[pk for group in found for pk in group]).values_list('id', 'title')
+    )
+    return [
+        {'notes': [{'id': pk, 'title': titles[pk]} for pk in group if pk in titles]}
+        for group in found
+    ]
+
+
+@receiver(post_save, sender=Note)
+def fingerprint_note(sender, instance, created, using=None, **kwargs):
+    # Still set while the save that assigned the content runs
+    if created or instance._content_changed:
+        fingerprint = fingerprint_for(instance, instance.content)
+        fields = ['user_id', 'signature', 'shared', *BAND_FIELDS]
+        NoteFingerprint.objects.using(using).update_or_create(
+            note_id=instance.pk, defaults={field: getattr(fingerprint, field) for field in fields}
+        )
+        mark_shared([fingerprint], using=using)
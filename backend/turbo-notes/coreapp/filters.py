@@ -0,0 +1,108 @@
+"""
+Query parameter filters for the notes list.
+
+Parameters are validated with a serializer before any query is built, so
+malformed input answers 400 instead of reaching the database. Every filter
+is a range or equality test on a column leading one of the composite
+indexes declared on Note, always behind ``user``:
+
+- ``category`` (repeatable or comma separated): (user, category, date, id)
+- ``date_from`` / ``date_to``: (user, date, id)
+- ``updated_since``: (user, updated_at, id)
+- ``ids`` (comma separated): primary key
+- ``min_words`` / ``max_words``: (user, word_count, id)
+- ``has_checklist``: (user, has_checklist, date, id)
+- ``content_hash``: (user, content_hash)
+- ``ordering``: the index of the ordered column, ``id`` breaks ties
+
+Archived notes (see coreapp.archive) are only listed with
+``include_archived``; the same filters apply to them, on the
+(user, date, id) index of ArchivedNote.
+"""
+from rest_framework import serializers
+
+MAX_IDS = 100
+MAX_CATEGORIES = 50
+
+ORDERING_FIELDS = ('date', 'updated_at', 'title', 'word_count', 'char_count')
+DEFAULT_ORDERING = '-date'
+
+
+class CommaSeparatedIntegerField(serializers.ListField):
+    """A list of positive integers given as repeated and/or comma separated values"""
+    child = serializers.IntegerField(min_value=1)
+
+    def get_value(self, dictionary):
+        if self.field_name not in dictionary:
+            return serializers.empty
+        values = []
+        for value in dictionary.getlist(self.field_name):
+            values.extend(item for item in value.split(',') if item.strip())
+        return values
+
+
+class NoteFilterSerializer(serializers.Serializer):
+    category = CommaSeparatedIntegerField(required=False, max_length=MAX_CATEGORIES)
+    ids = CommaSeparatedIntegerField(required=False, max_length=MAX_IDS)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    updated_since = serializers.DateTimeField(required=False)
+    min_words = serializers.IntegerField(required=False, min_value=0)
+    max_words = serializers.IntegerField(required=False, min_value=0)
+    # Not False when left out
+    has_checklist = serializers.BooleanField(required=False, allow_null=True, default=None)
+    content_hash = serializers.RegexField(r'^[0-9a-f]{64}$', required=False)
+    ordering = serializers.ChoiceField(
+        choices=[prefix + field for field in ORDERING_FIELDS for prefix in ('', '-')],
+        default=DEFAULT_ORDERING,
+    )
+    include_archived = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if 'date_from' in attrs and 'date_to' in attrs and attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError({'date_to': ['Must not be before date_from.']})
+        if 'min_words' in attrs and 'max_words' in attrs and attrs['min_words'] > attrs['max_words']:
+            raise serializers.ValidationError({'max_words': ['Must not be below min_words.']})
+        return attrs
+
+
+def include_archived(params):
+    """Whether ``params`` (a QueryDict) ask for the archived notes too"""
+    filters = NoteFilterSerializer(data=params)
+    filters.is_valid(raise_exception=True)
+    return filters.validated_data['include_archived']
+
+
+def filter_notes(queryset, params):
+    """
+    Apply the list filters in ``params`` (a QueryDict) to ``queryset``, of
+    notes or of archived notes.
+
+    Raises ValidationError for invalid parameters.
+    """
+    filters = NoteFilterSerializer(data=params)
+    filters.is_valid(raise_exception=True)
+    data = filters.validated_data
+
+    if 'category' in data:
+        queryset = queryset.filter(category_id__in=data['category'])
+    if 'ids' in data:
+        queryset = queryset.filter(pk__in=data['ids'])
+    if 'date_from' in data:
+        queryset = queryset.filter(date__gte=data['date_from'])
+    if 'date_to' in data:
+        queryset = queryset.filter(date__lte=data['date_to'])
+    if 'updated_since' in data:
+        queryset = queryset.filter(updated_at__gte=data['updated_since'])
+    if 'min_words' in data:
+        queryset = queryset.filter(word_count__gte=data['min_words'])
+    if 'max_words' in data:
+        queryset = queryset.filter(word_count__lte=data['max_words'])
+    if data['has_checklist'] is not None:
+        queryset = queryset.filter(has_checklist=data['has_checklist'])
+    if 'content_hash' in data:
+        queryset = queryset.filter(content_hash=data['content_hash'])
+
+    ordering = data['ordering']
+    tiebreak = '-id' if ordering.startswith('-') else 'id'
+    return queryset.order_by(ordering, tiebreak)
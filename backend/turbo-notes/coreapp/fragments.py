@@ -0,0 +1,176 @@
+"""
+Rendered notes, kept by each process for the note lists.
+
+Most notes of a page did not change since it was last served, yet every
+response serialized each of them again. NoteListSerializer keeps the JSON
+of each note it renders, keyed by the note's id and checked against its
+`updated_at`, its `content_hash` and its category's `updated_at`: any save
+of the note or of its category changes them, and the content hash covers
+writes keeping `updated_at`, such as the metadata backfill. Only the notes
+missing or stale are serialized, and the renderer copies the others into
+the response as they are, see ORJSONRenderer.
+
+The cache holds up to NOTE_FRAGMENT_CACHE_BYTES of JSON, least recently
+used notes first out, and 0 turns it off. A stale entry is never served,
+whichever process made the change; saving or deleting a category only
+frees the entries of its notes in this process right away. Notes showing
+a buffered autosave are not their stored state, and are never cached.
+Writes changing notes with QuerySet.update() must set `updated_at`.
+"""
+import threading
+from collections import OrderedDict, defaultdict
+from collections.abc import Mapping
+
+import orjson
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import serializers
+
+from .caching import CacheStats
+from .conf import setting
+from .deletion import handles_set_based_delete
+from .models import Category
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# Counted for each entry on top of its JSON: the key, stamp and index sets
+ENTRY_OVERHEAD = 200
+
+
+class Fragment(Mapping):
+    """The rendered JSON of a note, read as the dict it encodes when needed"""
+
+    __slots__ = ('content', '_data')
+
+    def __init__(self, content):
+        self.content = content
+        self._data = None
+
+    def __reduce__(self):
+        return Fragment, (self.content,)
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = orjson.loads(self.content)
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f'Fragment({self.content!r})'
+
+
+def stamp(note):
+    """What the rendered note depends on, besides its id"""
+    return note.updated_at, note.content_hash, note.category.updated_at
+
+
+class FragmentCache:
+    """The rendered notes of this process, by note id, least recently used first"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.by_category = defaultdict(set)
+        self.size = 0
+
+    @property
+    def max_bytes(self):
+        return setting('NOTE_FRAGMENT_CACHE_BYTES', DEFAULT_MAX_BYTES)
+
+    def get_many(self, notes):
+        """The cached fragments of the notes, None for those missing or stale"""
+        found = []
+        with self.lock:
+            for note in notes:
+                entry = self.entries.get(note.pk)
+                if entry is not None and entry[0] == stamp(note):
+                    self.entries.move_to_end(note.pk)
+                    found.append(entry[2])
+                else:
+                    found.append(None)
+        return found
+
+    def set_many(self, items):
+        """Store (note, fragment) pairs, evicting the least recently used notes beyond the bound"""
+        max_bytes = self.max_bytes
+        with self.lock:
+            for note, fragment in items:
+                self.remove(note.pk)
+                self.entries[note.pk] = (stamp(note), note.category_id, fragment)
+                self.by_category[note.category_id].add(note.pk)
+                self.size += len(fragment.content) + ENTRY_OVERHEAD
+            while self.size > max_bytes and self.entries:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, pk):
+        # Called with the lock held
+        entry = self.entries.pop(pk, None)
+        if entry is not None:
+            self.size -= len(entry[2].content) + ENTRY_OVERHEAD
+            notes = self.by_category[entry[1]]
+            notes.discard(pk)
+            if not notes:
+                del self.by_category[entry[1]]
+
+    def discard_category(self, category_id):
+        with self.lock:
+            for pk in list(self.by_category.get(category_id, ())):
+                self.remove(pk)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.by_category.clear()
+            self.size = 0
+
+
+fragments = FragmentCache()
+stats = CacheStats()
+
+
+def render(child, notes):
+    """The notes rendered by the `child` serializer, as Fragments, serializing only the cache misses"""
+    # Imported here, the renderer module imports this one
+    from .renderers import ORJSONRenderer
+
+    found = [
+        None if getattr(note, '_buffered', False) else fragment
+        for note, fragment in zip(notes, fragments.get_many(notes))
+    ]
+    renderer = ORJSONRenderer()
+    missed = [position for position, fragment in enumerate(found) if fragment is None]
+    for position in missed:
+        found[position] = Fragment(renderer.render(child.to_representation(notes[position])))
+    stats.hits += len(notes) - len(missed)
+    stats.misses += len(missed)
+    fragments.set_many(
+        (notes[position], found[position]) for position in missed if not getattr(notes[position], '_buffered', False)
+    )
+    return found
+
+
+class NoteListSerializer(serializers.ListSerializer):
+    """Renders the notes of lists through the fragment cache"""
+
+    def to_representation(self, data):
+        if not setting('NOTE_FRAGMENT_CACHE_BYTES', DEFAULT_MAX_BYTES):
+            return super().to_representation(data)
+        notes = list(data.all() if hasattr(data, 'all') else data)
+        return render(self.child, notes)
+
+
+@handles_set_based_delete
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def discard_category(sender, instance, **kwargs):
+    # A renamed or recoloured category changes its updated_at, which
+    # already makes its notes' entries stale: free them for the others
+    fragments.discard_category(instance.pk)
@@ -0,0 +1,356 @@
+import codecs
+import csv
+import json
+import os
+import re
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import Q
+from rest_framework import serializers
+from rest_framework.validators import ProhibitSurrogateCharactersValidator
+
+from .caching import invalidate_user
+from .models import Category, Note
+from .sharding import assign_ids
+from .serializers import NoteSerializer
+
+DEFAULT_BATCH_SIZE = 2000
+MAX_REPORTED_ERRORS = 1000
+DEFAULT_IMPORT_COLOUR = '#CCCCCC'
+
+FORMATS = ('ndjson', 'csv', 'markdown')
+EXTENSIONS = {
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+    '.md': 'markdown',
+    '.markdown': 'markdown',
+}
+
+
+def detect_format(filename):
+    """Guess the import format from a file name"""
+    _, ext = os.path.splitext(filename or '')
+    return EXTENSIONS.get(ext.lower())
+
+
+def iter_lines(chunks, encoding='utf-8'):
+    """
+    Decode an iterable of byte chunks into lines, keeping line endings.
+    Lines only end with '\n' (the '\r' of '\r\n' stays with its line):
+    str.splitlines() would also split on characters such as U+2028 or form
+    feeds, which are valid inside JSON strings, CSV fields and notes.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='strict')
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        start = 0
+        while (end := pending.find('\n', start)) != -1:
+            yield pending[start:end + 1]
+            start = end + 1
+        # The rest is an incomplete line
+        pending = pending[start:]
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def parse_ndjson(lines):
+    """Yield one record per non-blank line of newline-delimited JSON"""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield ParseFailure(f"Invalid JSON: {exc}")
+            continue
+        if not isinstance(record, dict):
+            yield ParseFailure("Each line must be a JSON object.")
+            continue
+        yield record
+
+
+def parse_csv(lines):
+    """Yield one record per CSV row, using the header row as keys"""
+    for row in csv.DictReader(lines):
+        # Short rows fill missing columns with None, long rows put the
+        # overflow under a None key
+        if None in row:
+            yield ParseFailure("Row has more columns than the header.")
+            continue
+        yield {key: value for key, value in row.items() if value is not None}
+
+
+def parse_markdown(lines):
+    """
+    Yield one record per note of a Markdown document.
+
+    Every note starts with a level one heading holding its title, optionally
+    followed by ``date:`` and ``category:`` lines. Everything up to the next
+    level one heading is the note content.
+    """
+    record = None
+    body = []
+    in_header = False
+
+    for line in lines:
+        if line.startswith('# '):
+            if record is not None:
+                record['content'] = ''.join(body).strip('\n')
+                yield record
+            record = {'title': line[2:].strip()}
+            body = []
+            in_header = True
+            continue
+        if record is None:
+            # Text before the first heading does not belong to any note
+            continue
+        if in_header:
+            key, sep, value = line.partition(':')
+            if sep and key.strip().lower() in ('date', 'category', 'category_id'):
+                record[key.strip().lower()] = value.strip()
+                continue
+            in_header = False
+            if not line.strip():
+                continue
+        body.append(line)
+
+    if record is not None:
+        record['content'] = ''.join(body).strip('\n')
+        yield record
+
+
+PARSERS = {
+    'ndjson': parse_ndjson,
+    'csv': parse_csv,
+    'markdown': parse_markdown,
+}
+
+
+class SurrogateCharactersValidator(ProhibitSurrogateCharactersValidator):
+    """Same check as DRF's validator, done with a regex instead of a Python loop"""
+    pattern = re.compile('[\ud800-\udfff]')
+
+    def __call__(self, value):
+        match = self.pattern.search(value)
+        if match:
+            message = self.message.format(code_point=ord(match.group()))
+            raise serializers.ValidationError(message, code=self.code)
+
+
+class ParseFailure:
+    """Placeholder for a record that could not be parsed"""
+
+    def __init__(self, message):
+        self.message = message
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.failed = 0
+        self.categories_created = 0
+        self.errors = []
+
+    def add_error(self, row, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'failed': self.failed,
+            'categories_created': self.categories_created,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+class NoteImporter:
+    """
+    Validate and insert notes for a single user in batches.
+
+    Field values go through the same serializer fields as ``NoteSerializer``.
+    Categories are referenced either by ``category_id`` (which must belong
+    to the user) or by ``category`` name, in which case unknown names are
+    created on the fly. Each batch commits in its own transaction, so a
+    large import never holds one long transaction, and its notes are
+    written with ``bulk_create`` inside a savepoint, falling back to row
+    by row inserts to pinpoint the rows failing.
+    """
+
+    def __init__(self, user, batch_size=DEFAULT_BATCH_SIZE, create_categories=True):
+        self.user = user
+        self.batch_size = batch_size
+        self.create_categories = create_categories
+        self.report = ImportReport()
+
+        fields = NoteSerializer().fields
+        self.title_field = fields['title']
+        self.content_field = fields['content']
+        self.date_field = fields['date']
+        for field in (self.title_field, self.content_field):
+            field.validators = [
+                SurrogateCharactersValidator()
+                if isinstance(validator, ProhibitSurrogateCharactersValidator) else validator
+                for validator in field.validators
+            ]
+
+        # Resolved category lookups are kept for the whole import
+        self.category_ids = set()
+        self.category_names = {}
+        # The shard of the user's notes
+        self.using = router.db_for_write(Note, instance=Note(user=user))
+
+    def run(self, records):
+        batch = []
+        for record in records:
+            self.report.rows += 1
+            batch.append((self.report.rows, record))
+            if len(batch) >= self.batch_size:
+                self.commit_batch(batch)
+                batch = []
+        if batch:
+            self.commit_batch(batch)
+        return self.report
+
+    def commit_batch(self, batch):
+        with transaction.atomic(using=self.using):
+            self.process_batch(batch)
+        # bulk_create sends no signals
+        invalidate_user(self.user.pk, using=self.using)
+
+    def process_batch(self, batch):
+        valid = []
+        for row, record in batch:
+            if isinstance(record, ParseFailure):
+                self.report.add_error(row, {'non_field_errors': [record.message]})
+                continue
+            attrs, errors = self.validate_fields(record)
+            if errors:
+                self.report.add_error(row, errors)
+                continue
+            valid.append((row, attrs))
+
+        self.resolve_categories(valid)
+
+        notes = []
+        for row, attrs in valid:
+            category_id, error = self.category_for(attrs)
+            if error:
+                self.report.add_error(row, {'category_id': [error]})
+                continue
+            notes.append((row, Note(
+                title=attrs['title'],
+                content=attrs['content'],
+                date=attrs['date'],
+                category_id=category_id,
+                user=self.user,
+            )))
+
+        self.write(notes)
+
+    def validate_fields(self, record):
+        attrs = {}
+        errors = {}
+        for name, field in (
+            ('title', self.title_field),
+            ('content', self.content_field),
+            ('date', self.date_field),
+        ):
+            try:
+                attrs[name] = field.run_validation(record.get(name, serializers.empty))
+            except serializers.ValidationError as exc:
+                errors[name] = exc.detail
+
+        category_id = record.get('category_id')
+        category = record.get('category')
+        if category_id not in (None, ''):
+            try:
+                attrs['category_id'] = int(category_id)
+            except (TypeError, ValueError):
+                errors['category_id'] = ['Incorrect type. Expected pk value.']
+        elif isinstance(category, str) and category.strip():
+            attrs['category_name'] = category.strip()[:100]
+        else:
+            errors['category_id'] = ['This field is required.']
+        return attrs, errors
+
+    def resolve_categories(self, valid):
+        """Look up every category of the batch in one ownership query"""
+        ids = {attrs['category_id'] for _, attrs in valid if 'category_id' in attrs}
+        names = {attrs['category_name'] for _, attrs in valid if 'category_name' in attrs}
+        ids -= self.category_ids
+        names -= self.category_names.keys()
+        if not ids and not names:
+            return
+
+        lookup = Category.objects.using(self.using).filter(user=self.user)
+        if ids and names:
+            lookup = lookup.filter(Q(id__in=ids) | Q(name__in=names))
+        elif ids:
+            lookup = lookup.filter(id__in=ids)
+        else:
+            lookup = lookup.filter(name__in=names)
+
+        # Order by id so duplicate names resolve to the oldest category
+        for pk, name in lookup.order_by('id').values_list('id', 'name'):
+            self.category_ids.add(pk)
+            self.category_names.setdefault(name, pk)
+
+        missing = names - self.category_names.keys()
+        if missing and self.create_categories:
+            created = [
+                Category(name=name, colour=DEFAULT_IMPORT_COLOUR, user=self.user)
+                for name in sorted(missing)
+            ]
+            assign_ids(created)
+            created = Category.objects.using(self.using).bulk_create(created)
+            for category in created:
+                self.category_ids.add(category.pk)
+                self.category_names[category.name] = category.pk
+            self.report.categories_created += len(created)
+
+    def category_for(self, attrs):
+        if 'category_id' in attrs:
+            if attrs['category_id'] in self.category_ids:
+                return attrs['category_id'], None
+            return None, f'Invalid pk "{attrs["category_id"]}" - object does not exist.'
+        pk = self.category_names.get(attrs['category_name'])
+        if pk is None:
+            return None, f'Unknown category "{attrs["category_name"]}".'
+        return pk, None
+
+    def write(self, notes):
+        if not notes:
+            return
+        try:
+            with transaction.atomic(using=self.using):
+                Note.objects.using(self.using).bulk_create([note for _, note in notes])
+            self.report.created += len(notes)
+            return
+        except IntegrityError:
+            pass
+
+        # Fall back to row-by-row inserts to pinpoint the offending rows
+        for row, note in notes:
+            try:
+                with transaction.atomic(using=self.using):
+                    note.save(using=self.using)
+                self.report.created += 1
+            except IntegrityError as exc:
+                self.report.add_error(row, {'non_field_errors': [str(exc)]})
+
+
+def import_notes(user, chunks, fmt, batch_size=DEFAULT_BATCH_SIZE, create_categories=True):
+    """Import notes for ``user`` from an iterable of byte chunks"""
+    if fmt not in PARSERS:
+        raise ValueError(f'Unsupported import format "{fmt}".')
+    records = PARSERS[fmt](iter_lines(chunks))
+    importer = NoteImporter(user, batch_size=batch_size, create_categories=create_categories)
+    return importer.run(records)
@@ -0,0 +1,147 @@
+"""
+Per-user in-memory indexes kept by each process, such as the title index
+of coreapp.suggest and the similarity index of coreapp.related.
+
+An IndexCache holds the indexes of the most recently used users, built on
+first use. Changes committed by this process are applied to the loaded
+index in place. Every change also increments a per-user version in the
+shared cache, and an index whose version is behind, because another
+process or a set-based write changed the notes, is rebuilt on its next
+use. Indexes are rebuilt after a maximum age in any case, which bounds
+how stale they get when the cache is not shared between processes.
+
+Indexes too slow to build during a request can be built by a thread
+instead, the request getting the stale index, or none, meanwhile.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.db import connections
+
+from .conf import setting
+
+logger = logging.getLogger(__name__)
+
+
+class IndexCache:
+    """
+    The indexes of the most recently used users of this process.
+    `build(user_id, using)` returns a new index, which gets `version` and
+    `built_at` attributes.
+    """
+
+    def __init__(self, name, build, users_setting, default_users, max_age_setting, default_max_age):
+        self.name = name
+        self.build = build
+        self.users_setting = users_setting
+        self.default_users = default_users
+        self.max_age_setting = max_age_setting
+        self.default_max_age = default_max_age
+        self.lock = threading.Lock()
+        self.indexes = OrderedDict()
+        # The threads building indexes, by user
+        self.building = {}
+
+    def version_key(self, user_id):
+        return f'{self.name}:version:{user_id}'
+
+    def version(self, user_id):
+        cache = caches['default']
+        version = cache.get(self.version_key(user_id))
+        if version is None:
+            cache.add(self.version_key(user_id), time.time_ns(), timeout=None)
+            version = cache.get(self.version_key(user_id))
+        return version
+
+    def bump_version(self, user_id):
+        """Increment the version of a user, return the new one or None if it was not set"""
+        try:
+            return caches['default'].incr(self.version_key(user_id))
+        except ValueError:
+            return None
+
+    def clear(self):
+        with self.lock:
+            self.indexes.clear()
+
+    def get(self, user_id, using=None, background=None):
+        """
+        The index of a user, built if missing or stale. When the index is
+        needed and `background(user_id, using)` is true, a thread builds it
+        and the stale index, or None, is returned meanwhile.
+        """
+        version = self.version(user_id)
+        max_age = setting(self.max_age_setting, self.default_max_age)
+        with self.lock:
+            index = self.indexes.get(user_id)
+            if index is not None and index.version == version and time.monotonic() - index.built_at < max_age:
+                self.indexes.move_to_end(user_id)
+                return index
+        if background is not None and background(user_id, using):
+            self.build_in_background(user_id, using, version)
+            return index
+        with self.lock:
+            if index is not None and self.indexes.get(user_id) is index:
+                del self.indexes[user_id]
+        return self.load(user_id, using, version)
+
+    def load(self, user_id, using, version):
+        # Built outside the lock, the version read before the queries covers
+        # any change made while they run
+        index = self.build(user_id, using)
+        index.version = version
+        index.built_at = time.monotonic()
+        with self.lock:
+            self.indexes[user_id] = index
+            self.indexes.move_to_end(user_id)
+            while len(self.indexes) > setting(self.users_setting, self.default_users):
+                self.indexes.popitem(last=False)
+        return index
+
+    def build_in_background(self, user_id, using, version):
+        with self.lock:
+            if user_id in self.building:
+                return
+            # The thread reads the shard of the request
+            context = contextvars.copy_context()
+            thread = threading.Thread(
+                target=context.run, args=(self.load_in_background, user_id, using, version),
+                name=f'{self.name}-index', daemon=True,
+            )
+            self.building[user_id] = thread
+        thread.start()
+
+    def load_in_background(self, user_id, using, version):
+        try:
+            self.load(user_id, using, version)
+        except Exception:
+            logger.exception('Building the %s index of user %s failed', self.name, user_id)
+        finally:
+            with self.lock:
+                del self.building[user_id]
+            # The connections opened by this thread
+            connections.close_all()
+
+    def apply(self, user_id, change):
+        """Apply a committed change of a user's notes to their index, if loaded"""
+        version = self.bump_version(user_id)
+        with self.lock:
+            index = self.indexes.get(user_id)
+            if index is None:
+                return
+            if version is None or version != index.version + 1:
+                # Other processes changed the notes too
+                del self.indexes[user_id]
+                return
+            change(index)
+            index.version = version
+
+    def forget(self, user_id):
+        """Drop the index of a user after a set-based change to their notes"""
+        self.bump_version(user_id)
+        with self.lock:
+            self.indexes.pop(user_id, None)
@@ -0,0 +1,195 @@
+"""
+Background job queue stored in the database.
+
+Tasks are plain functions registered with @task. enqueue() inserts a Job
+row, and workers (`manage.py run_worker`) claim queued jobs by priority
+with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers never wait
+on each other or run a job twice. The claim is also a conditional UPDATE,
+which keeps databases without SKIP LOCKED (SQLite) correct.
+
+A failing job is retried after an exponential backoff until it has used
+max_attempts, then marked failed. Jobs left running by a worker that died
+are queued again once they have been locked for longer than
+JOB_STALE_AFTER seconds.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.db import OperationalError, close_old_connections, transaction
+from django.utils import timezone
+
+from .conf import setting
+from .models import Job
+from .sharding import for_user
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF_BASE = 2.0
+DEFAULT_BACKOFF_MAX = 3600.0
+DEFAULT_STALE_AFTER = 3600.0
+DEFAULT_POLL_INTERVAL = 1.0
+FINISH_RETRIES = 5
+ERROR_LENGTH = 500
+
+tasks = {}
+
+
+def task(name):
+    """Register a function as the task `name`, called with the job payload as keyword arguments"""
+    def register(fn):
+        tasks[name] = fn
+        return fn
+    return register
+
+
+def enqueue(name, payload=None, user=None, priority=0, max_attempts=None, delay=0, using=None):
+    """Queue the task `name` and return its Job"""
+    if name not in tasks:
+        raise KeyError(f'Unknown task "{name}".')
+    return Job.objects.using(using).create(
+        name=name,
+        payload=payload or {},
+        user=user,
+        priority=priority,
+        max_attempts=max_attempts or setting('JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS),
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def backoff(attempts):
+    """Seconds to wait before the next attempt, doubling with every attempt and jittered"""
+    base = setting('JOB_BACKOFF_BASE', DEFAULT_BACKOFF_BASE)
+    delay = min(base * 2 ** (attempts - 1), setting('JOB_BACKOFF_MAX', DEFAULT_BACKOFF_MAX))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim_job(worker, using=None):
+    """Claim the next runnable job for `worker`, or return None"""
+    while True:
+        now = timezone.now()
+        with transaction.atomic(using=using):
+            job = (
+                Job.objects.using(using).select_for_update(skip_locked=True)
+                .filter(status=Job.QUEUED, run_at__lte=now)
+                .order_by('-priority', 'run_at', 'id')
+                .first()
+            )
+            if job is None:
+                return None
+            claimed = Job.objects.using(using).filter(pk=job.pk, status=Job.QUEUED).update(
+                status=Job.RUNNING, attempts=job.attempts + 1, locked_by=worker, locked_at=now
+            )
+        if claimed:
+            job.status, job.attempts, job.locked_by, job.locked_at = Job.RUNNING, job.attempts + 1, worker, now
+            return job
+        # Taken by another worker on a database without row locks, try the next one
+
+
+def finish_job(job, worker, result=None, error=None, using=None):
+    """Record the outcome of a job run by `worker`"""
+    now = timezone.now()
+    mine = Job.objects.using(using).filter(pk=job.pk, status=Job.RUNNING, locked_by=worker)
+    if error is None:
+        changes = {'status': Job.SUCCEEDED, 'result': result, 'error': '', 'finished_at': now}
+    elif job.attempts < job.max_attempts:
+        changes = {'status': Job.QUEUED, 'error': error, 'run_at': now + timedelta(seconds=backoff(job.attempts))}
+    else:
+        changes = {'status': Job.FAILED, 'error': error, 'finished_at': now}
+    changes.update(locked_by='', locked_at=None)
+    # A job requeued as stale meanwhile belongs to another worker now
+    mine.update(**changes)
+    for field, value in changes.items():
+        setattr(job, field, value)
+
+
+def requeue_stale_jobs(using=None):
+    """Queue again the jobs whose worker stopped without finishing them"""
+    cutoff = timezone.now() - timedelta(seconds=setting('JOB_STALE_AFTER', DEFAULT_STALE_AFTER))
+    return Job.objects.using(using).filter(status=Job.RUNNING, locked_at__lt=cutoff).update(
+        status=Job.QUEUED, locked_by='', locked_at=None, run_at=timezone.now()
+    )
+
+
+def error_summary(exc):
+    """The error stored on a job and shown to its user, the traceback is only logged"""
+    summary = f'{type(exc).__name__}: {exc}'
+    return summary if len(summary) <= ERROR_LENGTH else summary[:ERROR_LENGTH - 1] + '…'
+
+
+def run_job(job, worker, using=None):
+    fn = tasks.get(job.name)
+    try:
+        if fn is None:
+            raise LookupError(f'Unknown task "{job.name}".')
+        # Jobs of a user work on their shard, and are retried while it moves
+        with for_user(job.user_id, writable=True):
+            outcome = {'result': fn(**job.payload)}
+    except Exception as exc:
+        logger.exception('Job %s (%s) failed on attempt %s', job.pk, job.name, job.attempts)
+        outcome = {'error': error_summary(exc)}
+
+    # The work is done, so losing the outcome to a transient database error
+    # would only get the job run again once it is stale
+    for retry in range(FINISH_RETRIES):
+        try:
+            finish_job(job, worker, using=using, **outcome)
+            return
+        except OperationalError:
+            if retry == FINISH_RETRIES - 1:
+                raise
+            time.sleep(0.05 * 2 ** retry)
+
+
+def default_worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+class Worker:
+    """Claim and run jobs until stopped"""
+
+    def __init__(self, name=None, poll_interval=None, using=None):
+        self.name = name or default_worker_name()
+        self.poll_interval = poll_interval if poll_interval is not None else setting('JOB_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+        self.using = using
+        self.stopping = threading.Event()
+        self.processed = 0
+
+    def stop(self):
+        """Finish the current job and return from run()"""
+        self.stopping.set()
+
+    def run_once(self):
+        """Run one job if any is ready, return whether one was"""
+        job = claim_job(self.name, using=self.using)
+        if job is None:
+            return False
+        run_job(job, self.name, using=self.using)
+        self.processed += 1
+        return True
+
+    def run(self, max_jobs=None, exit_when_empty=False):
+        last_stale_check = None
+        while not self.stopping.is_set():
+            if max_jobs is not None and self.processed >= max_jobs:
+                return
+            # Drop connections that broke or outlived CONN_MAX_AGE, like
+            # Django does between requests
+            close_old_connections()
+            try:
+                if last_stale_check is None or time.monotonic() - last_stale_check > self.poll_interval * 60:
+                    requeue_stale_jobs(using=self.using)
+                    last_stale_check = time.monotonic()
+                if self.run_once():
+                    continue
+                if exit_when_empty:
+                    return
+            except OperationalError as exc:
+                # Lost connection or lock contention, try again later
+                logger.warning('Worker %s could not reach the job queue: %s', self.name, exc)
+            self.stopping.wait(self.poll_interval)
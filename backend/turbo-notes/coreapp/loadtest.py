@@ -0,0 +1,368 @@
+"""
+HTTP load generator for the notes API, run by `manage.py loadtest`.
+
+Virtual users send a weighted mix of operations (login, list, filter,
+create, update, delete) to a running server through a small HTTP/1.1
+client on asyncio streams, keeping connections alive like browsers
+behind nginx do. Two ways of driving the load:
+
+- closed loop: each virtual user sends its next request once the previous
+  one answered, optionally after a think time, so the load adapts to the
+  server's speed
+- open loop: requests arrive at a fixed average rate (Poisson arrivals)
+  whatever the server's speed. Latencies are measured from the time a
+  request was due, so a server falling behind shows in the percentiles
+  instead of slowing the load down.
+
+Results hold throughput, latency percentiles and error rates overall and
+per operation, as a dict ready to be written to JSON.
+"""
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from urllib.parse import urlencode, urlsplit
+
+OPERATIONS = ('login', 'list', 'filter', 'create', 'update', 'delete')
+DEFAULT_MIX = {'login': 2, 'list': 40, 'filter': 20, 'create': 15, 'update': 18, 'delete': 5}
+PERCENTILES = (50, 90, 95, 99)
+# Sent again on a fresh connection when a kept-alive one was closed before answering
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def parse_mix(text):
+    """Parse `list=40,create=10` into operation weights"""
+    mix = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f'Unknown operation "{name}", choose from {", ".join(OPERATIONS)}.')
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise ValueError(f'Weight of "{name}" must be a number.')
+        if mix[name] < 0:
+            raise ValueError(f'Weight of "{name}" must not be negative.')
+    if not any(mix.values()):
+        raise ValueError('The mix needs at least one operation with a positive weight.')
+    return mix
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection"""
+
+    def __init__(self, host, port, ssl=False):
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.reader = self.writer = None
+        # Whether the server sent any of the response to the last request
+        self.received = False
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl or None)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method, path, headers=None, body=None):
+        """Send a request and return (status, headers, body), reconnecting once if the server closed"""
+        reused = self.writer is not None
+        try:
+            return await self.exchange(method, path, headers, body)
+        except (ConnectionError, asyncio.IncompleteReadError, ProtocolError):
+            self.close()
+            # Only a server closing an idle connection is retried: once part of the
+            # response came, or for a POST, the request may have had its effect
+            if not reused or self.received or method not in IDEMPOTENT_METHODS:
+                raise
+        return await self.exchange(method, path, headers, body)
+
+    async def exchange(self, method, path, headers, body):
+        if self.writer is None:
+            await self.connect()
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}']
+        for name, value in (headers or {}).items():
+            lines.append(f'{name}: {value}')
+        lines.append(f'Content-Length: {len(body or b"")}')
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        self.received = False
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ProtocolError('Connection closed before the response')
+        self.received = True
+        parts = status_line.split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith(b'HTTP/'):
+            raise ProtocolError(f'Bad status line {status_line!r}')
+        status = int(parts[1])
+
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+            data = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            data = await self.reader.readexactly(int(response_headers['content-length']))
+        elif status in (204, 304) or method == 'HEAD':
+            data = b''
+        else:
+            data = await self.reader.read()
+            self.close()
+
+        if response_headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, response_headers, data
+
+
+class ConnectionPool:
+    """Connections shared by the requests in flight, at most `size` of them"""
+
+    def __init__(self, url, size):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.ssl = parts.scheme == 'https'
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.prefix = parts.path.rstrip('/')
+        self.idle = []
+        self.slots = asyncio.Semaphore(size)
+
+    async def request(self, method, path, headers=None, body=None):
+        async with self.slots:
+            connection = self.idle.pop() if self.idle else Connection(self.host, self.port, self.ssl)
+            try:
+                response = await connection.request(method, self.prefix + path, headers, body)
+            except BaseException:
+                connection.close()
+                raise
+            self.idle.append(connection)
+            return response
+
+    def close(self):
+        for connection in self.idle:
+            connection.close()
+        self.idle.clear()
+
+
+@dataclass
+class VirtualUser:
+    email: str
+    password: str
+    token: str
+    category_ids: list = field(default_factory=list)
+    # Notes created by this user during the run, updated and deleted in turn
+    note_ids: list = field(default_factory=list)
+
+
+class OperationStats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = 0
+
+    def record(self, latency, status):
+        self.latencies.append(latency)
+        self.statuses[str(status)] += 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors += 1
+
+    def summary(self, elapsed):
+        requests = len(self.latencies)
+        return {
+            'requests': requests,
+            'errors': self.errors,
+            'error_rate': self.errors / requests if requests else 0.0,
+            'throughput': requests / elapsed if elapsed else 0.0,
+            'latency_ms': latency_summary(self.latencies),
+            'statuses': dict(sorted(self.statuses.items())),
+        }
+
+
+def latency_summary(latencies):
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    summary = {'mean': sum(ordered) / len(ordered) * 1000}
+    for percentile in PERCENTILES:
+        # Nearest rank
+        rank = max(1, -(-percentile * len(ordered) // 100))
+        summary[f'p{percentile}'] = ordered[rank - 1] * 1000
+    summary['max'] = ordered[-1] * 1000
+    return summary
+
+
+class LoadTest:
+    def __init__(self, url, users, mix=None, mode='closed', duration=10.0, rate=50.0, think_time=0.0,
+                 connections=100, seed=None):
+        if mode not in ('closed', 'open'):
+            raise ValueError('mode must be "closed" or "open".')
+        self.url = url
+        self.users = users
+        self.mix = mix or DEFAULT_MIX
+        self.mode = mode
+        self.duration = duration
+        self.rate = rate
+        self.think_time = think_time
+        self.connections = connections
+        self.random = random.Random(seed)
+        self.stats = {}
+
+    def run(self):
+        return asyncio.run(self.main())
+
+    async def main(self):
+        self.pool = ConnectionPool(self.url, self.connections)
+        try:
+            for user in self.users:
+                await self.load_categories(user)
+            self.stats = {name: OperationStats() for name, weight in self.mix.items() if weight > 0}
+            start = time.perf_counter()
+            if self.mode == 'closed':
+                await self.closed_loop()
+            else:
+                await self.open_loop()
+            elapsed = time.perf_counter() - start
+        finally:
+            self.pool.close()
+        return self.results(elapsed)
+
+    async def closed_loop(self):
+        deadline = time.perf_counter() + self.duration
+
+        async def virtual_user(user):
+            while time.perf_counter() < deadline:
+                await self.send(user, self.pick(), time.perf_counter())
+                if self.think_time:
+                    await asyncio.sleep(self.random.expovariate(1 / self.think_time))
+
+        await asyncio.gather(*(virtual_user(user) for user in self.users))
+
+    async def open_loop(self):
+        start = time.perf_counter()
+        due = start
+        tasks = []
+        while True:
+            due += self.random.expovariate(self.rate)
+            if due > start + self.duration:
+                break
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            tasks.append(asyncio.create_task(self.send(self.random.choice(self.users), self.pick(), due)))
+        await asyncio.gather(*tasks)
+
+    def pick(self):
+        names = list(self.stats)
+        return self.random.choices(names, weights=[self.mix[name] for name in names])[0]
+
+    async def send(self, user, operation, due):
+        try:
+            status = await getattr(self, f'op_{operation}')(user)
+        except (OSError, asyncio.IncompleteReadError, ProtocolError) as exc:
+            status = type(exc).__name__
+        self.stats[operation].record(time.perf_counter() - due, status)
+
+    async def call(self, user, method, path, payload=None, auth=True):
+        headers = {'Accept': 'application/json'}
+        if auth:
+            headers['Authorization'] = f'Bearer {user.token}'
+        body = None
+        if payload is not None:
+            headers['Content-Type'] = 'application/json'
+            body = json.dumps(payload).encode()
+        status, _, data = await self.pool.request(method, path, headers, body)
+        return status, data
+
+    async def load_categories(self, user):
+        status, data = await self.call(user, 'GET', '/api/categories/')
+        if status == 200:
+            user.category_ids = [category['id'] for category in json.loads(data)['results']]
+
+    def note_payload(self, user):
+        n = self.random.randrange(1_000_000)
+        return {
+            'title': f'Load test note {n}',
+            'content': f'Written by the load test. {n} ' * self.random.randint(1, 20),
+            'date': f'2024-{self.random.randint(1, 12):02}-{self.random.randint(1, 28):02}',
+            'category_id': self.random.choice(user.category_ids) if user.category_ids else None,
+        }
+
+    async def op_login(self, user):
+        status, data = await self.call(
+            user, 'POST', '/api/token/', {'email': user.email, 'password': user.password}, auth=False
+        )
+        if status == 200:
+            user.token = json.loads(data)['access']
+        return status
+
+    async def op_list(self, user):
+        return (await self.call(user, 'GET', '/api/notes/'))[0]
+
+    async def op_filter(self, user):
+        params = {'ordering': self.random.choice(['-date', '-updated_at', 'title'])}
+        if user.category_ids and self.random.random() < 0.5:
+            params['category'] = self.random.choice(user.category_ids)
+        else:
+            params['date_from'] = f'2024-{self.random.randint(1, 12):02}-01'
+        return (await self.call(user, 'GET', f'/api/notes/?{urlencode(params)}'))[0]
+
+    async def op_create(self, user):
+        status, data = await self.call(user, 'POST', '/api/notes/', self.note_payload(user))
+        if status == 201:
+            user.note_ids.append(json.loads(data)['id'])
+        return status
+
+    async def op_update(self, user):
+        if not user.note_ids:
+            return await self.op_create(user)
+        note_id = self.random.choice(user.note_ids)
+        return (await self.call(user, 'PUT', f'/api/notes/{note_id}/', self.note_payload(user)))[0]
+
+    async def op_delete(self, user):
+        if not user.note_ids:
+            return await self.op_create(user)
+        note_id = user.note_ids.pop(self.random.randrange(len(user.note_ids)))
+        return (await self.call(user, 'DELETE', f'/api/notes/{note_id}/'))[0]
+
+    def results(self, elapsed):
+        total = OperationStats()
+        for stats in self.stats.values():
+            total.latencies.extend(stats.latencies)
+            total.statuses.update(stats.statuses)
+            total.errors += stats.errors
+        summary = total.summary(elapsed)
+        return {
+            'url': self.url,
+            'mode': self.mode,
+            'users': len(self.users),
+            'duration': self.duration,
+            'rate': self.rate if self.mode == 'open' else None,
+            'think_time': self.think_time,
+            'mix': self.mix,
+            'elapsed': elapsed,
+            **summary,
+            'operations': {name: stats.summary(elapsed) for name, stats in self.stats.items()},
+        }
@@ -0,0 +1,191 @@
+"""
+Structured logging that never blocks a request on I/O.
+
+RequestLogMiddleware gives every request an id, taken from the
+X-Request-ID header set by nginx or generated, returns it in the response
+and logs one record per request to the `coreapp.requests` logger. Records
+below WARNING of that logger are sampled at LOG_REQUEST_SAMPLE_RATE.
+
+BackgroundHandler only puts records on a bounded queue in the thread
+logging them; a background thread formats them as JSON lines, with the id of
+the request they were logged in, and writes them out. When the writes
+fall behind and the queue holds LOG_QUEUE_SIZE records, new records are
+dropped and counted instead of making requests wait, and a warning with
+the number dropped is logged once the queue has room again.
+"""
+import copy
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+
+DEFAULT_QUEUE_SIZE = 10000
+
+REQUEST_ID_HEADER = 'HTTP_X_REQUEST_ID'
+REQUEST_ID_RE = re.compile(r'^[\w.-]{1,64}$')
+
+# The attributes of every LogRecord, the others were passed in `extra`
+RECORD_ATTRIBUTES = {
+    *logging.LogRecord('', 0, '', 0, '', (), None).__dict__, 'message', 'asctime', 'request_id',
+}
+
+current_request_id = ContextVar('current_request_id', default=None)
+
+request_logger = logging.getLogger('coreapp.requests')
+
+
+class RequestIDFilter(logging.Filter):
+    """Adds the id of the current request to records, in the thread logging them"""
+
+    def filter(self, record):
+        request_id = current_request_id.get()
+        if request_id is None:
+            # Django logs error responses once the middleware returned
+            request_id = getattr(getattr(record, 'request', None), 'request_id', None)
+        record.request_id = request_id
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a `rate` share of the records below WARNING, and every other record"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, with the fields passed in `extra`"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            data['request_id'] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = record.stack_info
+        return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Queues records for a thread writing them to `stream` (stdout by
+    default) as JSON lines. The thread is started on first use in each
+    process, so gunicorn workers forked from a preloaded master get theirs.
+    """
+
+    def __init__(self, stream=None, maxsize=DEFAULT_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        self.maxsize = maxsize
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self.target.setFormatter(JSONFormatter())
+        self.listener = None
+        self.pid = None
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+
+    def start(self):
+        if self.pid != os.getpid():
+            # A forked process has a copy of the queue, but not the thread
+            self.queue = queue.Queue(self.maxsize)
+            self.listener = QueueListener(self.queue, self.target)
+            self.listener.start()
+            self.pid = os.getpid()
+
+    def prepare(self, record):
+        # Only what needs the calling thread: the message arguments and
+        # the exception may change once the call returns
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = self.target.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self.start()
+        try:
+            if self.dropped:
+                with self.dropped_lock:
+                    if self.dropped:
+                        self.queue.put_nowait(logging.makeLogRecord({
+                            'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                            'msg': 'Dropped %s log records, the log output fell behind', 'args': (self.dropped,),
+                            'created': time.time(),
+                        }))
+                        self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+    def flush(self):
+        """Wait until the queued records are written"""
+        if self.listener is not None and self.pid == os.getpid():
+            self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+            self.pid = None
+        super().close()
+
+
+class RequestLogMiddleware:
+    """Sets the request id and logs every request with its status and duration"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.META.get(REQUEST_ID_HEADER, '')
+        if not REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+        token = current_request_id.set(request_id)
+        try:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            response['X-Request-ID'] = request_id
+            user = getattr(request, 'user', None)
+            request_logger.log(
+                logging.ERROR if response.status_code >= 500 else logging.INFO,
+                '%s %s %s', request.method, request.path, response.status_code,
+                extra={
+                    'method': request.method,
+                    'path': request.path,
+                    'status': response.status_code,
+                    'duration_ms': round((time.perf_counter() - start) * 1000, 2),
+                    'user_id': user.pk if user is not None and user.is_authenticated else None,
+                },
+            )
+            return response
+        finally:
+            current_request_id.reset(token)
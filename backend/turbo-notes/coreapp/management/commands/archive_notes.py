@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from coreapp.archive import archive_cold_notes
+from coreapp.jobs import enqueue
+from coreapp.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Move notes not changed for ARCHIVE_AFTER_DAYS to the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive notes not changed for this many days instead')
+        parser.add_argument('--now', action='store_true', help='Archive right away instead of queueing jobs')
+
+    def handle(self, *args, **options):
+        if options['now']:
+            archived = sum(
+                archive_cold_notes(using=alias, days=options['days'], seconds=float('inf'))[0]
+                for alias in shard_aliases()
+            )
+            self.stdout.write(f'Archived {archived} notes')
+            return
+
+        for alias in shard_aliases():
+            job = enqueue('archive_notes', {'shard': alias, 'days': options['days']}, priority=-10)
+            self.stdout.write(f'Queued job {job.pk} archiving the notes of {alias}')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from coreapp.jobs import enqueue
+from coreapp.metadata import backfill_metadata
+from coreapp.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Compute the derived metadata of the notes saved before it was stored'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--now', action='store_true', help='Compute it right away instead of queueing jobs')
+
+    def handle(self, *args, **options):
+        if options['now']:
+            updated = sum(backfill_metadata(using=alias, seconds=float('inf'))[0] for alias in shard_aliases())
+            self.stdout.write(f'Updated {updated} notes')
+            return
+
+        for alias in shard_aliases():
+            job = enqueue('backfill_note_metadata', {'shard': alias}, priority=-10)
+            self.stdout.write(f'Queued job {job.pk} computing the note metadata of {alias}')
@@ -0,0 +1,46 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from coreapp.sharding import shard_aliases
+from coreapp.stats import check_stats, rebuild_stats
+
+MAX_LISTED = 20
+
+
+class Command(BaseCommand):
+    help = 'Compare the precomputed note statistics with the notes table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', help='Only check the statistics of this user')
+        parser.add_argument('--fix', action='store_true', help='Rebuild the statistics of users with drift')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['email']:
+            user_ids = list(User.objects.filter(email=options['email']).values_list('id', flat=True))
+            if not user_ids:
+                raise CommandError(f'No user found with email {options["email"]}')
+
+        mismatches = [
+            (alias, *mismatch) for alias in shard_aliases() for mismatch in check_stats(user_ids, using=alias)
+        ]
+        if not mismatches:
+            self.stdout.write('Note statistics are consistent')
+            return
+
+        for _, (user_id, category_id, day), expected, stored in mismatches[:MAX_LISTED]:
+            self.stdout.write(
+                f'user {user_id} category {category_id} {day}: {stored} counted, {expected} expected'
+            )
+        if len(mismatches) > MAX_LISTED:
+            self.stdout.write(f'... and {len(mismatches) - MAX_LISTED} more')
+
+        if options['fix']:
+            affected = {}
+            for alias, (user_id, _, _), _, _ in mismatches:
+                affected.setdefault(alias, set()).add(user_id)
+            for alias, alias_user_ids in affected.items():
+                rebuild_stats(sorted(alias_user_ids), using=alias)
+            self.stdout.write(f'Rebuilt the statistics of {sum(map(len, affected.values()))} users')
+        else:
+            raise CommandError(f'{len(mismatches)} statistics buckets are inconsistent')
@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from coreapp.deletion import delete_user
+from coreapp.jobs import enqueue
+
+
+class Command(BaseCommand):
+    help = 'Delete a user with all their categories and notes using set-based SQL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', required=True, help='Email of the user to delete')
+        parser.add_argument('--chunk-size', type=int, help='Rows deleted per transaction')
+        parser.add_argument('--background', action='store_true', help='Queue the deletion for a worker')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError(f'No user found with email {options["email"]}')
+
+        if options['background']:
+            job = enqueue('delete_user', {'user_id': user.pk})
+            self.stdout.write(f'Queued job {job.pk}')
+            return
+
+        deleted = delete_user(user, chunk_size=options['chunk_size'])
+        self.stdout.write(f'Deleted {deleted} rows')
@@ -0,0 +1,22 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from coreapp.duplicates import backfill_fingerprints
+from coreapp.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Compute the near-duplicate fingerprints of the notes that have none yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', help='Only fingerprint the notes of this user')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['email']:
+            user_ids = list(User.objects.filter(email=options['email']).values_list('id', flat=True))
+            if not user_ids:
+                raise CommandError(f'No user found with email {options["email"]}')
+
+        notes = sum(backfill_fingerprints(user_ids, using=alias) for alias in shard_aliases())
+        self.stdout.write(f'Fingerprinted {notes} notes')
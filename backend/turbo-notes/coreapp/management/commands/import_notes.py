@@ -0,0 +1,62 @@
+import json
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from coreapp.importers import DEFAULT_BATCH_SIZE, FORMATS, detect_format, import_notes
+from coreapp.sharding import ShardMoving, for_user
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Command(BaseCommand):
+    help = 'Bulk import notes for a user from an NDJSON, CSV or Markdown file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for stdin')
+        parser.add_argument('--email', required=True, help='Email of the user owning the notes')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            '--no-create-categories',
+            action='store_true',
+            help='Reject rows naming an unknown category instead of creating it',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError(f'No user found with email {options["email"]}')
+
+        fmt = options['format'] or detect_format(options['path'])
+        if fmt is None:
+            raise CommandError('Could not detect the file format, pass --format')
+
+        if options['path'] == '-':
+            report = self.run_import(user, sys.stdin.buffer, fmt, options)
+        else:
+            try:
+                with open(options['path'], 'rb') as stream:
+                    report = self.run_import(user, stream, fmt, options)
+            except OSError as exc:
+                raise CommandError(str(exc))
+
+        self.stdout.write(json.dumps(report.as_dict(), indent=2, default=str))
+
+    def run_import(self, user, stream, fmt, options):
+        chunks = iter(lambda: stream.read(CHUNK_SIZE), b'')
+        try:
+            with for_user(user, writable=True):
+                return import_notes(
+                    user,
+                    chunks,
+                    fmt,
+                    batch_size=options['batch_size'],
+                    create_categories=not options['no_create_categories'],
+                )
+        except UnicodeDecodeError:
+            raise CommandError('File must be UTF-8 encoded')
+        except ShardMoving:
+            raise CommandError('The notes of this user are being moved to another shard, try again later')
@@ -0,0 +1,109 @@
+import json
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from coreapp.loadtest import DEFAULT_MIX, LoadTest, VirtualUser, parse_mix
+from coreapp.models import Category
+from coreapp.sharding import for_user
+
+DEFAULT_CATEGORIES = [("Random Thoughts", "#EF9C66"), ("School", "#FCDC94"), ("Personal", "#78ABA8")]
+
+
+class Command(BaseCommand):
+    help = 'Send a mix of API requests from many virtual users to a running server and report the latencies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:7777', help='Server to load, nginx by default')
+        parser.add_argument('--users', type=int, default=10, help='Number of virtual users')
+        parser.add_argument('--mode', choices=['closed', 'open'], default='closed',
+                            help='closed: users wait for each answer; open: requests arrive at --rate')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to send requests for')
+        parser.add_argument('--rate', type=float, default=50, help='Requests per second in open loop mode')
+        parser.add_argument('--think-time', type=float, default=0,
+                            help='Mean pause in seconds between the requests of a user in closed loop mode')
+        parser.add_argument('--connections', type=int, default=100, help='Most connections open at once')
+        parser.add_argument('--mix', default=','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items()),
+                            help='Weights of the operations, such as list=50,create=10')
+        parser.add_argument('--password', default='Load-test-password-1',
+                            help='Password of the virtual users, used by the login operation')
+        parser.add_argument('--seed', type=int, help='Seed of the random choices, for repeatable runs')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if options['users'] < 1:
+            raise CommandError('--users must be at least 1')
+
+        # Tokens are signed here, the server must share SECRET_KEY and the
+        # database with this command
+        lifetime = timedelta(seconds=options['duration'] + 600)
+        users = [
+            VirtualUser(email=user.email, password=options['password'], token=self.token(user, lifetime))
+            for user in self.accounts(options['users'], options['password'])
+        ]
+
+        test = LoadTest(
+            options['url'], users, mix=mix, mode=options['mode'], duration=options['duration'],
+            rate=options['rate'], think_time=options['think_time'], connections=options['connections'],
+            seed=options['seed'],
+        )
+        try:
+            results = test.run()
+        except OSError as exc:
+            raise CommandError(f'Could not reach {options["url"]}: {exc}')
+
+        self.print_results(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def accounts(self, count, password):
+        """The virtual users' accounts, created with the registration's categories when missing"""
+        accounts = []
+        for n in range(count):
+            email = f'loadtest-{n}@example.com'
+            user = User.objects.filter(email=email).first()
+            if user is None:
+                user = User.objects.create_user(username=email, email=email, password=password)
+                with for_user(user, writable=True):
+                    for name, colour in DEFAULT_CATEGORIES:
+                        Category.objects.create(user=user, name=name, colour=colour)
+            elif not user.check_password(password):
+                user.set_password(password)
+                user.save(update_fields=['password'])
+            accounts.append(user)
+        return accounts
+
+    def token(self, user, lifetime):
+        token = AccessToken.for_user(user)
+        token.set_exp(lifetime=lifetime)
+        return str(token)
+
+    def print_results(self, results):
+        self.stdout.write(
+            f'{results["mode"]} loop, {results["users"]} users, {results["elapsed"]:.1f} s: '
+            f'{results["requests"]} requests, {results["throughput"]:.1f}/s, '
+            f'{results["error_rate"]:.2%} errors'
+        )
+        header = f'{"operation":<10}{"requests":>10}{"errors":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}'
+        self.stdout.write(header)
+        for name, stats in [('all', results), *results['operations'].items()]:
+            latency = stats['latency_ms']
+            self.stdout.write(
+                f'{name:<10}{stats["requests"]:>10}{stats["errors"]:>8}'
+                + ''.join(f'{latency.get(key, 0):>10.1f}' for key in ('p50', 'p95', 'p99', 'max'))
+            )
+        statuses = ', '.join(f'{status}: {count}' for status, count in results['statuses'].items())
+        self.stdout.write(f'Statuses: {statuses}')
+        if '429' in results['statuses']:
+            self.stdout.write(
+                'Some requests were rate limited: raise THROTTLE_RATE_AUTH and THROTTLE_RATE_WRITE '
+                'on the server to measure it without the limits.'
+            )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from coreapp.models import Note, NoteRevision
+from coreapp.revisions import compact_revisions, prune_revisions
+from coreapp.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Apply the NOTE_REVISIONS retention policy to every note with history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--compact',
+            action='store_true',
+            help='Also thin out old history to one revision per day',
+        )
+
+    def handle(self, *args, **options):
+        pruned = compacted = notes = 0
+        for alias in shard_aliases():
+            note_ids = (
+                NoteRevision.objects.using(alias).values_list('note_id', flat=True).distinct().order_by('note_id')
+            )
+            for note in Note.objects.using(alias).filter(pk__in=list(note_ids)).iterator(chunk_size=500):
+                notes += 1
+                pruned += prune_revisions(note)
+                if options['compact']:
+                    compacted += compact_revisions(note)
+
+        self.stdout.write(f'{notes} notes: {pruned} revisions pruned, {compacted} compacted away')
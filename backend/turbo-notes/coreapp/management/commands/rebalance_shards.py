@@ -0,0 +1,53 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from coreapp.sharding import misplaced_users, move_user, shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Move users to the shard the hash ring places them on, or one user to a given shard'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', help='Only move this user')
+        parser.add_argument('--to', dest='target', help='Shard to move the user given with --email to')
+        parser.add_argument('--limit', type=int, help='Move at most this many users')
+        parser.add_argument('--dry-run', action='store_true', help='List the moves without making them')
+        parser.add_argument('--grace', type=float, help='Seconds to let running writes finish before the final copy')
+
+    def handle(self, *args, **options):
+        if options['target'] and not options['email']:
+            raise CommandError('--to needs --email')
+
+        if options['email']:
+            try:
+                user = User.objects.get(email=options['email'])
+            except User.DoesNotExist:
+                raise CommandError(f'No user found with email {options["email"]}')
+            if options['target'] is None:
+                moves = [(user_id, shard, wanted) for user_id, shard, wanted in misplaced_users() if user_id == user.pk]
+            else:
+                if options['target'] not in shard_aliases():
+                    raise CommandError(f'Unknown shard "{options["target"]}", choose one of: {", ".join(shard_aliases())}')
+                moves = [(user.pk, None, options['target'])]
+        else:
+            moves = misplaced_users()
+
+        moved = 0
+        for user_id, shard, target in moves:
+            if options['limit'] is not None and moved >= options['limit']:
+                break
+            if options['dry_run']:
+                self.stdout.write(f'user {user_id}: {shard} -> {target}')
+                moved += 1
+                continue
+            try:
+                rows = move_user(user_id, target, grace=options['grace'])
+            except ImproperlyConfigured as exc:
+                raise CommandError(str(exc))
+            if rows:
+                self.stdout.write(f'user {user_id}: moved {rows} rows to {target}')
+                moved += 1
+
+        action = 'would move' if options['dry_run'] else 'moved'
+        self.stdout.write(f'{moved} users {action}')
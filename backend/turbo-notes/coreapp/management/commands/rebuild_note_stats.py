@@ -0,0 +1,22 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from coreapp.sharding import shard_aliases
+from coreapp.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed note statistics from the notes table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', help='Only rebuild the statistics of this user')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['email']:
+            user_ids = list(User.objects.filter(email=options['email']).values_list('id', flat=True))
+            if not user_ids:
+                raise CommandError(f'No user found with email {options["email"]}')
+
+        buckets = sum(rebuild_stats(user_ids, using=alias) for alias in shard_aliases())
+        self.stdout.write(f'Rebuilt {buckets} statistics buckets')
@@ -0,0 +1,32 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from coreapp.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', help='Worker name recorded on claimed jobs, defaults to host:pid:thread')
+        parser.add_argument('--poll-interval', type=float, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--max-jobs', type=int, help='Exit after running this many jobs')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        worker = Worker(name=options['name'], poll_interval=options['poll_interval'])
+
+        # supervisord stops programs with SIGTERM, let the current job finish
+        def stop(signum, frame):
+            worker.stop()
+
+        previous = {signum: signal.signal(signum, stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+
+        self.stdout.write(f'Worker {worker.name} started')
+        try:
+            worker.run(max_jobs=options['max_jobs'], exit_when_empty=options['burst'])
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(f'Worker {worker.name} stopped after {worker.processed} jobs')
@@ -0,0 +1,50 @@
+"""
+Backfill of the metadata derived from note contents.
+
+Notes compute their character and word counts, preview, content hash and
+checklist flag whenever their content is saved, see Note. Notes and
+archived notes saved before these columns existed have a blank
+content_hash; the `backfill_note_metadata` background job, queued by the
+migration following the one adding them, computes theirs in batches and
+queues its own continuation when it runs out of time.
+"""
+import time
+
+from django.db import router, transaction
+
+from .models import METADATA_FIELDS, ArchivedNote, Note, content_metadata
+
+BATCH_SIZE = 500
+JOB_SECONDS = 60
+
+
+def backfill_batch(queryset, using, batch_size):
+    """Compute the metadata of one batch of rows, return how many"""
+    with transaction.atomic(using=using):
+        # Rows being saved right now get theirs from the save
+        rows = list(
+            queryset.select_for_update(skip_locked=True, of=('self',))
+            .filter(content_hash='').order_by('pk')[:batch_size]
+        )
+        for row in rows:
+            for field, value in content_metadata(row.content).items():
+                setattr(row, field, value)
+        # No save(), the notes keep their updated_at
+        queryset.model.objects.using(using).bulk_update(rows, METADATA_FIELDS)
+    return len(rows)
+
+
+def backfill_metadata(using=None, seconds=None, batch_size=BATCH_SIZE):
+    """
+    Compute the metadata of the notes and archived notes that have none yet,
+    for up to `seconds`. Returns (updated, whether rows are left).
+    """
+    using = using or router.db_for_write(Note)
+    deadline = time.monotonic() + (seconds or JOB_SECONDS)
+    updated = 0
+    for queryset in (Note.objects.using(using).with_content(), ArchivedNote.objects.using(using)):
+        while count := backfill_batch(queryset, using, batch_size):
+            updated += count
+            if time.monotonic() > deadline:
+                return updated, True
+    return updated, False
@@ -0,0 +1,193 @@
+import hashlib
+import zlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from .conf import setting
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_LEVELS = {'zstd': 3, 'br': 4, 'gzip': 6}
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml')
+
+
+class GzipCodec:
+    name = 'gzip'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compressor(self):
+        # wbits=31 writes a gzip header with a zero mtime, like Django's
+        # compress_string
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress, compressor.flush
+
+    def compress(self, data):
+        compress, finish = self.compressor()
+        return compress(data) + finish()
+
+
+class BrotliCodec:
+    name = 'br'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compressor(self):
+        compressor = brotli.Compressor(quality=self.level)
+        return compressor.process, compressor.finish
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.level)
+
+
+class ZstdCodec:
+    name = 'zstd'
+
+    def __init__(self, level):
+        self.level = level
+        self.zstd = zstandard.ZstdCompressor(level=level)
+
+    def compressor(self):
+        compressor = self.zstd.compressobj()
+        return compressor.compress, compressor.flush
+
+    def compress(self, data):
+        return self.zstd.compress(data)
+
+
+def compress_stream(codec, chunks):
+    compress, finish = codec.compressor()
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+async def acompress_stream(codec, chunks):
+    compress, finish = codec.compressor()
+    async for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def available_codecs(levels=None):
+    """Return the usable codecs in server preference order"""
+    levels = {**DEFAULT_LEVELS, **(levels or {})}
+    codecs = []
+    if zstandard is not None:
+        codecs.append(ZstdCodec(levels['zstd']))
+    if brotli is not None:
+        codecs.append(BrotliCodec(levels['br']))
+    codecs.append(GzipCodec(levels['gzip']))
+    return codecs
+
+
+def parse_accept_encoding(header):
+    """Parse an Accept-Encoding header into a {coding: qvalue} dict"""
+    accepted = {}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_codec(codecs, header):
+    """Pick the codec with the highest qvalue, preferring earlier codecs on ties"""
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for codec in codecs:
+        q = accepted.get(codec.name, wildcard)
+        if q > best_q:
+            best, best_q = codec, q
+    return best
+
+
+def content_etag(content):
+    return '"%s"' % hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compress responses with the best encoding the client accepts.
+
+    zstd and brotli are used when their packages are installed, gzip is
+    always available. Responses shorter than COMPRESSION_MIN_SIZE are left
+    alone, streaming responses are compressed chunk by chunk.
+
+    Unlike GZipMiddleware, complete GET responses get a strong ETag computed
+    over the uncompressed body. It is the same whatever the encoding, so
+    conditional requests keep matching when clients switch encodings.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.min_size = setting('COMPRESSION_MIN_SIZE', DEFAULT_MIN_SIZE)
+        self.codecs = available_codecs(setting('COMPRESSION_LEVELS', None))
+
+    def process_response(self, request, response):
+        if not response.streaming and request.method in ('GET', 'HEAD') and response.status_code == 200:
+            if not response.has_header('ETag'):
+                response.headers['ETag'] = content_etag(response.content)
+            conditional = get_conditional_response(
+                request, etag=response.headers['ETag'], response=response
+            )
+            if conditional is not response:
+                patch_vary_headers(conditional, ('Accept-Encoding',))
+                return conditional
+
+        if response.has_header('Content-Encoding'):
+            return response
+        if not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        codec = choose_codec(self.codecs, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if codec is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_stream(codec, response.streaming_content)
+            else:
+                response.streaming_content = compress_stream(codec, response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            compressed = codec.compress(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        response.headers['Content-Encoding'] = codec.name
+        return response
@@ -0,0 +1,74 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:34
+
+import coreapp.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def move_content_to_body(apps, schema_editor):
+    Note = apps.get_model('coreapp', 'Note')
+    NoteBody = apps.get_model('coreapp', 'NoteBody')
+    db = schema_editor.connection.alias
+
+    batch = []
+    rows = Note.objects.using(db).values_list('id', 'content').order_by('id')
+    for note_id, content in rows.iterator(chunk_size=BATCH_SIZE):
+        codec, data, size = coreapp.models.encode_body(content)
+        batch.append(NoteBody(note_id=note_id, codec=codec, data=data, size=size))
+        if len(batch) >= BATCH_SIZE:
+            NoteBody.objects.using(db).bulk_create(batch)
+            batch = []
+    if batch:
+        NoteBody.objects.using(db).bulk_create(batch)
+
+
+def move_body_to_content(apps, schema_editor):
+    Note = apps.get_model('coreapp', 'Note')
+    NoteBody = apps.get_model('coreapp', 'NoteBody')
+    db = schema_editor.connection.alias
+
+    batch = []
+    bodies = NoteBody.objects.using(db).values_list('note_id', 'codec', 'data').order_by('note_id')
+    for note_id, codec, data in bodies.iterator(chunk_size=BATCH_SIZE):
+        batch.append(Note(id=note_id, content=coreapp.models.decode_body(codec, data)))
+        if len(batch) >= BATCH_SIZE:
+            Note.objects.using(db).bulk_update(batch, ['content'])
+            batch = []
+    if batch:
+        Note.objects.using(db).bulk_update(batch, ['content'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteBody',
+            fields=[
+                ('note', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='body', serialize=False, to='coreapp.note')),
+                ('codec', models.PositiveSmallIntegerField(choices=[(0, 'Plain'), (1, 'zlib')], default=0)),
+                ('size', models.PositiveIntegerField(default=0, help_text='Length of the uncompressed body in bytes')),
+                ('data', models.BinaryField()),
+            ],
+            options={
+                'verbose_name_plural': 'Note bodies',
+            },
+        ),
+        # A default lets the column be added back to existing rows when
+        # the migration is reversed
+        migrations.AlterField(
+            model_name='note',
+            name='content',
+            field=models.TextField(default=''),
+        ),
+        migrations.RunPython(move_content_to_body, move_body_to_content),
+        migrations.RemoveField(
+            model_name='note',
+            name='content',
+        ),
+    ]
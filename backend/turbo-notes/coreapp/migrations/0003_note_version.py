@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0002_note_body'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='version',
+            field=models.PositiveIntegerField(default=1, help_text='Incremented on every content change'),
+        ),
+    ]
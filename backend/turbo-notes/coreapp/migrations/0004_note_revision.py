@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0003_note_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('kind', models.PositiveSmallIntegerField(choices=[(0, 'Snapshot'), (1, 'Delta')])),
+                ('data', models.BinaryField()),
+                ('size', models.PositiveIntegerField(help_text="Length of the revision's content in characters")),
+                ('saved_at', models.DateTimeField(help_text='When this version of the note was saved')),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='coreapp.note')),
+            ],
+            options={
+                'ordering': ['-version'],
+                'constraints': [models.UniqueConstraint(fields=('note', 'version'), name='unique_note_revision')],
+            },
+        ),
+    ]
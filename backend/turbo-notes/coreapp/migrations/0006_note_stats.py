@@ -0,0 +1,68 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def count_notes(apps, schema_editor):
+    Note = apps.get_model('coreapp', 'Note')
+    NoteStatsBucket = apps.get_model('coreapp', 'NoteStatsBucket')
+    NoteActivity = apps.get_model('coreapp', 'NoteActivity')
+    db = schema_editor.connection.alias
+
+    rows = (
+        Note.objects.using(db).values_list('user_id', 'category_id', 'date')
+        .annotate(count=models.Count('id')).order_by()
+    )
+    NoteStatsBucket.objects.using(db).bulk_create(
+        [
+            NoteStatsBucket(user_id=user_id, category_id=category_id, day=day, count=count)
+            for user_id, category_id, day, count in rows.iterator()
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+    latest = Note.objects.using(db).values_list('user_id').annotate(last=models.Max('updated_at')).order_by()
+    NoteActivity.objects.using(db).bulk_create(
+        [NoteActivity(user_id=user_id, last_activity=last) for user_id, last in latest.iterator()],
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('coreapp', '0005_note_list_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteActivity',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='note_activity', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_activity', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'Note activity',
+            },
+        ),
+        migrations.CreateModel(
+            name='NoteStatsBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='note_stats', to='coreapp.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='note_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'category', 'day'), name='unique_note_stats_bucket')],
+            },
+        ),
+        migrations.RunPython(count_notes, migrations.RunPython.noop),
+    ]
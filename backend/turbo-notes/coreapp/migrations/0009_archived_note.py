@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-19 11:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0008_sharding'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedNote',
+            fields=[
+                ('id', models.BigIntegerField(help_text='Id of the note', primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=200)),
+                ('date', models.DateField()),
+                ('version', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField()),
+                ('codec', models.PositiveSmallIntegerField(choices=[(0, 'Plain'), (1, 'zlib')])),
+                ('data', models.BinaryField()),
+                ('revisions', models.BinaryField(blank=True, help_text="zlib compressed JSON of the note's revisions")),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_notes', to='coreapp.category')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_notes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['user', 'date', 'id'], name='archived_note_user_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-19 11:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0009_archived_note'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteTerms',
+            fields=[
+                ('note', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='terms', serialize=False, to='coreapp.note')),
+                ('counts', models.JSONField(default=dict, help_text='Number of occurrences of the most frequent words')),
+            ],
+            options={
+                'verbose_name_plural': 'Note terms',
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.7 on 2026-10-19 11:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0010_note_terms'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteFingerprint',
+            fields=[
+                ('note', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='fingerprint', serialize=False, to='coreapp.note')),
+                ('signature', models.BinaryField(blank=True, help_text="The minimum hashes of the content's word pairs")),
+                ('band0', models.PositiveIntegerField(null=True)),
+                ('band1', models.PositiveIntegerField(null=True)),
+                ('band2', models.PositiveIntegerField(null=True)),
+                ('band3', models.PositiveIntegerField(null=True)),
+                ('band4', models.PositiveIntegerField(null=True)),
+                ('band5', models.PositiveIntegerField(null=True)),
+                ('band6', models.PositiveIntegerField(null=True)),
+                ('band7', models.PositiveIntegerField(null=True)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='note_fingerprints', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'band0'], name='note_fingerprint_band0_idx'), models.Index(fields=['user', 'band1'], name='note_fingerprint_band1_idx'), models.Index(fields=['user', 'band2'], name='note_fingerprint_band2_idx'), models.Index(fields=['user', 'band3'], name='note_fingerprint_band3_idx'), models.Index(fields=['user', 'band4'], name='note_fingerprint_band4_idx'), models.Index(fields=['user', 'band5'], name='note_fingerprint_band5_idx'), models.Index(fields=['user', 'band6'], name='note_fingerprint_band6_idx'), models.Index(fields=['user', 'band7'], name='note_fingerprint_band7_idx')],
+            },
+        ),
+    ]
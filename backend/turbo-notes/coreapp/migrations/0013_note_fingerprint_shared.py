@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-19 13:05
+
+from django.db import migrations, models
+
+BANDS = 8
+
+
+def mark_shared(apps, schema_editor):
+    NoteFingerprint = apps.get_model('coreapp', 'NoteFingerprint')
+    db = schema_editor.connection.alias
+    fingerprints = NoteFingerprint.objects.using(db)
+    for band in range(BANDS):
+        field = f'band{band}'
+        # One UPDATE per band, each row looked up in the (user, band) index
+        same_band = fingerprints.filter(
+            user_id=models.OuterRef('user_id'), **{field: models.OuterRef(field)}
+        ).exclude(note_id=models.OuterRef('note_id'))
+        fingerprints.filter(
+            models.Exists(same_band), **{f'{field}__isnull': False}, shared=False
+        ).update(shared=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0012_note_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notefingerprint',
+            name='shared',
+            field=models.BooleanField(default=False, help_text='Shares a band with another note of the user'),
+        ),
+        migrations.AddIndex(
+            model_name='notefingerprint',
+            index=models.Index(fields=['user', 'shared'], name='note_fingerprint_shared_idx'),
+        ),
+        migrations.RunPython(mark_shared, migrations.RunPython.noop),
+    ]
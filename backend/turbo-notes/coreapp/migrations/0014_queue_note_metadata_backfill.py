@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-19 15:20
+
+from django.db import DEFAULT_DB_ALIAS, migrations
+from django.utils import timezone
+
+
+def queue_backfill(apps, schema_editor):
+    # The notes saved before 0012 show no metadata until the backfill job
+    # ran: queue it for the database migrated, on the default database
+    # the workers poll
+    db = schema_editor.connection.alias
+    Note = apps.get_model('coreapp', 'Note')
+    ArchivedNote = apps.get_model('coreapp', 'ArchivedNote')
+    Job = apps.get_model('coreapp', 'Job')
+    if not any(model.objects.using(db).filter(content_hash='').exists() for model in (Note, ArchivedNote)):
+        return
+    Job.objects.using(DEFAULT_DB_ALIAS).create(
+        name='backfill_note_metadata', payload={'shard': db}, priority=-10, run_at=timezone.now(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0013_note_fingerprint_shared'),
+    ]
+
+    operations = [
+        migrations.RunPython(queue_backfill, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,19 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
+import hashlib
 import re
+import zlib
+from collections import namedtuple
+
+from .conf import setting
+
+DEFAULT_BODY_COMPRESSION_THRESHOLD = 1024
+PREVIEW_LENGTH = 200
+
+BODY_PLAIN = 0
+BODY_ZLIB = 1
 
 def validate_hex_color(value):
     if not re.match(r'^#(?:[0-9a-fA-F]{3}){1,2}$', value):
@@ -29,17 +40,472 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+def encode_body(text):
+    """Return the (codec, data, size) to store for a note body"""
+    raw = text.encode('utf-8')
+    threshold = setting('NOTE_BODY_COMPRESSION_THRESHOLD', DEFAULT_BODY_COMPRESSION_THRESHOLD)
+    if len(raw) >= threshold:
+        compressed = zlib.compress(raw)
+        if len(compressed) < len(raw):
+            return BODY_ZLIB, compressed, len(raw)
+    return BODY_PLAIN, raw, len(raw)
+
+
+def decode_body(codec, data):
+    data = bytes(data)
+    if codec == BODY_ZLIB:
+        data = zlib.decompress(data)
+    return data.decode('utf-8')
+
+
+# Checklist items, "[ ] todo" or "- [x] done"
+CHECKLIST_RE = re.compile(r'^\s*(?:[-*+]\s+)?\[[ xX]\]\s', re.MULTILINE)
+# Heading, quote and list markers and emphasis left out of previews
+MARKUP_RE = re.compile(r'^\s*(?:(?:#+|>|[-*+]|\d+[.)])\s+)?(?:\[[ xX]\]\s+)?|[*`~]+', re.MULTILINE)
+
+METADATA_FIELDS = ('char_count', 'word_count', 'preview', 'content_hash', 'has_checklist')
+
+
+def content_metadata(text):
+    """The values of the METADATA_FIELDS derived from a note's content"""
+    plain = ' '.join(MARKUP_RE.sub('', text).split())
+    if len(plain) > PREVIEW_LENGTH:
+        plain = plain[:PREVIEW_LENGTH - 1].rsplit(' ', 1)[0] + '…'
+    return {
+        'char_count': len(text),
+        'word_count': len(text.split()),
+        'preview': plain,
+        'content_hash': hashlib.sha256(text.encode('utf-8')).hexdigest(),
+        'has_checklist': CHECKLIST_RE.search(text) is not None,
+    }
+
+
+StoredContent = namedtuple('StoredContent', ['version', 'updated_at', 'text'])
+
+
+class NoteQuerySet(models.QuerySet):
+    def with_content(self):
+        """Fetch note bodies in the same query"""
+        return self.select_related('body')
+
+    def bulk_create(self, objs, *args, **kwargs):
+        # Imported here, these modules depend on this one
+        from .duplicates import fingerprint_many
+        from .related import notes_changed
+        from .sharding import assign_ids
+        from .stats import record_bulk_create
+        from .suggest import titles_changed
+
+        assign_ids(objs)
+        for note in objs:
+            if note._content is not None:
+                note.set_metadata(note._content)
+        objs = super().bulk_create(objs, *args, **kwargs)
+        bodies = [
+            NoteBody.for_text(note, note._content)
+            for note in objs
+            if note._content is not None and note.pk is not None
+        ]
+        if bodies:
+            NoteBody.objects.using(self.db).bulk_create(bodies, batch_size=kwargs.get('batch_size'))
+            fingerprint_many([(body.note, body.note._content) for body in bodies], using=self.db)
+        record_bulk_create(objs, using=self.db)
+        for user_id in {note.user_id for note in objs}:
+            titles_changed(user_id, using=self.db)
+            notes_changed(user_id, using=self.db)
+        for note in objs:
+            note._content_changed = False
+        return objs
+
+
 class Note(models.Model):
     title = models.CharField(max_length=200)
-    content = models.TextField()
     date = models.DateField()
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='notes')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notes')
+    # Indexed through the composite indexes below, which all lead with user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notes', db_index=False)
+    version = models.PositiveIntegerField(default=1, help_text="Incremented on every content change")
+    # Derived from the content when it is saved, so that lists, filters and
+    # orderings never read the bodies
+    char_count = models.PositiveIntegerField(default=0)
+    word_count = models.PositiveIntegerField(default=0)
+    preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True, help_text="Start of the content as plain text")
+    content_hash = models.CharField(max_length=64, blank=True, help_text="SHA-256 of the content, blank until computed")
+    has_checklist = models.BooleanField(default=False)
     
+    objects = NoteQuerySet.as_manager()
+
+    # The body lives in NoteBody and is only loaded when `content` is read
+    _content = None
+    _content_changed = False
+
     class Meta:
         ordering = ['-date']
+        # One index per list filter and ordering, see coreapp.filters
+        indexes = [
+            models.Index(fields=['user', 'date', 'id'], name='note_user_date_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='note_user_updated_idx'),
+            models.Index(fields=['user', 'title', 'id'], name='note_user_title_idx'),
+            models.Index(fields=['user', 'category', 'date', 'id'], name='note_user_category_idx'),
+            models.Index(fields=['user', 'word_count', 'id'], name='note_user_words_idx'),
+            models.Index(fields=['user', 'char_count', 'id'], name='note_user_chars_idx'),
+            models.Index(fields=['user', 'has_checklist', 'date', 'id'], name='note_user_checklist_idx'),
+            models.Index(fields=['user', 'content_hash'], name='note_user_content_hash_idx'),
+        ]
     
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return self.title
+
+    def set_metadata(self, text):
+        for field, value in content_metadata(text).items():
+            setattr(self, field, value)
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = ''
+            if self.pk is not None:
+                try:
+                    self._content = self.body.text
+                except NoteBody.DoesNotExist:
+                    pass
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+        self._content_changed = True
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        store_body = self._content_changed
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            store_body = store_body and 'content' in update_fields
+            update_fields.discard('content')
+            kwargs['update_fields'] = update_fields
+
+        if not store_body:
+            super().save(*args, **kwargs)
+            return
+
+        self.set_metadata(self._content)
+        if update_fields is not None:
+            update_fields.update(METADATA_FIELDS)
+
+        # Imported here, the revisions module depends on this one
+        from .revisions import record_revision
+
+        using = kwargs.get('using') or router.db_for_write(self.__class__, instance=self)
+        with transaction.atomic(using=using):
+            previous = None if self._state.adding else self.lock_stored_content(using)
+            if previous is not None and previous.text == self._content:
+                # Assigned but unchanged, no new version
+                super().save(*args, **kwargs)
+            else:
+                if previous is not None:
+                    # Bump in SQL so concurrent writers never hand out the same version
+                    self.version = models.F('version') + 1
+                    if update_fields is not None:
+                        update_fields.update(('version', 'updated_at'))
+                super().save(*args, **kwargs)
+                NoteBody.store(self, self._content, created=previous is None)
+                if previous is not None:
+                    self.refresh_from_db(using=using, fields=['version'])
+                    record_revision(self, previous, using=using)
+        self._content_changed = False
+
+    def lock_stored_content(self, using):
+        """Lock the stored row and return its version, timestamp and body"""
+        row = (
+            Note.objects.using(using).select_for_update()
+            .filter(pk=self.pk).values_list('version', 'updated_at').first()
+        )
+        if row is None:
+            return None
+        body = NoteBody.objects.using(using).filter(note_id=self.pk).values_list('codec', 'data').first()
+        return StoredContent(row[0], row[1], decode_body(*body) if body else '')
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        if fields is None or 'content' in fields:
+            self._content = None
+            self._content_changed = False
+        if fields is not None and 'content' in fields:
+            if Note.body.related.is_cached(self):
+                Note.body.related.delete_cached_value(self)
+            fields = [field for field in fields if field != 'content']
+            if not fields:
+                return
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+
+
+class NoteBody(models.Model):
+    """
+    The text of a note, kept out of the note row.
+
+    Listing notes or filtering on their metadata never has to read the
+    bodies, and bodies larger than NOTE_BODY_COMPRESSION_THRESHOLD bytes are
+    stored zlib compressed.
+    """
+    CODEC_CHOICES = [
+        (BODY_PLAIN, 'Plain'),
+        (BODY_ZLIB, 'zlib'),
+    ]
+
+    note = models.OneToOneField(Note, on_delete=models.CASCADE, primary_key=True, related_name='body')
+    codec = models.PositiveSmallIntegerField(choices=CODEC_CHOICES, default=BODY_PLAIN)
+    size = models.PositiveIntegerField(default=0, help_text="Length of the uncompressed body in bytes")
+    data = models.BinaryField()
+
+    class Meta:
+        verbose_name_plural = "Note bodies"
+
+    @property
+    def text(self):
+        return decode_body(self.codec, self.data)
+
+    @classmethod
+    def for_text(cls, note, text):
+        codec, data, size = encode_body(text)
+        return cls(note=note, codec=codec, data=data, size=size)
+
+    @classmethod
+    def store(cls, note, text, created=False):
+        """Write the body of a saved note"""
+        body = cls.for_text(note, text)
+        using = note._state.db
+        if not created:
+            updated = cls.objects.using(using).filter(note_id=note.pk).update(
+                codec=body.codec, data=body.data, size=body.size
+            )
+            if updated:
+                return
+        body.save(using=using, force_insert=True)
+
+
+class NoteRevision(models.Model):
+    """
+    A past version of a note's content.
+
+    Most revisions are stored as a reverse delta: the patch turning the
+    next newer revision (or the current content) back into this one. Every
+    few revisions a full snapshot bounds how many deltas must be applied to
+    rebuild any version, see coreapp.revisions.
+    """
+    SNAPSHOT = 0
+    DELTA = 1
+    KIND_CHOICES = [
+        (SNAPSHOT, 'Snapshot'),
+        (DELTA, 'Delta'),
+    ]
+
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='revisions')
+    version = models.PositiveIntegerField()
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+    data = models.BinaryField()
+    size = models.PositiveIntegerField(help_text="Length of the revision's content in characters")
+    saved_at = models.DateTimeField(help_text="When this version of the note was saved")
+
+    class Meta:
+        ordering = ['-version']
+        constraints = [
+            models.UniqueConstraint(fields=['note', 'version'], name='unique_note_revision'),
+        ]
+
+    def __str__(self):
+        return f'{self.note_id} v{self.version}'
+
+
+class NoteStatsBucket(models.Model):
+    """
+    Number of notes of a user per category and note date.
+
+    Kept up to date as notes are saved and deleted, see coreapp.stats, so
+    statistics are summed over buckets instead of counted over notes.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='note_stats')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='note_stats')
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'category', 'day'], name='unique_note_stats_bucket'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.category_id} {self.day}: {self.count}'
+
+
+class NoteActivity(models.Model):
+    """When a user last created, changed or deleted a note"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='note_activity')
+    last_activity = models.DateTimeField()
+
+    class Meta:
+        verbose_name_plural = "Note activity"
+
+
+class Job(models.Model):
+    """
+    A unit of background work, claimed and run by `manage.py run_worker`.
+
+    See coreapp.jobs for the queue itself.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100, help_text="Name of the registered task to run")
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    priority = models.SmallIntegerField(default=0, help_text="Higher priorities run first")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(help_text="The job is not claimed before this time")
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='jobs', null=True, blank=True, db_index=False
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Serves the claim query of coreapp.jobs.claim_job
+            models.Index(fields=['status', '-priority', 'run_at', 'id'], name='job_claim_idx'),
+            models.Index(fields=['user', '-created_at'], name='job_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
+
+
+class UserShard(models.Model):
+    """
+    The database holding a user's categories and notes, see coreapp.sharding.
+
+    Kept in the default database. `locked` is set while the user's data is
+    being moved to another shard, during which their writes are refused.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='shard')
+    shard = models.CharField(max_length=100, help_text="Database alias")
+    locked = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.shard}'
+
+
+class ShardSequence(models.Model):
+    """
+    Next free primary key of a sharded model, so that rows keep their ids
+    when moved between shards. Ids are handed out in blocks.
+    """
+    name = models.CharField(max_length=100, primary_key=True, help_text="Model label")
+    next_value = models.BigIntegerField()
+
+    def __str__(self):
+        return f'{self.name}: {self.next_value}'
+
+
+class ArchivedNote(models.Model):
+    """
+    A note left unchanged for longer than ARCHIVE_AFTER_DAYS, moved out of
+    the notes table with its body compressed and its revisions packed into
+    one value. It keeps the note's id and is restored as soon as the note
+    is edited, see coreapp.archive.
+    """
+    id = models.BigIntegerField(primary_key=True, help_text="Id of the note")
+    title = models.CharField(max_length=200)
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='archived_notes')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_notes', db_index=False)
+    version = models.PositiveIntegerField()
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField()
+    codec = models.PositiveSmallIntegerField(choices=NoteBody.CODEC_CHOICES)
+    data = models.BinaryField()
+    revisions = models.BinaryField(blank=True, help_text="zlib compressed JSON of the note's revisions")
+    # Copied from the note, see Note
+    char_count = models.PositiveIntegerField(default=0)
+    word_count = models.PositiveIntegerField(default=0)
+    preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    has_checklist = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['-date']
+        indexes = [
+            models.Index(fields=['user', 'date', 'id'], name='archived_note_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return self.title
+
+    @property
+    def content(self):
+        return decode_body(self.codec, self.data)
+
+
+class NoteTerms(models.Model):
+    """
+    How often each word occurs in a note's title and content, kept up to
+    date on save. The related notes index of coreapp.related is built from
+    these rows without reading or tokenizing the bodies.
+    """
+    note = models.OneToOneField(Note, on_delete=models.CASCADE, primary_key=True, related_name='terms')
+    counts = models.JSONField(default=dict, help_text="Number of occurrences of the most frequent words")
+
+    class Meta:
+        verbose_name_plural = "Note terms"
+
+    def __str__(self):
+        return f'{self.note_id}: {len(self.counts)} terms'
+
+
+class NoteFingerprint(models.Model):
+    """
+    The MinHash signature of a note's content, kept up to date on save. Its
+    bands are indexed so that near-duplicates, which very likely share one,
+    are found without comparing every pair of notes, see
+    coreapp.duplicates. The bands are null for notes without words.
+    `shared` is set once another note of the user shares a band, which
+    makes the note a candidate.
+    """
+    note = models.OneToOneField(Note, on_delete=models.CASCADE, primary_key=True, related_name='fingerprint')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='note_fingerprints', db_index=False)
+    signature = models.BinaryField(blank=True, help_text="The minimum hashes of the content's word pairs")
+    band0 = models.PositiveIntegerField(null=True)
+    band1 = models.PositiveIntegerField(null=True)
+    band2 = models.PositiveIntegerField(null=True)
+    band3 = models.PositiveIntegerField(null=True)
+    band4 = models.PositiveIntegerField(null=True)
+    band5 = models.PositiveIntegerField(null=True)
+    band6 = models.PositiveIntegerField(null=True)
+    band7 = models.PositiveIntegerField(null=True)
+    shared = models.BooleanField(default=False, help_text="Shares a band with another note of the user")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', f'band{band}'], name=f'note_fingerprint_band{band}_idx')
+            for band in range(8)
+        ] + [
+            models.Index(fields=['user', 'shared'], name='note_fingerprint_shared_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.note_id}: {bytes(self.signature[:8]).hex()}'
@@ -0,0 +1,118 @@
+"""
+Pagination of the note list, streamed for large pages.
+
+Clients can ask for up to NOTES_MAX_PAGE_SIZE notes per page with
+`page_size`. Pages of at least LIST_STREAMING_THRESHOLD notes are not
+built in memory: the page is read with a server-side cursor (on
+PostgreSQL), LIST_STREAMING_CHUNK_SIZE notes at a time, and each chunk is
+serialized, rendered and sent before the next one is read. The bytes sent
+are the same as those of the paginated response, only the cached response
+and the Content-Length header are missing.
+"""
+from itertools import islice
+
+from django.core.paginator import InvalidPage
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
+
+from .autosave import overlay_many
+from .conf import setting
+from .sharding import for_user
+
+DEFAULT_MAX_PAGE_SIZE = 10000
+DEFAULT_STREAMING_THRESHOLD = 500
+DEFAULT_CHUNK_SIZE = 500
+
+
+class NotePagination(PageNumberPagination):
+    page_size_query_param = 'page_size'
+
+    @property
+    def max_page_size(self):
+        return setting('NOTES_MAX_PAGE_SIZE', DEFAULT_MAX_PAGE_SIZE)
+
+
+def should_stream(view, request):
+    """Whether the page requested is large enough to stream, and rendered as compact JSON"""
+    renderer = getattr(request, 'accepted_renderer', None)
+    if not isinstance(renderer, JSONRenderer) or renderer.get_indent(request.accepted_media_type, {}) is not None:
+        return False
+    page_size = view.paginator.get_page_size(request)
+    return page_size is not None and page_size >= setting('LIST_STREAMING_THRESHOLD', DEFAULT_STREAMING_THRESHOLD)
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def release(objects):
+    """
+    Unlink the instances of a sent chunk from their related objects. A note
+    and the body select_related() attached to it refer to each other, and
+    only the cyclic garbage collector would free them otherwise, after
+    many more chunks were read.
+    """
+    for obj in objects:
+        obj._state.fields_cache.clear()
+
+
+def stream_page(view, request, queryset, load=None):
+    """
+    Answer the requested page of `queryset` as a StreamingHttpResponse.
+    `load` turns a chunk of the queryset's rows into the objects to
+    serialize, for querysets that do not return notes.
+    """
+    paginator = view.paginator
+    page_size = paginator.get_page_size(request)
+    django_paginator = paginator.django_paginator_class(queryset, page_size)
+    page_number = paginator.get_page_number(request, django_paginator)
+    try:
+        paginator.page = django_paginator.page(page_number)
+    except InvalidPage as exc:
+        raise NotFound(paginator.invalid_page_message.format(page_number=page_number, message=str(exc)))
+    paginator.request = request
+
+    renderer = request.accepted_renderer
+    context = {'view': view, 'request': request}
+
+    def render(data):
+        return renderer.render(data, request.accepted_media_type, context)
+
+    # The envelope rendered with no results, split where they go
+    envelope = render({
+        'count': paginator.page.paginator.count,
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link(),
+        'results': [],
+    })
+    head, tail = envelope[:-2], envelope[-2:]
+    rows = paginator.page.object_list
+    chunk_size = setting('LIST_STREAMING_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    # One serializer for every chunk, which renders the notes through
+    # coreapp.fragments
+    serializer = view.get_serializer_class()(many=True, context=view.get_serializer_context())
+    user = request.user
+
+    def content():
+        yield head
+        # Read after the view returned, outside its shard context
+        with for_user(user):
+            separator = b''
+            for chunk in chunks(rows.iterator(chunk_size=chunk_size), chunk_size):
+                objects = overlay_many(load(chunk) if load else chunk)
+                data = serializer.to_representation(objects)
+                release(objects)
+                if data:
+                    # A rendered list, without its brackets
+                    yield separator + render(data)[1:-1]
+                    separator = b','
+        yield tail
+
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type = f'{content_type}; charset={renderer.charset}'
+    return StreamingHttpResponse(content(), content_type=content_type)
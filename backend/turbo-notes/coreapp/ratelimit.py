@@ -0,0 +1,165 @@
+"""
+Rate limiting for the API.
+
+RateLimitThrottle plugs into DRF's throttling: views name a scope in
+`throttle_scope`, the rate of the scope comes from DEFAULT_THROTTLE_RATES
+and every client (user, or IP address when anonymous) gets its own limit
+within the scope. Rates use DRF's "<requests>/<period>" format and allow
+bursts of up to <requests> requests.
+
+Limits are kept by the backend named in RATE_LIMIT_BACKEND:
+
+- LocalBackend (the default) runs GCRA in process memory. It needs a
+  single timestamp per client and no I/O, but each gunicorn worker limits
+  on its own.
+- CacheBackend keeps sliding window counters in the RATE_LIMIT_CACHE
+  cache, shared by every worker using that cache.
+
+Both do a constant amount of work per check.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from .conf import setting
+
+DEFAULT_BACKEND = 'coreapp.ratelimit.LocalBackend'
+DEFAULT_MAX_KEYS = 100000
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+Rate = namedtuple('Rate', ['count', 'period'])
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """Parse a DRF style rate such as "10/min" into a Rate"""
+    count, _, period = rate.partition('/')
+    return Rate(int(count), PERIODS[period[0]])
+
+
+class LocalBackend:
+    """
+    Generic cell rate algorithm in process memory.
+
+    Each client is reduced to its theoretical arrival time: the time at
+    which it would have used up its allowance if requests arrived exactly
+    at the permitted pace. A request is allowed unless that time is more
+    than one period ahead, minus one interval for the request itself.
+    Clients are kept in LRU order and the oldest is forgotten beyond
+    `max_keys`.
+    """
+
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self.arrivals = OrderedDict()
+        self.lock = threading.Lock()
+
+    def hit(self, key, rate):
+        """Count a request, return (allowed, seconds to wait when not)"""
+        interval = rate.period / rate.count
+        tolerance = rate.period - interval
+        now = self.clock()
+        with self.lock:
+            arrival = max(self.arrivals.get(key, now), now)
+            ahead = arrival - now
+            if ahead > tolerance:
+                return False, ahead - tolerance
+            self.arrivals[key] = arrival + interval
+            self.arrivals.move_to_end(key)
+            if len(self.arrivals) > self.max_keys:
+                self.arrivals.popitem(last=False)
+        return True, None
+
+    def reset(self):
+        with self.lock:
+            self.arrivals.clear()
+
+
+class CacheBackend:
+    """
+    Sliding window counters in a Django cache.
+
+    Requests are counted per fixed window of one period. The previous
+    window's count is weighted by how much of it still overlaps the sliding
+    window ending now, which approximates a true sliding window with two
+    counters. Increments are atomic on memcached, Redis and the database
+    cache, concurrent checks may let a few requests over the limit.
+    """
+
+    def __init__(self, cache_alias=None, clock=time.time):
+        self.cache = caches[cache_alias or setting('RATE_LIMIT_CACHE', 'default')]
+        self.clock = clock
+
+    def hit(self, key, rate):
+        now = self.clock()
+        window, elapsed = divmod(now, rate.period)
+        current_key = f'ratelimit:{key}:{int(window)}'
+        previous_key = f'ratelimit:{key}:{int(window) - 1}'
+        counts = self.cache.get_many([current_key, previous_key])
+        current = counts.get(current_key, 0)
+        previous = counts.get(previous_key, 0)
+
+        overlap = 1 - elapsed / rate.period
+        if previous * overlap + current + 1 > rate.count:
+            return False, self.wait(rate, elapsed, current, previous)
+
+        # Kept for two periods, the next window weighs this one
+        if not self.cache.add(current_key, 1, timeout=rate.period * 2):
+            try:
+                self.cache.incr(current_key)
+            except ValueError:
+                # Expired between add and incr
+                self.cache.set(current_key, 1, timeout=rate.period * 2)
+        return True, None
+
+    def wait(self, rate, elapsed, current, previous):
+        """Seconds until the weighted count leaves room for one more request"""
+        room = rate.count - 1 - current
+        if room >= 0 and previous:
+            # The previous window fades out during the current one
+            return max(rate.period * (1 - room / previous) - elapsed, 0)
+        # Wait for the next window, where the current count fades out in turn
+        fade = rate.period * (1 - (rate.count - 1) / current) if current else 0
+        return rate.period - elapsed + max(fade, 0)
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    return import_string(setting('RATE_LIMIT_BACKEND', DEFAULT_BACKEND))()
+
+
+@receiver(setting_changed)
+def reset_backend(**kwargs):
+    if kwargs['setting'] in ('RATE_LIMIT_BACKEND', 'RATE_LIMIT_CACHE'):
+        get_backend.cache_clear()
+
+
+class RateLimitThrottle(BaseThrottle):
+    """Limit the requests of each user or IP address per `throttle_scope` of the view"""
+
+    def allow_request(self, request, view):
+        self.retry_after = None
+        scope = getattr(view, 'throttle_scope', None)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope) if scope else None
+        if rate is None:
+            return True
+
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        allowed, self.retry_after = get_backend().hit(f'{scope}:{ident}', parse_rate(rate))
+        return allowed
+
+    def wait(self):
+        return self.retry_after
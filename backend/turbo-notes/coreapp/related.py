@@ -0,0 +1,243 @@
+"""
+Related notes, by TF-IDF cosine similarity of their titles and contents.
+
+The words of a note's content (stop words and numbers left out) are
+counted when it is saved and stored in NoteTerms, keeping the MAX_TERMS
+most frequent, and the words of its title are added to them with twice
+the weight. Each process keeps a RelatedIndex per user, built from these
+rows and the titles: an inverted index from each word to the notes
+containing it, with the note's log-scaled term frequency. Looking up the
+notes related to one only walks the postings of its QUERY_TERMS most
+distinctive words, so it costs a fraction of the notes of the user.
+
+A note saved by this process is updated in the loaded index in place.
+Other changes rebuild the index on next use, see coreapp.indexcache. The
+indexes of users with more than RELATED_INDEX_SYNC_NOTES notes are built
+in the background, their first lookups finding no related notes or those
+of the stale index.
+Notes without NoteTerms, saved before the table existed or bulk created,
+get theirs when the index is built.
+
+Inverse document frequencies change with every note. The norm of a note
+is computed when it enters the index and all norms are recomputed once
+the number of notes drifted by NORM_REFRESH_RATIO since, so scores stay
+within a few percent of exact cosine similarity.
+"""
+import heapq
+import math
+import re
+from collections import Counter
+
+from django.db import router, transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .conf import setting
+from .deletion import handles_set_based_delete
+from .indexcache import IndexCache
+from .models import Note, NoteTerms
+
+DEFAULT_INDEX_USERS = 100
+DEFAULT_MAX_AGE = 600
+# About a tenth of a second of building
+DEFAULT_SYNC_NOTES = 1000
+DEFAULT_LIMIT = 5
+MAX_LIMIT = 20
+MAX_TERMS = 100
+QUERY_TERMS = 20
+TITLE_WEIGHT = 2
+NORM_REFRESH_RATIO = 0.1
+BACKFILL_BATCH_SIZE = 500
+
+WORD_RE = re.compile(r'[^\W\d_]{2,}')
+STOP_WORDS = frozenset('''
+    about above after again against all also am an and any are as at be because been before being below between
+    both but by can could did do does doing down during each few for from further had has have having he her here
+    hers herself him himself his how if in into is it its itself just me more most my myself no nor not now of off
+    on once only or other our ours ourselves out over own same she should so some such than that the their theirs
+    them themselves then there these they this those through to too under until up very was we were what when
+    where which while who whom why will with would you your yours yourself yourselves
+'''.split())
+
+
+def words(text):
+    return [word for word in WORD_RE.findall(text.casefold()) if word not in STOP_WORDS]
+
+
+def content_counts(content):
+    """The counts of the MAX_TERMS most frequent words of a note's content"""
+    counts = Counter(words(content))
+    # Ties broken by word so the kept terms do not depend on word order
+    return dict(heapq.nsmallest(MAX_TERMS, counts.items(), key=lambda item: (-item[1], item[0])))
+
+
+def document_counts(title, counts):
+    """The term counts of a note, from its title and the counts of its content"""
+    counts = dict(counts)
+    for word in words(title):
+        counts[word] = counts.get(word, 0) + TITLE_WEIGHT
+    return counts
+
+
+class RelatedIndex:
+    """Postings of each term, {term: {note id: log-scaled term frequency}}"""
+
+    def __init__(self, documents):
+        self.terms = {}
+        self.postings = {}
+        self.norms = {}
+        for pk, counts in documents:
+            self.insert(pk, counts)
+        self.refresh_norms()
+
+    def __len__(self):
+        return len(self.terms)
+
+    def idf(self, term):
+        # Smoothed, a term of every note still weighs a little
+        return math.log((1 + len(self.terms)) / (1 + len(self.postings.get(term, ())))) + 1
+
+    def weights(self, frequencies):
+        return {term: tf * self.idf(term) for term, tf in frequencies.items()}
+
+    def norm(self, frequencies):
+        return math.sqrt(sum(weight * weight for weight in self.weights(frequencies).values()))
+
+    def refresh_norms(self):
+        self.norms = {pk: self.norm(frequencies) for pk, frequencies in self.terms.items()}
+        self.norms_size = len(self.terms)
+
+    def insert(self, pk, counts):
+        frequencies = {term: 1 + math.log(count) for term, count in counts.items() if count > 0}
+        self.terms[pk] = frequencies
+        for term, tf in frequencies.items():
+            self.postings.setdefault(term, {})[pk] = tf
+
+    def add(self, pk, counts):
+        self.remove(pk)
+        self.insert(pk, counts)
+        self.norms[pk] = self.norm(self.terms[pk])
+        if abs(len(self.terms) - self.norms_size) > NORM_REFRESH_RATIO * max(self.norms_size, 1):
+            self.refresh_norms()
+
+    def remove(self, pk):
+        frequencies = self.terms.pop(pk, None)
+        if frequencies is None:
+            return
+        self.norms.pop(pk, None)
+        for term in frequencies:
+            postings = self.postings[term]
+            del postings[pk]
+            if not postings:
+                del self.postings[term]
+
+    def similar(self, counts, limit=DEFAULT_LIMIT, exclude=None):
+        """The (id, score) of the `limit` notes most similar to a note with these term counts"""
+        frequencies = {term: 1 + math.log(count) for term, count in counts.items() if count > 0}
+        weights = self.weights(frequencies)
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        if not norm:
+            return []
+        scores = {}
+        for term, weight in heapq.nlargest(QUERY_TERMS, weights.items(), key=lambda item: item[1]):
+            factor = weight * self.idf(term)
+            for pk, tf in self.postings.get(term, {}).items():
+                scores[pk] = scores.get(pk, 0.0) + factor * tf
+        scores.pop(exclude, None)
+        best = heapq.nlargest(limit, ((score / (norm * self.norms[pk]), pk) for pk, score in scores.items()))
+        return [(pk, min(score, 1.0)) for score, pk in best]
+
+
+def backfill_terms(user_id, using=None):
+    """Count the words of the notes of a user that have no NoteTerms yet, return how many"""
+    using = using or router.db_for_write(NoteTerms)
+    notes = Note.objects.using(using).filter(user_id=user_id)
+    # Bodies are only read for the notes missing their counts
+    missing = list(notes.filter(terms__isnull=True).order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(missing), BACKFILL_BATCH_SIZE):
+        batch = notes.filter(pk__in=missing[start:start + BACKFILL_BATCH_SIZE]).with_content()
+        NoteTerms.objects.using(using).bulk_create(
+            [NoteTerms(note_id=note.pk, counts=content_counts(note.content)) for note in batch],
+            ignore_conflicts=True,
+        )
+    return len(missing)
+
+
+def load_terms(user_id, using=None):
+    backfill_terms(user_id, using)
+    rows = NoteTerms.objects.using(using).filter(note__user_id=user_id).values_list('note_id', 'note__title', 'counts')
+    for pk, title, counts in rows.iterator():
+        yield pk, document_counts(title, counts)
+
+
+def build_index(user_id, using=None):
+    return RelatedIndex(load_terms(user_id, using))
+
+
+indexes = IndexCache(
+    'related', build_index, 'RELATED_INDEX_USERS', DEFAULT_INDEX_USERS, 'RELATED_INDEX_MAX_AGE', DEFAULT_MAX_AGE
+)
+
+
+def build_in_background(user_id, using=None):
+    """Whether a user has too many notes to build their index during a request"""
+    notes = Note.objects.using(using).filter(user_id=user_id)
+    return notes.count() > setting('RELATED_INDEX_SYNC_NOTES', DEFAULT_SYNC_NOTES)
+
+
+def related_notes(user, note, limit=DEFAULT_LIMIT):
+    """The notes of `user` most similar to `note`, as a list of {'id', 'title', 'score'}"""
+    index = indexes.get(user.pk, background=build_in_background)
+    if index is None:
+        # Being built
+        return []
+    counts = None
+    if isinstance(note, Note):
+        counts = NoteTerms.objects.filter(note_id=note.pk).values_list('counts', flat=True).first()
+    if counts is None:
+        # An archived note
+        counts = content_counts(note.content)
+    ranked = index.similar(document_counts(note.title, counts), limit, exclude=note.pk)
+    titles = dict(Note.objects.filter(user=user, pk__in=[pk for pk, _ in ranked]).values_list('id', 'title'))
+    return [{'id': pk, 'title': titles[pk], 'score': score} for pk, score in ranked if pk in titles]
+
+
+def notes_changed(user_id, using=None):
+    """Called after set-based writes to a user's notes"""
+    transaction.on_commit(lambda: indexes.forget(user_id), using=using)
+
+
+@receiver(post_init, sender=Note)
+def remember_title(sender, instance, **kwargs):
+    instance._terms_title = instance.__dict__.get('title') if instance.pk is not None else None
+
+
+def stored_counts(pk, using=None):
+    return NoteTerms.objects.using(using).filter(note_id=pk).values_list('counts', flat=True).first() or {}
+
+
+@receiver(post_save, sender=Note)
+def count_terms(sender, instance, created, using=None, update_fields=None, **kwargs):
+    pk, user_id, title = instance.pk, instance.user_id, instance.title
+    # Still set while the save that assigned the content runs
+    if created or instance._content_changed:
+        counts = content_counts(instance.content)
+        NoteTerms.objects.using(using).update_or_create(note_id=pk, defaults={'counts': counts})
+    elif (update_fields is not None and 'title' not in update_fields) or instance._terms_title == title:
+        return
+    else:
+        # Renamed: the content counts are only read if the index is loaded
+        counts = None
+    instance._terms_title = title
+
+    def change(index):
+        index.add(pk, document_counts(title, stored_counts(pk, using) if counts is None else counts))
+
+    transaction.on_commit(lambda: indexes.apply(user_id, change), using=using)
+
+
+@handles_set_based_delete
+@receiver(post_delete, sender=Note)
+def unindex_deleted_note(sender, instance, using=None, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: indexes.apply(instance.user_id, lambda index: index.remove(pk)), using=using)
@@ -0,0 +1,84 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+
+from .fragments import Fragment
+
+ORJSON_OPTIONS = (
+    orjson.OPT_NON_STR_KEYS
+    # Leave these types to DRF's encoder so the output format is unchanged
+    | orjson.OPT_PASSTHROUGH_DATETIME
+    | orjson.OPT_PASSTHROUGH_DATACLASS
+)
+
+
+class FloatFound(Exception):
+    """Raised by the default function when the value it returns holds floats"""
+
+
+def contains_float(data):
+    """Whether a payload holds a float, in its dicts, lists and tuples"""
+    stack = [data]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, float):
+            return True
+        if isinstance(obj, dict):
+            stack.extend(obj)
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+    return False
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    Drop-in replacement for DRF's JSONRenderer backed by orjson.
+
+    The output is byte-for-byte the same as JSONRenderer for the compact,
+    unicode, strict settings DRF uses by default. Anything orjson does not
+    encode natively (dates, datetimes, decimals, lazy strings, querysets, ...)
+    is handed to DRF's encoder, and requests for indented output or for
+    non-default JSON settings fall back to the stdlib implementation.
+    Notes rendered before, see coreapp.fragments, are copied as they are.
+
+    orjson writes floats in a shorter form than Python (0.00001 for 1e-05,
+    1e16 for 1e+16) and NaN and infinities as null, where the strict stdlib
+    encoder raises, so payloads holding floats use the stdlib encoder too.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        renderer_context = renderer_context or {}
+        if (
+            self.ensure_ascii
+            or not self.compact
+            or not self.strict
+            or self.get_indent(accepted_media_type, renderer_context) is not None
+            or contains_float(data)
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        encoder = self.encoder_class()
+
+        def default(obj):
+            if isinstance(obj, Fragment):
+                return orjson.Fragment(obj.content)
+            value = encoder.default(obj)
+            # Decimals become floats, sets tuples that may hold some
+            if contains_float(value):
+                raise FloatFound()
+            return value
+
+        try:
+            ret = orjson.dumps(data, default=default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # Floats, integers beyond 64 bits and other edge cases; let the
+            # stdlib encoder produce its output (or its error)
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Keep the output a strict javascript subset, like JSONRenderer does
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
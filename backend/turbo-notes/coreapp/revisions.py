@@ -0,0 +1,208 @@
+"""
+Note revision history.
+
+Every content change stores the replaced content as a NoteRevision. To
+keep history cheap, revisions are reverse deltas: each one holds the patch
+turning the next newer revision (or the current content) back into itself.
+Whenever SNAPSHOT_INTERVAL - 1 deltas have piled up since the newest
+snapshot, the revision is stored whole instead, so rebuilding any version
+applies fewer than SNAPSHOT_INTERVAL patches.
+
+Old revisions only depend on newer ones, so pruning from the oldest end
+never breaks the chain. Compaction thins out history older than
+COMPACT_AFTER_DAYS to the last revision of each day, re-encoding the
+deltas of the revisions it keeps.
+"""
+import zlib
+from datetime import timedelta
+
+import orjson
+from django.db import transaction
+from django.utils import timezone
+
+from .conf import setting
+from .models import Note, NoteRevision
+from .textpatch import apply_patch, make_patch
+
+DEFAULTS = {
+    'SNAPSHOT_INTERVAL': 20,
+    'MAX_REVISIONS': 1000,
+    'MAX_AGE_DAYS': None,
+    'COMPACT_AFTER_DAYS': 30,
+    # Pruning runs on every PRUNE_EVERY-th version of a note
+    'PRUNE_EVERY': 20,
+}
+
+
+def revision_settings():
+    return {**DEFAULTS, **setting('NOTE_REVISIONS', {})}
+
+
+def encode_snapshot(text):
+    return zlib.compress(text.encode('utf-8'))
+
+
+def encode_delta(ops):
+    return zlib.compress(orjson.dumps(ops))
+
+
+def decode_snapshot(data):
+    return zlib.decompress(bytes(data)).decode('utf-8')
+
+
+def decode_delta(data):
+    return orjson.loads(zlib.decompress(bytes(data)))
+
+
+def revision_row(note_id, version, saved_at, text, newer_text, snapshot):
+    """Build the revision storing `text`, as a delta from `newer_text` unless `snapshot`"""
+    if not snapshot:
+        ops = make_patch(newer_text, text)
+        inserted = sum(len(op) for op in ops if isinstance(op, str))
+        # A delta that rewrites most of the text is no cheaper than a snapshot
+        snapshot = inserted * 2 > len(text)
+    if snapshot:
+        kind, data = NoteRevision.SNAPSHOT, encode_snapshot(text)
+    else:
+        kind, data = NoteRevision.DELTA, encode_delta(ops)
+    return NoteRevision(
+        note_id=note_id, version=version, kind=kind, data=data, size=len(text), saved_at=saved_at
+    )
+
+
+def record_revision(note, previous, using=None):
+    """Store the content `previous` that `note`'s current content replaced"""
+    conf = revision_settings()
+    revisions = NoteRevision.objects.using(using).filter(note_id=note.pk)
+    last_snapshot = (
+        revisions.filter(kind=NoteRevision.SNAPSHOT)
+        .order_by('-version').values_list('version', flat=True).first()
+    ) or 0
+    deltas_since_snapshot = revisions.filter(version__gt=last_snapshot).count()
+
+    revision = revision_row(
+        note.pk,
+        previous.version,
+        previous.updated_at,
+        previous.text,
+        note.content,
+        snapshot=deltas_since_snapshot + 1 >= conf['SNAPSHOT_INTERVAL'],
+    )
+    revision.save(using=using, force_insert=True)
+
+    if conf['PRUNE_EVERY'] and note.version % conf['PRUNE_EVERY'] == 0:
+        prune_revisions(note, using=using)
+    return revision
+
+
+def get_revision_content(note, version, using=None):
+    """
+    Rebuild the content of `note` at `version`.
+
+    Raises NoteRevision.DoesNotExist for versions that were never stored or
+    have been pruned.
+    """
+    if version == note.version:
+        return note.content
+    if version < 1 or version > note.version:
+        raise NoteRevision.DoesNotExist
+
+    window = revision_settings()['SNAPSHOT_INTERVAL']
+    revisions = NoteRevision.objects.using(using or note._state.db).filter(note_id=note.pk)
+    chain = []
+    start = version
+    while not chain or chain[-1][1] != NoteRevision.SNAPSHOT:
+        rows = list(
+            revisions.filter(version__gte=start).order_by('version')
+            .values_list('version', 'kind', 'data')[:window]
+        )
+        if not rows:
+            break
+        for row in rows:
+            chain.append(row)
+            if row[1] == NoteRevision.SNAPSHOT:
+                break
+        start = rows[-1][0] + 1
+
+    if not chain or chain[0][0] != version:
+        raise NoteRevision.DoesNotExist
+
+    if chain[-1][1] == NoteRevision.SNAPSHOT:
+        text = decode_snapshot(chain.pop()[2])
+    else:
+        text = note.content
+    for _, _, data in reversed(chain):
+        text = apply_patch(text, decode_delta(data))
+    return text
+
+
+def prune_revisions(note, using=None):
+    """Drop the oldest revisions beyond MAX_REVISIONS or MAX_AGE_DAYS"""
+    conf = revision_settings()
+    revisions = NoteRevision.objects.using(using or note._state.db).filter(note_id=note.pk)
+    deleted = 0
+
+    if conf['MAX_REVISIONS'] is not None:
+        cutoff = (
+            revisions.order_by('-version').values_list('version', flat=True)
+            [conf['MAX_REVISIONS']:conf['MAX_REVISIONS'] + 1].first()
+        )
+        if cutoff is not None:
+            deleted += revisions.filter(version__lte=cutoff).delete()[0]
+
+    if conf['MAX_AGE_DAYS'] is not None:
+        oldest = timezone.now() - timedelta(days=conf['MAX_AGE_DAYS'])
+        deleted += revisions.filter(saved_at__lt=oldest).delete()[0]
+
+    return deleted
+
+
+def compact_revisions(note, using=None):
+    """
+    Keep only the last revision of each day for history older than
+    COMPACT_AFTER_DAYS, and re-encode the chain of the kept revisions.
+
+    Returns the number of revisions removed.
+    """
+    conf = revision_settings()
+    using = using or note._state.db
+    cutoff = timezone.now() - timedelta(days=conf['COMPACT_AFTER_DAYS'])
+
+    with transaction.atomic(using=using):
+        # Saving a note locks its row too, so no revision is added meanwhile
+        Note.objects.using(using).select_for_update().filter(pk=note.pk).values_list('pk').first()
+        note.refresh_from_db(using=using, fields=['version', 'content'])
+
+        revisions = NoteRevision.objects.using(using).filter(note_id=note.pk)
+        rows = revisions.order_by('-version').values_list('version', 'kind', 'data', 'saved_at')
+
+        kept = []
+        seen_days = set()
+        text = note.content
+        newer_kept_text = text
+        deltas_since_snapshot = 0
+        total = 0
+        for version, kind, data, saved_at in rows.iterator(chunk_size=100):
+            total += 1
+            if kind == NoteRevision.SNAPSHOT:
+                text = decode_snapshot(data)
+            else:
+                text = apply_patch(text, decode_delta(data))
+
+            # Walking from newest to oldest, the first revision seen for a
+            # day is the last one saved that day
+            day = saved_at.date()
+            if saved_at < cutoff and day in seen_days:
+                continue
+            seen_days.add(day)
+
+            snapshot = deltas_since_snapshot + 1 >= conf['SNAPSHOT_INTERVAL']
+            revision = revision_row(note.pk, version, saved_at, text, newer_kept_text, snapshot)
+            deltas_since_snapshot = 0 if revision.kind == NoteRevision.SNAPSHOT else deltas_since_snapshot + 1
+            kept.append(revision)
+            newer_kept_text = text
+
+        revisions.delete()
+        NoteRevision.objects.using(using).bulk_create(kept)
+
+    return total - len(kept)
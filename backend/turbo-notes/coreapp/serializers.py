@@ -3,7 +3,12 @@ from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .models import Category, Note
+from .models import METADATA_FIELDS, Category, Job, Note, NoteRevision
+from .fragments import NoteListSerializer
+from .duplicates import DEFAULT_LIMIT as DUPLICATES_DEFAULT_LIMIT, MAX_LIMIT as DUPLICATES_MAX_LIMIT
+from .related import DEFAULT_LIMIT as RELATED_DEFAULT_LIMIT, MAX_LIMIT as RELATED_MAX_LIMIT
+from .suggest import DEFAULT_LIMIT, MAX_LIMIT
+from .textpatch import PatchError, validate_ops
 
 class CategorySerializer(serializers.ModelSerializer):
     notes_count = serializers.IntegerField(read_only=True)
@@ -29,6 +34,8 @@ class CategoryNestedSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'colour']
 
 class NoteSerializer(serializers.ModelSerializer):
+    # Not a model field, the body is stored in NoteBody
+    content = serializers.CharField(style={'base_template': 'textarea.html'})
     category = CategoryNestedSerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
         write_only=True,
@@ -38,11 +45,14 @@ class NoteSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Note
-        fields = ['id', 'title', 'content', 'date', 'category', 'category_id', 'created_at', 'updated_at']
-        extra_kwargs = {
-            'created_at': {'read_only': True},
-            'updated_at': {'read_only': True},
-        }
+        fields = [
+            'id', 'title', 'content', 'date', 'category', 'category_id', 'version', 'created_at', 'updated_at',
+            'char_count', 'word_count', 'preview', 'content_hash', 'has_checklist',
+        ]
+        # Derived from the content on save, see Note
+        read_only_fields = ['version', 'created_at', 'updated_at', *METADATA_FIELDS]
+        # Lists reuse the JSON of the notes rendered before
+        list_serializer_class = NoteListSerializer
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -50,6 +60,89 @@ class NoteSerializer(serializers.ModelSerializer):
         if user and not user.is_anonymous:
             self.fields['category_id'].queryset = Category.objects.filter(user=user)
 
+class NoteContentPatchSerializer(serializers.Serializer):
+    """An incremental edit of a note's content, see coreapp.textpatch"""
+    base_version = serializers.IntegerField(min_value=1)
+    ops = serializers.ListField(child=serializers.JSONField(), allow_empty=True)
+
+    def validate_ops(self, value):
+        try:
+            validate_ops(value)
+        except PatchError as exc:
+            raise serializers.ValidationError(str(exc))
+        return value
+
+class NoteSuggestQuerySerializer(serializers.Serializer):
+    prefix = serializers.CharField(max_length=200, trim_whitespace=False)
+    limit = serializers.IntegerField(min_value=1, max_value=MAX_LIMIT, default=DEFAULT_LIMIT)
+
+class NoteSuggestionSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+
+class NoteRelatedQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=RELATED_MAX_LIMIT, default=RELATED_DEFAULT_LIMIT)
+
+class RelatedNoteSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+    score = serializers.FloatField()
+
+class NoteDuplicatesQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=DUPLICATES_MAX_LIMIT, default=DUPLICATES_DEFAULT_LIMIT)
+
+class DuplicateClusterSerializer(serializers.Serializer):
+    notes = NoteSuggestionSerializer(many=True)
+
+class NoteVersionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Note
+        fields = ['id', 'version', 'updated_at']
+        read_only_fields = fields
+
+class NoteRevisionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = NoteRevision
+        fields = ['version', 'size', 'saved_at']
+        read_only_fields = fields
+
+class NoteRevisionDetailSerializer(NoteRevisionSerializer):
+    content = serializers.CharField(read_only=True)
+
+    class Meta(NoteRevisionSerializer.Meta):
+        fields = NoteRevisionSerializer.Meta.fields + ['content']
+        read_only_fields = fields
+
+class CategoryCountSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    colour = serializers.CharField()
+    count = serializers.IntegerField()
+
+class MonthCountSerializer(serializers.Serializer):
+    month = serializers.CharField()
+    count = serializers.IntegerField()
+
+class DayCountSerializer(serializers.Serializer):
+    date = serializers.DateField()
+    count = serializers.IntegerField()
+
+class NoteStatsSerializer(serializers.Serializer):
+    total = serializers.IntegerField()
+    last_activity = serializers.DateTimeField(allow_null=True)
+    categories = CategoryCountSerializer(many=True)
+    months = MonthCountSerializer(many=True)
+    days = DayCountSerializer(many=True)
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'name', 'status', 'priority', 'attempts', 'max_attempts',
+            'run_at', 'created_at', 'finished_at', 'result', 'error',
+        ]
+        read_only_fields = fields
+
 class SimpleEmailRegistrationSerializer(serializers.Serializer):
     email = serializers.EmailField(required=True)
     password = serializers.CharField(write_only=True, required=True, validators=[validate_password])
@@ -0,0 +1,385 @@
+"""
+Sharding of users' categories and notes across databases.
+
+Every user's categories, notes and the rows hanging off them live in one of
+the database aliases listed in SHARDS. A directory in the default database
+(UserShard) records each user's shard. New users are placed on a
+consistent hash ring, so adding a shard only moves the users that the ring
+now places there, and `manage.py rebalance_shards` moves them.
+
+ShardRouter sends queries on the sharded models to:
+
+1. the database an instance was loaded from,
+2. the shard activated for the current request or job, see use_shard()
+   and for_user(); the API views activate the shard of the requesting user,
+3. the shard of the instance's user, for new instances.
+
+Outside of these, queries go to the default database. With a single shard,
+the default configuration, the router stays out of the way.
+
+Ids of sharded models come from ShardSequence in the default database, in
+blocks, so that rows keep their ids on every shard.
+"""
+import bisect
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import lru_cache
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import F, Max
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
+
+from .conf import setting
+from .models import (
+    ArchivedNote, Category, Note, NoteActivity, NoteBody, NoteFingerprint, NoteRevision, NoteStatsBucket, NoteTerms,
+    ShardSequence, UserShard,
+)
+
+VIRTUAL_NODES = 64
+DEFAULT_ID_BLOCK_SIZE = 100
+DEFAULT_MOVE_GRACE = 2.0
+SYNC_BATCH_SIZE = 500
+
+# The sharded models, parents first, with the lookup of their user and the
+# fields identifying a row on every shard. Revisions and statistics buckets
+# keep the ids of the shard they are on.
+SHARDED_MODELS = [
+    (Category, 'user_id', ('id',)),
+    (Note, 'user_id', ('id',)),
+    (ArchivedNote, 'user_id', ('id',)),
+    (NoteBody, 'note__user_id', ('note_id',)),
+    (NoteRevision, 'note__user_id', ('note_id', 'version')),
+    (NoteTerms, 'note__user_id', ('note_id',)),
+    (NoteFingerprint, 'user_id', ('note_id',)),
+    (NoteStatsBucket, 'user_id', ('user_id', 'category_id', 'day')),
+    (NoteActivity, 'user_id', ('user_id',)),
+]
+SHARDED = {model for model, _, _ in SHARDED_MODELS}
+
+current_shard = ContextVar('current_shard', default=None)
+
+Placement = namedtuple('Placement', ['shard', 'locked'])
+
+
+def shard_aliases():
+    return setting('SHARDS', [DEFAULT_DB_ALIAS])
+
+
+def is_sharded():
+    return len(shard_aliases()) > 1
+
+
+def hash_key(value):
+    return int.from_bytes(hashlib.md5(str(value).encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring with VIRTUAL_NODES points per shard"""
+
+    def __init__(self, shards, vnodes=VIRTUAL_NODES):
+        points = sorted((hash_key(f'{shard}:{n}'), shard) for shard in shards for n in range(vnodes))
+        self.hashes = [point for point, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def get(self, key):
+        index = bisect.bisect(self.hashes, hash_key(key)) % len(self.hashes)
+        return self.shards[index]
+
+
+@lru_cache(maxsize=8)
+def get_ring(shards):
+    return HashRing(shards)
+
+
+def ring_shard(user_id):
+    """The shard the ring places a user on"""
+    return get_ring(tuple(shard_aliases())).get(user_id)
+
+
+def locate(user_id, assign=True):
+    """
+    Return the Placement of a user's data, placing new users on the ring.
+    Returns None for users without one when `assign` is false.
+    """
+    if not is_sharded():
+        return Placement(DEFAULT_DB_ALIAS, False)
+    directory = UserShard.objects.using(DEFAULT_DB_ALIAS)
+    row = directory.filter(user_id=user_id).values_list('shard', 'locked').first()
+    if row is None:
+        if not assign:
+            return None
+        # Users from before sharding keep their data in the default database
+        has_data = Category.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id).exists()
+        shard = DEFAULT_DB_ALIAS if has_data else ring_shard(user_id)
+        ensure_user(user_id, shard)
+        try:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                directory.create(user_id=user_id, shard=shard)
+        except IntegrityError:
+            # Placed by a concurrent request
+            return locate(user_id)
+        return Placement(shard, False)
+    if row[0] not in shard_aliases():
+        raise ImproperlyConfigured(f'User {user_id} is on the unknown shard "{row[0]}".')
+    return Placement(*row)
+
+
+def shard_for(user_id):
+    return locate(user_id).shard
+
+
+@contextmanager
+def use_shard(alias):
+    """Route the sharded models to `alias` within the block"""
+    token = current_shard.set(alias)
+    try:
+        yield alias
+    finally:
+        current_shard.reset(token)
+
+
+class ShardMoving(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Your notes are being moved, try again in a few seconds.'
+    default_code = 'shard_moving'
+    wait = 5
+
+
+def for_user(user, writable=False):
+    """
+    Route the sharded models to the shard of `user` (a User or id) within
+    the block. Raises ShardMoving if `writable` and the user is being moved.
+    """
+    if user is None or not is_sharded():
+        return nullcontext()
+    placement = locate(getattr(user, 'pk', user))
+    if writable and placement.locked:
+        raise ShardMoving()
+    return use_shard(placement.shard)
+
+
+class ShardRouter:
+    def db_for_write(self, model, **hints):
+        if model not in SHARDED or not is_sharded():
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        shard = current_shard.get()
+        if shard is not None:
+            return shard
+        user_id = getattr(instance, 'user_id', None)
+        if user_id is not None:
+            return shard_for(user_id)
+        return None
+
+    db_for_read = db_for_write
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users live in the default database and are copied to the shards
+        if type(obj1) in SHARDED or type(obj2) in SHARDED:
+            return True
+        return None
+
+
+class ShardedViewMixin:
+    """Serve the requests of a user from their shard, refusing writes while it moves"""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        writable = request.method not in SAFE_METHODS
+        self.shard_context = for_user(request.user if request.user.is_authenticated else None, writable)
+        self.shard_context.__enter__()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        context = getattr(self, 'shard_context', None)
+        if context is not None:
+            context.__exit__(None, None, None)
+            self.shard_context = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class IdAllocator:
+    """Hand out primary keys from blocks reserved in ShardSequence"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.blocks = {}
+
+    def reserve(self, model, size):
+        """Reserve `size` ids and return the first"""
+        sequences = ShardSequence.objects.using(DEFAULT_DB_ALIAS)
+        while True:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                row = sequences.select_for_update().filter(name=model._meta.label).first()
+                if row is not None:
+                    sequences.filter(name=row.name).update(next_value=F('next_value') + size)
+                    return row.next_value
+            # Continue after the rows created before the model was sharded
+            start = max(
+                model._base_manager.using(alias).aggregate(last=Max('pk'))['last'] or 0
+                for alias in shard_aliases()
+            ) + 1
+            try:
+                with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                    sequences.create(name=model._meta.label, next_value=start + size)
+                return start
+            except IntegrityError:
+                # Created concurrently, reserve from it
+                pass
+
+    def allocate(self, model, count):
+        ids = []
+        with self.lock:
+            start, end = self.blocks.get(model, (0, 0))
+            while len(ids) < count:
+                if start >= end:
+                    size = max(setting('SHARD_ID_BLOCK_SIZE', DEFAULT_ID_BLOCK_SIZE), count - len(ids))
+                    start = self.reserve(model, size)
+                    end = start + size
+                taken = min(end - start, count - len(ids))
+                ids.extend(range(start, start + taken))
+                start += taken
+            self.blocks[model] = (start, end)
+        return ids
+
+    def reset(self):
+        with self.lock:
+            self.blocks.clear()
+
+
+allocator = IdAllocator()
+
+
+def assign_ids(objs):
+    """Give new Category and Note instances ids that are unique across shards"""
+    if not is_sharded():
+        return
+    missing = [obj for obj in objs if obj.pk is None]
+    if missing:
+        for obj, pk in zip(missing, allocator.allocate(type(missing[0]), len(missing))):
+            obj.pk = pk
+
+
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=Note)
+def assign_id(sender, instance, raw=False, **kwargs):
+    if not raw and instance._state.adding:
+        assign_ids([instance])
+
+
+def ensure_user(user_id, alias):
+    """Copy the user row to a shard, where the foreign keys of their rows point"""
+    if alias == DEFAULT_DB_ALIAS or User.objects.using(alias).filter(pk=user_id).exists():
+        return
+    user = User.objects.using(DEFAULT_DB_ALIAS).get(pk=user_id)
+    User._base_manager.using(alias)._insert([user], fields=User._meta.local_concrete_fields, raw=True, using=alias)
+
+
+def user_rows(model, lookup, key, user_id, alias):
+    """Map the key of each row of a user to its primary key and field values"""
+    fields = [field for field in model._meta.concrete_fields if field.attname in key or not field.primary_key]
+    names = [field.attname for field in fields]
+    positions = [names.index(name) for name in key]
+    rows = model._base_manager.using(alias).filter(**{lookup: user_id}).values_list('pk', *names)
+    return fields, {
+        tuple(row[1:][position] for position in positions): (row[0], row[1:]) for row in rows.iterator()
+    }
+
+
+def sync_user(user_id, source, target):
+    """
+    Make the rows of a user on `target` equal to those on `source`: insert
+    missing rows, update changed ones and delete the rest, keeping ids and
+    timestamps. Returns the number of rows written.
+    """
+    ensure_user(user_id, target)
+    written = 0
+    stale = []
+    with transaction.atomic(using=target):
+        for model, lookup, key in SHARDED_MODELS:
+            fields, wanted = user_rows(model, lookup, key, user_id, source)
+            _, present = user_rows(model, lookup, key, user_id, target)
+            names = [field.attname for field in fields]
+            queryset = model._base_manager.using(target)
+
+            new = [model(**dict(zip(names, row))) for row_key, (_, row) in wanted.items() if row_key not in present]
+            for start in range(0, len(new), SYNC_BATCH_SIZE):
+                # raw keeps auto_now fields as they are
+                queryset._insert(new[start:start + SYNC_BATCH_SIZE], fields=fields, raw=True, using=target)
+            written += len(new)
+
+            for row_key, (_, row) in wanted.items():
+                if row_key in present and present[row_key][1] != row:
+                    pk, old = present[row_key]
+                    queryset.filter(pk=pk).update(**{
+                        name: value for name, value, previous in zip(names, row, old) if value != previous
+                    })
+                    written += 1
+            stale.append((model, [pk for row_key, (pk, _) in present.items() if row_key not in wanted]))
+
+        # Children first
+        for model, pks in reversed(stale):
+            for start in range(0, len(pks), SYNC_BATCH_SIZE):
+                written += model._base_manager.using(target).filter(
+                    pk__in=pks[start:start + SYNC_BATCH_SIZE]
+                )._raw_delete(target)
+    return written
+
+
+def purge_user(user_id, alias):
+    """Delete the rows of a user from a shard they were moved away from"""
+    deleted = 0
+    with transaction.atomic(using=alias):
+        for model, lookup, _ in reversed(SHARDED_MODELS):
+            deleted += model._base_manager.using(alias).filter(**{lookup: user_id})._raw_delete(alias)
+        if alias != DEFAULT_DB_ALIAS:
+            User._base_manager.using(alias).filter(pk=user_id)._raw_delete(alias)
+    return deleted
+
+
+def move_user(user_id, target, grace=None):
+    """
+    Move a user's data to the `target` shard while it stays readable.
+
+    The rows are copied while the user keeps working, then their writes
+    are refused for the short time it takes to copy what changed
+    meanwhile and switch the directory. Returns the number of rows copied.
+    """
+    if target not in shard_aliases():
+        raise ImproperlyConfigured(f'Unknown shard "{target}".')
+    source = shard_for(user_id)
+    if source == target:
+        return 0
+
+    copied = sync_user(user_id, source, target)
+    directory = UserShard.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id)
+    directory.update(locked=True)
+    try:
+        # Let the writes that passed the lock check finish
+        time.sleep(setting('SHARD_MOVE_GRACE', DEFAULT_MOVE_GRACE) if grace is None else grace)
+        copied += sync_user(user_id, source, target)
+        directory.update(shard=target, locked=False)
+    except BaseException:
+        directory.update(locked=False)
+        raise
+    purge_user(user_id, source)
+    return copied
+
+
+def misplaced_users():
+    """Yield (user_id, shard, ring shard) for the users the ring now places elsewhere"""
+    for user_id, shard in UserShard.objects.using(DEFAULT_DB_ALIAS).order_by('user_id').values_list('user_id', 'shard'):
+        wanted = ring_shard(user_id)
+        if wanted != shard:
+            yield user_id, shard, wanted
@@ -0,0 +1,89 @@
+"""
+Process startup: timings, warm-up and fork handling.
+
+notes.wsgi records how long loading Django and the application took, and
+warms the application up before it serves: the URL resolvers are
+populated, the lazily imported DRF and simplejwt classes are loaded and
+the field map of every serializer is built, so the first request does not
+pay for them.
+
+With gunicorn's preload_app (see gunicorn.conf.py), all of this happens
+once in the master and the workers start from a copy. before_fork()
+closes the connections the master may have opened, which the workers
+must not share, and after_fork() drops the state a worker must not
+inherit, such as the id blocks reserved by the master.
+"""
+import time
+from collections import OrderedDict
+
+from .conf import setting
+
+timings = OrderedDict()
+
+
+class timed_phase:
+    """Record the milliseconds spent in a block under `name` in `timings`"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        timings[self.name] = (time.perf_counter() - self.start) * 1000
+
+
+def serializer_classes():
+    from rest_framework.serializers import BaseSerializer
+
+    from . import serializers
+
+    for value in vars(serializers).values():
+        if isinstance(value, type) and issubclass(value, BaseSerializer) and value.__module__ == serializers.__name__:
+            yield value
+
+
+def warm_up():
+    """Do the one-off work of the first requests now, without touching the database"""
+    from django.contrib.auth.password_validation import get_default_password_validators
+    from django.urls import get_resolver
+    from rest_framework.settings import api_settings
+    from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+    with timed_phase('warm_up'):
+        # Imports every view and fills the reverse lookup tables
+        get_resolver()._populate()
+        # Settings naming classes are imported on first access
+        for name in ('DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES', 'DEFAULT_AUTHENTICATION_CLASSES',
+                     'DEFAULT_PERMISSION_CLASSES', 'DEFAULT_THROTTLE_CLASSES', 'DEFAULT_PAGINATION_CLASS',
+                     'DEFAULT_CONTENT_NEGOTIATION_CLASS', 'DEFAULT_METADATA_CLASS', 'DEFAULT_VERSIONING_CLASS'):
+            getattr(api_settings, name)
+        for name in ('AUTH_TOKEN_CLASSES', 'TOKEN_USER_CLASS', 'USER_AUTHENTICATION_RULE'):
+            getattr(jwt_settings, name)
+        # Reads the list of common passwords
+        get_default_password_validators()
+        # Builds the fields of model serializers and the model metadata caches
+        for serializer_class in serializer_classes():
+            serializer_class().fields
+
+
+def before_fork():
+    from django.core.cache import caches
+    from django.db import connections
+
+    connections.close_all()
+    caches.close_all()
+
+
+def after_fork():
+    from . import related, suggest
+    from .sharding import allocator
+
+    allocator.reset()
+    suggest.indexes.clear()
+    related.indexes.clear()
+
+
+def is_enabled():
+    return setting('STARTUP_WARM_UP', True)
@@ -0,0 +1,243 @@
+"""
+Per-user note statistics.
+
+Note counts are kept in NoteStatsBucket rows, one per user, category and
+note date, so the statistics endpoint sums a few buckets instead of
+counting notes. Signal handlers adjust the buckets as notes are created,
+moved to another category or date, and deleted, and NoteQuerySet.bulk_create
+counts bulk inserts. Writes bypassing both, such as QuerySet.update(), leave
+the buckets stale: check_note_stats reports the drift and rebuild_note_stats
+recomputes them from the notes table.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count, F, Max
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .deletion import handles_set_based_delete
+from .models import ArchivedNote, Category, Note, NoteActivity, NoteStatsBucket
+
+REBUILD_BATCH_SIZE = 2000
+
+
+def stats_key(note):
+    """Return the (user_id, category_id, day) bucket counting ``note``"""
+    day = note.date
+    if isinstance(day, str):
+        day = Note._meta.get_field('date').to_python(day)
+    return (note.user_id, note.category_id, day)
+
+
+def adjust_bucket(key, delta, using=None):
+    """Add ``delta`` to the count of one bucket, creating it if needed"""
+    user_id, category_id, day = key
+    using = using or router.db_for_write(NoteStatsBucket)
+    buckets = NoteStatsBucket.objects.using(using)
+    lookup = buckets.filter(user_id=user_id, category_id=category_id, day=day)
+    # Decrements never create buckets: a missing one is being deleted along
+    # with its user or category
+    if lookup.update(count=F('count') + delta) or delta < 0:
+        return
+    try:
+        with transaction.atomic(using=using):
+            buckets.create(user_id=user_id, category_id=category_id, day=day, count=delta)
+    except IntegrityError:
+        # Created by a concurrent writer in the meantime
+        lookup.update(count=F('count') + delta)
+
+
+def add_to_buckets(counts, using=None):
+    """Add a {key: count} mapping to the buckets with a constant number of queries"""
+    if not counts:
+        return
+    days = [day for _, _, day in counts]
+    with transaction.atomic(using=using):
+        existing = {
+            (bucket.user_id, bucket.category_id, bucket.day): bucket
+            for bucket in NoteStatsBucket.objects.using(using).select_for_update().filter(
+                user_id__in={user_id for user_id, _, _ in counts},
+                category_id__in={category_id for _, category_id, _ in counts},
+                day__gte=min(days),
+                day__lte=max(days),
+            )
+        }
+        changed = []
+        created = []
+        for key, count in counts.items():
+            bucket = existing.get(key)
+            if bucket is None:
+                created.append(NoteStatsBucket(user_id=key[0], category_id=key[1], day=key[2], count=count))
+            else:
+                bucket.count += count
+                changed.append(bucket)
+        NoteStatsBucket.objects.using(using).bulk_update(changed, ['count'], batch_size=REBUILD_BATCH_SIZE)
+        NoteStatsBucket.objects.using(using).bulk_create(created, batch_size=REBUILD_BATCH_SIZE)
+
+
+def touch_activity(user_id, when=None, using=None, create=True):
+    when = when or timezone.now()
+    using = using or router.db_for_write(NoteActivity)
+    activity = NoteActivity.objects.using(using)
+    if activity.filter(user_id=user_id).update(last_activity=when) or not create:
+        return
+    try:
+        with transaction.atomic(using=using):
+            activity.create(user_id=user_id, last_activity=when)
+    except IntegrityError:
+        activity.filter(user_id=user_id).update(last_activity=when)
+
+
+def record_bulk_create(notes, using=None):
+    """Count notes inserted with bulk_create"""
+    counts = Counter(stats_key(note) for note in notes if note.pk is not None)
+    add_to_buckets(counts, using=using)
+    now = timezone.now()
+    for user_id in {user_id for user_id, _, _ in counts}:
+        touch_activity(user_id, now, using=using)
+
+
+@receiver(post_init, sender=Note)
+def remember_stats_key(sender, instance, **kwargs):
+    # Deferred fields are missing from __dict__, reading them would query
+    fields = instance.__dict__
+    if instance.pk is not None and 'date' in fields and 'category_id' in fields and 'user_id' in fields:
+        instance._stats_key = stats_key(instance)
+    else:
+        instance._stats_key = None
+
+
+@receiver(pre_save, sender=Note)
+def load_stats_key(sender, instance, using=None, **kwargs):
+    """Fetch the stored bucket of notes that were not loaded whole"""
+    if instance._stats_key is None and not instance._state.adding and instance.pk is not None:
+        instance._stats_key = (
+            Note.objects.using(using).filter(pk=instance.pk)
+            .values_list('user_id', 'category_id', 'date').first()
+        )
+
+
+@receiver(post_save, sender=Note)
+def count_saved_note(sender, instance, created, using=None, **kwargs):
+    key = stats_key(instance)
+    previous = None if created else instance._stats_key
+    if previous != key:
+        if previous is not None:
+            adjust_bucket(previous, -1, using=using)
+        adjust_bucket(key, 1, using=using)
+    instance._stats_key = key
+    touch_activity(instance.user_id, using=using)
+
+
+@handles_set_based_delete
+@receiver(post_delete, sender=Note)
+def count_deleted_note(sender, instance, using=None, **kwargs):
+    key = instance._stats_key or stats_key(instance)
+    adjust_bucket(key, -1, using=using)
+    # The activity row may be going away with the user
+    touch_activity(instance.user_id, using=using, create=False)
+
+
+def user_stats(user):
+    """Summarize the notes of ``user`` from the buckets"""
+    by_category = Counter()
+    by_month = Counter()
+    by_day = Counter()
+    buckets = NoteStatsBucket.objects.filter(user=user, count__gt=0).values_list('category_id', 'day', 'count')
+    for category_id, day, count in buckets:
+        by_category[category_id] += count
+        by_month[day.year, day.month] += count
+        by_day[day] += count
+
+    categories = Category.objects.filter(user=user).order_by('name').values('id', 'name', 'colour')
+    return {
+        'total': sum(by_day.values()),
+        'last_activity': NoteActivity.objects.filter(user=user).values_list('last_activity', flat=True).first(),
+        'categories': [{**category, 'count': by_category[category['id']]} for category in categories],
+        'months': [
+            {'month': f'{year:04d}-{month:02d}', 'count': count}
+            for (year, month), count in sorted(by_month.items())
+        ],
+        'days': [{'date': day, 'count': count} for day, count in sorted(by_day.items())],
+    }
+
+
+def expected_buckets(notes):
+    """Count ``notes`` per bucket in the database"""
+    rows = notes.values_list('user_id', 'category_id', 'date').annotate(count=Count('id')).order_by()
+    return {(user_id, category_id, day): count for user_id, category_id, day, count in rows.iterator()}
+
+
+def expected_counts(user_ids, using):
+    """The bucket counts of the notes, archived ones included (see coreapp.archive)"""
+    counts = Counter()
+    for model in (Note, ArchivedNote):
+        notes = model.objects.using(using)
+        if user_ids is not None:
+            notes = notes.filter(user_id__in=user_ids)
+        counts.update(expected_buckets(notes))
+    return counts
+
+
+def rebuild_stats(user_ids=None, using=None):
+    """Recompute the buckets and last activity from the notes table"""
+    using = using or router.db_for_write(Note)
+    notes = Note.objects.using(using)
+    buckets = NoteStatsBucket.objects.using(using)
+    if user_ids is not None:
+        notes = notes.filter(user_id__in=user_ids)
+        buckets = buckets.filter(user_id__in=user_ids)
+
+    with transaction.atomic(using=using):
+        buckets.delete()
+        counts = expected_counts(user_ids, using)
+        NoteStatsBucket.objects.using(using).bulk_create(
+            [
+                NoteStatsBucket(user_id=user_id, category_id=category_id, day=day, count=count)
+                for (user_id, category_id, day), count in counts.items()
+            ],
+            batch_size=REBUILD_BATCH_SIZE,
+        )
+
+        # Deletions leave no trace in the notes table, so a recorded
+        # activity is only ever moved forward
+        activity = NoteActivity.objects.using(using)
+        latest = dict(notes.values_list('user_id').annotate(last=Max('updated_at')).order_by())
+        known = dict(activity.filter(user_id__in=latest).values_list('user_id', 'last_activity'))
+        activity.bulk_create(
+            [NoteActivity(user_id=user_id, last_activity=last) for user_id, last in latest.items() if user_id not in known],
+            batch_size=REBUILD_BATCH_SIZE,
+        )
+        activity.bulk_update(
+            [
+                NoteActivity(user_id=user_id, last_activity=last)
+                for user_id, last in latest.items() if user_id in known and known[user_id] < last
+            ],
+            ['last_activity'],
+            batch_size=REBUILD_BATCH_SIZE,
+        )
+    return len(counts)
+
+
+def check_stats(user_ids=None, using=None):
+    """
+    Compare the buckets with the notes table.
+
+    Returns a list of (key, expected, stored) for every bucket that is off.
+    """
+    buckets = NoteStatsBucket.objects.using(using).exclude(count=0)
+    if user_ids is not None:
+        buckets = buckets.filter(user_id__in=user_ids)
+
+    expected = expected_counts(user_ids, using)
+    stored = {
+        (user_id, category_id, day): count
+        for user_id, category_id, day, count in buckets.values_list('user_id', 'category_id', 'day', 'count').iterator()
+    }
+    return [
+        (key, expected.get(key, 0), stored.get(key, 0))
+        for key in sorted(expected.keys() | stored.keys())
+        if expected.get(key, 0) != stored.get(key, 0)
+    ]
@@ -0,0 +1,165 @@
+"""
+Note title suggestions for quick switchers, from an in-memory prefix index.
+
+Each process keeps a TitleIndex per user: the case folded title and word
+starts of every note (archived ones included) in one sorted list, searched
+by bisection, so a keystroke costs a few comparisons instead of a query.
+Indexes are built on first use and the least recently used are dropped
+past SUGGEST_INDEX_USERS users.
+
+Title changes saved by this process are applied to its index in place
+once committed, and changes made elsewhere (other processes, bulk
+imports, fast deletion) rebuild it, see coreapp.indexcache. Indexes are
+rebuilt after SUGGEST_INDEX_MAX_AGE seconds in any case.
+"""
+from bisect import bisect_left, bisect_right
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .deletion import handles_set_based_delete
+from .indexcache import IndexCache
+from .models import ArchivedNote, Note
+
+DEFAULT_INDEX_USERS = 1000
+DEFAULT_MAX_AGE = 300
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# Words of a title indexed for word-start matches, and the indexed length
+# of each key
+MAX_WORDS = 8
+KEY_LENGTH = 32
+
+
+def fold(text):
+    return ' '.join(text.casefold().split())
+
+
+def title_keys(title):
+    """The index keys of a title: the whole title and its first word starts"""
+    folded = fold(title)
+    keys = []
+    start = 0
+    while start < len(folded) and len(keys) < MAX_WORDS:
+        keys.append(folded[start:start + KEY_LENGTH])
+        space = folded.find(' ', start)
+        if space < 0:
+            break
+        start = space + 1
+    return keys
+
+
+class TitleIndex:
+    """Sorted keys with the note id of each, in two parallel lists"""
+
+    def __init__(self, notes):
+        self.titles = dict(notes)
+        entries = sorted((key, pk) for pk, title in self.titles.items() for key in title_keys(title))
+        self.keys = [key for key, _ in entries]
+        self.ids = [pk for _, pk in entries]
+
+    def __len__(self):
+        return len(self.titles)
+
+    def add(self, pk, title):
+        self.remove(pk)
+        self.titles[pk] = title
+        for key in title_keys(title):
+            position = bisect_right(self.keys, key)
+            self.keys.insert(position, key)
+            self.ids.insert(position, pk)
+
+    def remove(self, pk):
+        title = self.titles.pop(pk, None)
+        if title is None:
+            return
+        for key in title_keys(title):
+            position = bisect_left(self.keys, key)
+            while self.ids[position] != pk:
+                position += 1
+            del self.keys[position]
+            del self.ids[position]
+
+    def search(self, prefix, limit=DEFAULT_LIMIT):
+        """The (id, title) of up to `limit` notes with a title or word starting with `prefix`"""
+        prefix = fold(prefix)
+        key = prefix[:KEY_LENGTH]
+        results = []
+        seen = set()
+        position = bisect_left(self.keys, key)
+        while position < len(self.keys) and len(results) < limit:
+            if not self.keys[position].startswith(key):
+                break
+            pk = self.ids[position]
+            position += 1
+            if pk in seen:
+                continue
+            seen.add(pk)
+            # Keys are cut at KEY_LENGTH, longer prefixes are checked in full
+            if len(prefix) > KEY_LENGTH and not any(start.startswith(prefix) for start in self.word_starts(pk)):
+                continue
+            results.append((pk, self.titles[pk]))
+        return results
+
+    def word_starts(self, pk):
+        words = fold(self.titles[pk]).split(' ')
+        return [' '.join(words[n:]) for n in range(min(len(words), MAX_WORDS))]
+
+
+def titles_version(user_id):
+    return indexes.version(user_id)
+
+
+def bump_titles_version(user_id):
+    """Increment the titles version of a user, return the new one or None if it was not set"""
+    return indexes.bump_version(user_id)
+
+
+def load_titles(user_id, using=None):
+    titles = []
+    for model in (Note, ArchivedNote):
+        titles.extend(model.objects.using(using).filter(user_id=user_id).values_list('id', 'title').iterator())
+    return titles
+
+
+def build_index(user_id, using=None):
+    return TitleIndex(load_titles(user_id, using))
+
+
+indexes = IndexCache(
+    'suggest', build_index, 'SUGGEST_INDEX_USERS', DEFAULT_INDEX_USERS, 'SUGGEST_INDEX_MAX_AGE', DEFAULT_MAX_AGE
+)
+
+
+def suggest_titles(user, prefix, limit=DEFAULT_LIMIT):
+    """Suggest notes of `user` for `prefix`, as a list of {'id', 'title'}"""
+    return [{'id': pk, 'title': title} for pk, title in indexes.get(user.pk).search(prefix, limit)]
+
+
+def titles_changed(user_id, using=None):
+    """Called after set-based writes to a user's notes"""
+    transaction.on_commit(lambda: indexes.forget(user_id), using=using)
+
+
+@receiver(post_init, sender=Note)
+def remember_title(sender, instance, **kwargs):
+    instance._indexed_title = instance.__dict__.get('title') if instance.pk is not None else None
+
+
+@receiver(post_save, sender=Note)
+def index_saved_note(sender, instance, created, using=None, update_fields=None, **kwargs):
+    if update_fields is not None and 'title' not in update_fields:
+        return
+    if not created and instance._indexed_title == instance.title:
+        return
+    pk, title = instance.pk, instance.title
+    instance._indexed_title = title
+    transaction.on_commit(lambda: indexes.apply(instance.user_id, lambda index: index.add(pk, title)), using=using)
+
+
+@handles_set_based_delete
+@receiver(post_delete, sender=Note)
+def unindex_deleted_note(sender, instance, using=None, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: indexes.apply(instance.user_id, lambda index: index.remove(pk)), using=using)
@@ -0,0 +1,60 @@
+"""Background tasks run by the job queue, see coreapp.jobs"""
+from django.contrib.auth.models import User
+
+from .archive import archive_cold_notes
+from .deletion import delete_category, delete_user
+from .jobs import enqueue, task
+from .metadata import backfill_metadata
+from .models import Category, Note
+from .revisions import compact_revisions, prune_revisions
+from .sharding import shard_aliases
+from .stats import rebuild_stats
+
+
+@task('delete_category')
+def delete_category_task(category_id):
+    category = Category.objects.filter(pk=category_id).first()
+    if category is None:
+        return {'deleted': 0}
+    return {'deleted': delete_category(category)}
+
+
+@task('delete_user')
+def delete_user_task(user_id):
+    user = User.objects.filter(pk=user_id).first()
+    if user is None:
+        return {'deleted': 0}
+    return {'deleted': delete_user(user)}
+
+
+@task('rebuild_note_stats')
+def rebuild_note_stats_task(user_ids=None):
+    return {'buckets': sum(rebuild_stats(user_ids, using=alias) for alias in shard_aliases())}
+
+
+@task('prune_revisions')
+def prune_revisions_task(note_id, compact=False):
+    note = Note.objects.filter(pk=note_id).first()
+    if note is None:
+        return {'pruned': 0, 'compacted': 0}
+    return {
+        'pruned': prune_revisions(note),
+        'compacted': compact_revisions(note) if compact else 0,
+    }
+
+
+@task('archive_notes')
+def archive_notes_task(shard, after_user=0, days=None):
+    archived, last_user = archive_cold_notes(using=shard, after_user=after_user, days=days)
+    if last_user is not None:
+        # Out of time, the rest of the users go to a new job
+        enqueue('archive_notes', {'shard': shard, 'after_user': last_user, 'days': days}, priority=-10)
+    return {'archived': archived, 'last_user': last_user}
+
+
+@task('backfill_note_metadata')
+def backfill_note_metadata_task(shard):
+    updated, remaining = backfill_metadata(using=shard)
+    if remaining:
+        enqueue('backfill_note_metadata', {'shard': shard}, priority=-10)
+    return {'updated': updated, 'remaining': remaining}
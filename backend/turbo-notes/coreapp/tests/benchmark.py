@@ -0,0 +1,37 @@
+"""
+Helpers for the benchmark tests.
+
+Benchmarks run with small inputs by default so the suite stays fast. Set
+BENCHMARK_SCALE to a larger multiplier to get meaningful numbers locally.
+"""
+import os
+import sys
+import time
+
+SCALE = max(1, int(os.environ.get('BENCHMARK_SCALE', '1')))
+
+
+def scaled(n):
+    return n * SCALE
+
+
+def timed(fn, repeat=1):
+    """Return the best wall clock time of ``repeat`` calls to ``fn``"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(name, **metrics):
+    """Write a benchmark result line to stderr"""
+    parts = []
+    for key, value in metrics.items():
+        if isinstance(value, float):
+            value = f'{value:.4g}'
+        parts.append(f'{key}={value}')
+    sys.stderr.write(f'\n[benchmark] {name}: {" ".join(parts)}\n')
@@ -0,0 +1,199 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.archive import archive_cold_notes, archive_user_notes
+from coreapp.jobs import Worker
+from coreapp.models import BODY_ZLIB, ArchivedNote, Category, Job, Note, NoteBody, NoteRevision
+from coreapp.stats import check_stats, rebuild_stats
+
+from .benchmark import report, scaled, timed
+
+
+def age(notes, days):
+    """Make notes look last changed `days` ago"""
+    Note.objects.filter(pk__in=[note.pk for note in notes]).update(updated_at=timezone.now() - timedelta(days=days))
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.work = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.home = Category.objects.create(name="Home", colour="#000000", user=self.user)
+        self.old = Note.objects.create(
+            title="Old", content="Old body " * 100, date='2023-01-01', category=self.work, user=self.user
+        )
+        self.old.content = "Old body, edited " * 100
+        self.old.save()
+        self.older = Note.objects.create(
+            title="Older", content="Short", date='2022-06-01', category=self.home, user=self.user
+        )
+        self.new = Note.objects.create(
+            title="New", content="New body", date='2024-01-01', category=self.work, user=self.user
+        )
+        age([self.old, self.older], 400)
+
+    def archive(self):
+        return archive_user_notes(self.user.pk)
+
+    def test_archives_cold_notes(self):
+        self.assertEqual(self.archive(), 2)
+        self.assertEqual(list(Note.objects.values_list('title', flat=True)), ["New"])
+        self.assertEqual(NoteBody.objects.count(), 1)
+        self.assertFalse(NoteRevision.objects.exists())
+
+        archived = ArchivedNote.objects.get(pk=self.old.pk)
+        self.assertEqual(archived.codec, BODY_ZLIB)
+        self.assertEqual(archived.content, "Old body, edited " * 100)
+        self.assertEqual(archived.version, 2)
+        self.assertEqual(ArchivedNote.objects.get(pk=self.older.pk).content, "Short")
+        self.assertEqual(self.archive(), 0)
+
+    def test_statistics_count_archived_notes(self):
+        before = self.client.get(reverse('note-stats')).data
+        self.archive()
+        self.assertEqual(self.client.get(reverse('note-stats')).data, before)
+        self.assertEqual(check_stats(), [])
+        rebuild_stats()
+        self.assertEqual(self.client.get(reverse('note-stats')).data, before)
+        self.assertEqual(
+            self.client.get(reverse('category-list')).data['results'][1]['notes_count'], 2
+        )
+
+    def test_list_hides_archived_notes(self):
+        self.archive()
+        response = self.client.get(reverse('note-list'))
+        self.assertEqual([note['title'] for note in response.data['results']], ["New"])
+
+    def test_list_includes_archived_notes_on_request(self):
+        self.archive()
+        url = reverse('note-list')
+        response = self.client.get(url, {'include_archived': 'true'})
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([note['title'] for note in response.data['results']], ["New", "Old", "Older"])
+        self.assertEqual(response.data['results'][1]['content'], "Old body, edited " * 100)
+        self.assertEqual(response.data['results'][1]['category']['name'], "Work")
+
+        response = self.client.get(url, {'include_archived': 'true', 'ordering': 'title'})
+        self.assertEqual([note['title'] for note in response.data['results']], ["New", "Old", "Older"])
+        response = self.client.get(url, {'include_archived': 'true', 'category': self.work.pk, 'ordering': 'date'})
+        self.assertEqual([note['title'] for note in response.data['results']], ["Old", "New"])
+        response = self.client.get(url, {'include_archived': 'bogus'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_retrieve_archived_note(self):
+        self.archive()
+        response = self.client.get(reverse('note-detail', kwargs={'pk': self.old.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['content'], "Old body, edited " * 100)
+        self.assertEqual(response.data['version'], 2)
+        # Reading does not restore
+        self.assertFalse(Note.objects.filter(pk=self.old.pk).exists())
+
+        other = User.objects.create_user(username='other@example.com', email='other@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(other).access_token}')
+        response = self.client.get(reverse('note-detail', kwargs={'pk': self.old.pk}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_edit_restores(self):
+        self.archive()
+        detail = reverse('note-detail', kwargs={'pk': self.old.pk})
+        response = self.client.patch(detail, {'title': "Revived"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(ArchivedNote.objects.filter(pk=self.old.pk).exists())
+        note = Note.objects.get(pk=self.old.pk)
+        self.assertEqual(note.title, "Revived")
+        self.assertEqual(note.content, "Old body, edited " * 100)
+        self.assertEqual(note.created_at, self.old.created_at)
+
+        # The history came back too
+        response = self.client.get(reverse('note-revision', kwargs={'pk': self.old.pk, 'version': 1}))
+        self.assertEqual(response.data['content'], "Old body " * 100)
+        self.assertEqual(check_stats(), [])
+
+    def test_content_patch_restores(self):
+        self.archive()
+        detail = reverse('note-detail', kwargs={'pk': self.older.pk})
+        response = self.client.patch(detail, {'base_version': 1, 'ops': [5, "!"]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], 2)
+        self.assertEqual(Note.objects.get(pk=self.older.pk).content, "Short!")
+        self.assertFalse(ArchivedNote.objects.filter(pk=self.older.pk).exists())
+
+    def test_delete_archived_note(self):
+        self.archive()
+        response = self.client.delete(reverse('note-detail', kwargs={'pk': self.older.pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(ArchivedNote.objects.filter(pk=self.older.pk).exists())
+        self.assertEqual(self.client.get(reverse('note-stats')).data['total'], 2)
+        self.assertEqual(check_stats(), [])
+
+    def test_deleting_the_category_deletes_archived_notes(self):
+        self.archive()
+        response = self.client.delete(reverse('category-detail', kwargs={'pk': self.home.pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(ArchivedNote.objects.filter(pk=self.older.pk).exists())
+
+    def test_job_continues_where_it_ran_out_of_time(self):
+        other = User.objects.create_user(username='other@example.com', email='other@example.com')
+        category = Category.objects.create(name="Work", colour="#FF5733", user=other)
+        age([Note.objects.create(title="Cold", content="x", date='2020-01-01', category=category, user=other)], 400)
+
+        archived, last_user = archive_cold_notes(seconds=1e-9)
+        self.assertEqual((archived, last_user), (2, self.user.pk))
+        self.assertEqual(archive_cold_notes(after_user=last_user), (1, None))
+
+    def test_command_queues_jobs(self):
+        out = StringIO()
+        call_command('archive_notes', '--days', '365', stdout=out)
+        self.assertEqual(Job.objects.filter(name='archive_notes').count(), 1)
+        self.assertTrue(Worker(name='w').run_once())
+        self.assertEqual(Job.objects.get(name='archive_notes').result, {'archived': 2, 'last_user': None})
+
+        call_command('archive_notes', '--now', '--days', '0', stdout=out)
+        self.assertIn('Archived 1 notes', out.getvalue())
+        self.assertFalse(Note.objects.exists())
+
+
+class ArchiveBenchmarkTests(TestCase):
+    def test_hot_table_size_and_list_latency(self):
+        """List the recent notes of a user with most of their notes cold, before and after archiving"""
+        user = User.objects.create_user(username='bench@example.com', email='bench@example.com')
+        category = Category.objects.create(name="Work", colour="#000000", user=user)
+        count = scaled(2000)
+        notes = Note.objects.bulk_create([
+            Note(title=f"Note {n}", content="Lorem ipsum dolor sit amet " * 40, date='2024-01-01',
+                 category=category, user=user)
+            for n in range(count)
+        ])
+        # Nine notes out of ten are cold
+        age([note for n, note in enumerate(notes) if n % 10], 400)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        url = f'{reverse("note-list")}?ordering=-updated_at'
+        requests = scaled(50)
+
+        def workload():
+            for _ in range(requests):
+                client.get(url)
+
+        hot_before = Note.objects.count()
+        before = timed(workload)
+        archive_seconds = timed(lambda: archive_user_notes(user.pk))
+        after = timed(workload)
+        report(
+            'archive', notes=count, hot_before=hot_before, hot_after=Note.objects.count(),
+            archive_ms=archive_seconds * 1000, list_before_ms=before / requests * 1000,
+            list_after_ms=after / requests * 1000,
+        )
+        self.assertEqual(Note.objects.count() + ArchivedNote.objects.count(), count)
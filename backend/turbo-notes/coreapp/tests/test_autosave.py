@@ -0,0 +1,202 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp import autosave
+from coreapp.ratelimit import get_backend
+from coreapp.models import Category, Note
+
+from .benchmark import report, scaled
+
+
+def note_writes(queries):
+    return [
+        query['sql'] for query in queries
+        if query['sql'].startswith(('UPDATE "coreapp_note', 'INSERT INTO "coreapp_note'))
+    ]
+
+
+# Long enough that nothing is flushed before the tests ask for it
+@override_settings(AUTOSAVE_COALESCE_WINDOW=60)
+class AutosaveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Rate limits are counted per process
+        get_backend.cache_clear()
+        autosave.flusher.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.other_category = Category.objects.create(name="Home", colour="#000000", user=self.user)
+        self.note = Note.objects.create(
+            title="Draft", content="Hello", date='2024-01-01', category=self.category, user=self.user
+        )
+        self.url = reverse('note-detail', kwargs={'pk': self.note.pk})
+
+    def put(self, content, **fields):
+        data = {'title': 'Draft', 'content': content, 'date': '2024-01-01', 'category_id': self.category.pk}
+        data.update(fields)
+        return self.client.put(self.url, data, format='json')
+
+    def test_saves_are_buffered_and_read_back(self):
+        response = self.put("Hello w")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.put("Hello world", title="Greeting", category_id=self.other_category.pk)
+        self.assertEqual(response.json()['content'], "Hello world")
+        # The version the note will have once written
+        self.assertEqual(response.json()['version'], 2)
+
+        self.note.refresh_from_db()
+        self.assertEqual((self.note.title, self.note.content, self.note.version), ("Draft", "Hello", 1))
+
+        detail = self.client.get(self.url).json()
+        self.assertEqual((detail['title'], detail['content']), ("Greeting", "Hello world"))
+        self.assertEqual(detail['category']['id'], self.other_category.pk)
+        listed = self.client.get(reverse('note-list')).json()['results'][0]
+        self.assertEqual((listed['title'], listed['content'], listed['version']), ("Greeting", "Hello world", 2))
+        bootstrap = self.client.get(reverse('bootstrap')).json()['notes']['results'][0]
+        self.assertEqual(bootstrap['content'], "Hello world")
+
+    def test_flush_writes_the_last_save_once(self):
+        self.put("Hello w")
+        self.put("Hello wo")
+        self.put("Hello world", title="Greeting")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(autosave.flush_all(), 1)
+        self.assertEqual(len([sql for sql in note_writes(queries) if 'coreapp_note" SET' in sql]), 1)
+
+        self.note.refresh_from_db()
+        self.assertEqual((self.note.title, self.note.content, self.note.version), ("Greeting", "Hello world", 2))
+        self.assertIsNone(cache.get(autosave.entry_key(self.note.pk)))
+        self.assertEqual(self.client.get(self.url).json()['version'], 2)
+
+    def test_saves_after_the_window_are_written(self):
+        self.put("Hello w")
+        entry = cache.get(autosave.entry_key(self.note.pk))
+        self.assertEqual(autosave.flush_due(now=entry['since'] + 59), 0)
+        self.assertEqual(autosave.flush_due(now=entry['since'] + 60), 1)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.content, "Hello w")
+
+        # A new buffer starts from the written note
+        self.put("Hello world")
+        self.assertEqual(self.client.get(self.url).json()['content'], "Hello world")
+        autosave.flush_all()
+        self.note.refresh_from_db()
+        self.assertEqual((self.note.content, self.note.version), ("Hello world", 3))
+
+    def test_other_writes_apply_on_top_of_the_buffer(self):
+        self.put("Hello world")
+        response = self.client.patch(self.url, {'title': "Renamed"}, format='json')
+        self.assertEqual(response.json()['content'], "Hello world")
+        self.note.refresh_from_db()
+        self.assertEqual((self.note.title, self.note.content), ("Renamed", "Hello world"))
+
+        self.put("Hello world!", title="Renamed")
+        response = self.client.patch(
+            self.url, {'base_version': 3, 'ops': [12, '?']}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.json())
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.content, "Hello world!?")
+
+    def test_stale_buffer_is_ignored(self):
+        self.put("Hello world")
+        # Written by something that does not go through the API
+        self.note.refresh_from_db()
+        self.note.title = "Elsewhere"
+        self.note.save()
+        self.assertEqual(self.client.get(self.url).json()['content'], "Hello")
+        self.assertEqual(autosave.flush_all(), 0)
+
+    def test_deleting_discards_the_buffer(self):
+        self.put("Hello world")
+        self.assertEqual(self.client.delete(self.url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertIsNone(cache.get(autosave.entry_key(self.note.pk)))
+        self.assertEqual(autosave.flush_all(), 0)
+
+    def test_invalid_saves_are_not_buffered(self):
+        response = self.put("", title="")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIsNone(cache.get(autosave.entry_key(self.note.pk)))
+
+    @override_settings(AUTOSAVE_LOCK_TIMEOUT=0.05)
+    def test_lock(self):
+        key = f'{autosave.entry_key(self.note.pk)}:lock'
+        cache.set(key, 1)
+        # Held by another process: the save is refused, and the lock left alone
+        response = self.put("Hello world")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(cache.get(key), 1)
+
+        cache.delete(key)
+        with autosave.note_lock(self.note.pk, cache):
+            # Expired and taken over by another process
+            cache.set(key, 2)
+        self.assertEqual(cache.get(key), 2)
+        cache.delete(key)
+        with autosave.note_lock(self.note.pk, cache):
+            self.assertIsNotNone(cache.get(key))
+        self.assertIsNone(cache.get(key))
+
+    @override_settings(AUTOSAVE_COALESCE_WINDOW=0)
+    def test_disabled(self):
+        self.put("Hello world")
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.content, "Hello world")
+        self.assertIsNone(cache.get(autosave.entry_key(self.note.pk)))
+
+
+# Saves in the direct mode would hit the write rate limit
+@override_settings(AUTOSAVE_COALESCE_WINDOW=60, REST_FRAMEWORK={
+    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'PAGE_SIZE': 10,
+    'DEFAULT_AUTHENTICATION_CLASSES': ('rest_framework_simplejwt.authentication.JWTAuthentication',),
+    'DEFAULT_THROTTLE_CLASSES': (),
+})
+class AutosaveBenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        autosave.flusher.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+
+    def type_notes(self, notes, keystrokes):
+        """An editor saving each note after every keystroke, flushed at the end of the window"""
+        with CaptureQueriesContext(connection) as queries:
+            for note in notes:
+                url = reverse('note-detail', kwargs={'pk': note.pk})
+                for n in range(1, keystrokes + 1):
+                    data = {'title': note.title, 'content': 'x' * n, 'date': '2024-01-01',
+                            'category_id': self.category.pk}
+                    self.assertEqual(self.client.put(url, data, format='json').status_code, status.HTTP_200_OK)
+            autosave.flush_all()
+        return len(note_writes(queries.captured_queries))
+
+    def test_autosave_write_reduction(self):
+        notes = [
+            Note.objects.create(title=f"Note {n}", content="", date='2024-01-01', category=self.category, user=self.user)
+            for n in range(5)
+        ]
+        keystrokes = scaled(20)
+        with override_settings(AUTOSAVE_COALESCE_WINDOW=0):
+            direct = self.type_notes(notes, keystrokes)
+        coalesced = self.type_notes(notes, keystrokes)
+        report(
+            'autosave', notes=len(notes), saves=len(notes) * keystrokes,
+            direct_writes=direct, coalesced_writes=coalesced, reduction=direct / coalesced,
+        )
+        self.assertLess(coalesced * 5, direct)
+        for note in notes:
+            note.refresh_from_db()
+            self.assertEqual(note.content, 'x' * keystrokes)
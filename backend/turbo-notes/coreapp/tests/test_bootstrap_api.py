@@ -0,0 +1,122 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp import caching
+from coreapp.archive import archive_user_notes
+from coreapp.models import Category, Note
+
+from .benchmark import report, scaled, timed
+
+
+class BootstrapAPITests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.work = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.home = Category.objects.create(name="Home", colour="#000000", user=self.user)
+
+    def create_notes(self, count, category):
+        Note.objects.bulk_create([
+            Note(title=f"Note {n}", content=f"Body {n}", date=f'2024-01-{n % 28 + 1:02}', category=category, user=self.user)
+            for n in range(count)
+        ])
+
+    def test_matches_the_separate_endpoints(self):
+        self.create_notes(8, self.work)
+        self.create_notes(7, self.home)
+        response = self.client.get(reverse('bootstrap'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['categories'], self.client.get(reverse('category-list')).json()['results'])
+        self.assertEqual(data['notes'], self.client.get(reverse('note-list')).json())
+        self.assertEqual(data['notes']['count'], 15)
+
+    def test_query_count_is_fixed(self):
+        for count in (0, 3, 40):
+            self.create_notes(count, self.work)
+            # Authentication, categories, notes
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('bootstrap'))
+            self.assertEqual(len(response.json()['categories']), 2)
+
+    def test_archived_notes(self):
+        self.create_notes(3, self.work)
+        Note.objects.filter(title="Note 0").update(updated_at=timezone.now() - timedelta(days=400))
+        archive_user_notes(self.user.pk)
+        data = self.client.get(reverse('bootstrap')).json()
+        self.assertEqual(data['notes']['count'], 2)
+        self.assertEqual(len(data['notes']['results']), 2)
+        self.assertEqual(data['categories'][1]['notes_count'], 3)
+
+    def test_sync_marker(self):
+        before = timezone.now()
+        synced_at = parse_datetime(self.client.get(reverse('bootstrap')).json()['synced_at'])
+        self.assertGreaterEqual(synced_at, before - timedelta(seconds=1))
+        self.create_notes(1, self.work)
+        changed = self.client.get(reverse('note-list'), {'updated_since': synced_at.isoformat()}).json()
+        self.assertEqual([note['title'] for note in changed['results']], ["Note 0"])
+
+    @override_settings(RESPONSE_CACHE_ENABLED=True)
+    def test_cached_responses_are_synced_when_served(self):
+        cache.clear()
+        caching.stats.reset()
+        first = self.client.get(reverse('bootstrap')).json()
+        second = self.client.get(reverse('bootstrap')).json()
+        self.assertEqual((caching.stats.hits, caching.stats.misses), (1, 1))
+        self.assertGreater(parse_datetime(second.pop('synced_at')), parse_datetime(first.pop('synced_at')))
+        self.assertEqual(second, first)
+
+    def test_requires_authentication(self):
+        self.client.credentials()
+        self.assertEqual(self.client.get(reverse('bootstrap')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class BootstrapBenchmarkTests(TestCase):
+    def test_startup_latency(self):
+        """One bootstrap request against the categories and notes requests the app makes on load"""
+        user = User.objects.create_user(username='bench@example.com', email='bench@example.com')
+        categories = [Category.objects.create(name=f"Category {n}", colour="#000000", user=user) for n in range(8)]
+        Note.objects.bulk_create([
+            Note(title=f"Note {n}", content="Lorem ipsum " * 50, date='2024-01-01',
+                 category=categories[n % 8], user=user)
+            for n in range(scaled(2000))
+        ])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        rounds = scaled(50)
+
+        def separate():
+            for _ in range(rounds):
+                client.get(reverse('category-list'))
+                client.get(reverse('note-list'))
+
+        def bootstrap():
+            for _ in range(rounds):
+                client.get(reverse('bootstrap'))
+
+        separate_seconds = timed(separate)
+        bootstrap_seconds = timed(bootstrap)
+        # The saving asserted: fewer queries, timings are only reported
+        with CaptureQueriesContext(connection) as separate_queries:
+            client.get(reverse('category-list'))
+            client.get(reverse('note-list'))
+        with CaptureQueriesContext(connection) as bootstrap_queries:
+            client.get(reverse('bootstrap'))
+        report(
+            'bootstrap', notes=scaled(2000), separate_ms=separate_seconds / rounds * 1000,
+            bootstrap_ms=bootstrap_seconds / rounds * 1000, speedup=separate_seconds / bootstrap_seconds,
+            separate_queries=len(separate_queries), bootstrap_queries=len(bootstrap_queries),
+        )
+        self.assertLess(len(bootstrap_queries), len(separate_queries))
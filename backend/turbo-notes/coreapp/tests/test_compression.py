@@ -0,0 +1,155 @@
+import gzip
+import random
+from datetime import date
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.middleware import (
+    BrotliCodec, CompressionMiddleware, GzipCodec, ZstdCodec, available_codecs, brotli,
+    choose_codec, zstandard,
+)
+from coreapp.models import Category, Note
+
+from .benchmark import report, scaled, timed
+
+DECOMPRESS = {'gzip': gzip.decompress}
+if brotli is not None:
+    DECOMPRESS['br'] = brotli.decompress
+if zstandard is not None:
+    DECOMPRESS['zstd'] = lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+WORDS = (
+    'agenda roadmap review owners budget launch deadline customer feedback sprint '
+    'design draft meeting follow up research notes idea todo bug release plan'
+).split()
+
+
+def create_notes(user, count, seed=0):
+    rng = random.Random(seed)
+    category = Category.objects.create(name="Work", colour="#FF5733", user=user)
+    Note.objects.bulk_create([
+        Note(
+            title=' '.join(rng.choices(WORDS, k=4)).capitalize(),
+            content='\n'.join(
+                ' '.join(rng.choices(WORDS, k=rng.randint(5, 15))) for _ in range(rng.randint(5, 60))
+            ),
+            date=date(2024, 1, 1 + i % 28),
+            category=category,
+            user=user,
+        )
+        for i in range(count)
+    ])
+
+
+class CompressionMiddlewareTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        create_notes(self.user, 10)
+        self.list_url = reverse('note-list')
+
+    def test_identity_when_not_accepted(self):
+        """Test that responses are not compressed without Accept-Encoding"""
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_each_encoding_round_trips(self):
+        """Test that every codec returns the same body and the same strong ETag"""
+        plain = self.client.get(self.list_url)
+        for encoding, decompress in DECOMPRESS.items():
+            response = self.client.get(self.list_url, HTTP_ACCEPT_ENCODING=encoding)
+            self.assertEqual(response['Content-Encoding'], encoding)
+            self.assertEqual(decompress(response.content), plain.content)
+            self.assertLess(len(response.content), len(plain.content))
+            self.assertEqual(response['ETag'], plain['ETag'])
+            self.assertFalse(response['ETag'].startswith('W/'))
+
+    @skipUnless(brotli and zstandard, 'brotli and zstandard are optional')
+    def test_negotiation_prefers_best_codec(self):
+        """Test qvalue handling and server preference on ties"""
+        codecs = available_codecs()
+        self.assertEqual(choose_codec(codecs, 'gzip, deflate, br, zstd').name, 'zstd')
+        self.assertEqual(choose_codec(codecs, 'gzip;q=1.0, br;q=0.5').name, 'gzip')
+        self.assertEqual(choose_codec(codecs, '*').name, 'zstd')
+        self.assertEqual(choose_codec(codecs, '*;q=0.1, zstd;q=0, br;q=0').name, 'gzip')
+        self.assertIsNone(choose_codec(codecs, 'gzip;q=0, identity'))
+        self.assertIsNone(choose_codec(codecs, ''))
+
+    def test_if_none_match_returns_not_modified(self):
+        """Test that the ETag can be used for conditional requests across encodings"""
+        etag = self.client.get(self.list_url, HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        response = self.client.get(self.list_url, HTTP_ACCEPT_ENCODING='br', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        Note.objects.filter(user=self.user).update(title='Changed', updated_at=timezone.now())
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_small_responses_are_not_compressed(self):
+        """Test that bodies below the size threshold are sent as is"""
+        response = self.client.get(reverse('category-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    @override_settings(COMPRESSION_MIN_SIZE=10)
+    def test_threshold_is_configurable(self):
+        response = self.client.get(reverse('category-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_streaming_response(self):
+        """Test that streaming responses are compressed chunk by chunk"""
+        chunks = [b'{"results":['] + [b'{"id":%d},' % i for i in range(1000)] + [b'{}]}']
+        for encoding, decompress in DECOMPRESS.items():
+            middleware = CompressionMiddleware(
+                lambda request: StreamingHttpResponse(iter(chunks), content_type='application/json')
+            )
+            response = middleware(RequestFactory().get('/', HTTP_ACCEPT_ENCODING=encoding))
+
+            self.assertEqual(response['Content-Encoding'], encoding)
+            self.assertFalse(response.has_header('ETag'))
+            self.assertEqual(decompress(b''.join(response.streaming_content)), b''.join(chunks))
+
+    def test_incompressible_types_are_skipped(self):
+        middleware = CompressionMiddleware(
+            lambda request: HttpResponse(b'\x89PNG' * 1000, content_type='image/png')
+        )
+        response = middleware(RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class CompressionBenchmark(TestCase):
+    def test_codec_trade_off(self):
+        """Benchmark compression time against output size on a notes page"""
+        user = User.objects.create_user(username='bench@example.com', email='bench@example.com')
+        create_notes(user, scaled(100))
+        client = APIClient()
+        client.force_authenticate(user)
+        body = client.get(reverse('note-list')).content
+
+        codecs = [GzipCodec(1), GzipCodec(6), GzipCodec(9)]
+        if brotli is not None:
+            codecs += [BrotliCodec(1), BrotliCodec(4), BrotliCodec(9)]
+        if zstandard is not None:
+            codecs += [ZstdCodec(1), ZstdCodec(3), ZstdCodec(9)]
+        for codec in codecs:
+            compressed = codec.compress(body)
+            elapsed = timed(lambda: codec.compress(body), repeat=5)
+            report(
+                f'compress {codec.name}',
+                level=codec.level,
+                bytes=len(body),
+                compressed=len(compressed),
+                ratio=len(body) / len(compressed),
+                ms=elapsed * 1000,
+                mb_per_s=len(body) / elapsed / 1e6,
+            )
@@ -0,0 +1,148 @@
+from datetime import date
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.deletion import can_delete_set_based, delete_category
+from coreapp.jobs import Worker
+from coreapp.models import Category, Job, Note, NoteActivity, NoteBody, NoteRevision, NoteStatsBucket
+from coreapp.stats import check_stats
+
+from .benchmark import report, scaled, timed
+
+
+def create_notes(category, count, edits=0):
+    notes = Note.objects.bulk_create([
+        Note(title=f"Note {n}", content=f"Content {n}", date=date(2024, 1, n % 28 + 1),
+             category=category, user=category.user)
+        for n in range(count)
+    ], batch_size=1000)
+    for note in notes[:edits]:
+        note.content = "Edited"
+        note.save()
+    return notes
+
+
+class FastDeletionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.other_user = User.objects.create_user(username='otheruser@example.com', email='otheruser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+        self.work = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.home = Category.objects.create(name="Home", colour="#33FF57", user=self.user)
+        self.other_category = Category.objects.create(name="Other", colour="#000000", user=self.other_user)
+        create_notes(self.work, 10, edits=3)
+        create_notes(self.home, 4, edits=1)
+        create_notes(self.other_category, 4, edits=1)
+
+    def test_models_allow_set_based_deletion(self):
+        self.assertTrue(can_delete_set_based(Category))
+        self.assertTrue(can_delete_set_based(User))
+
+    def test_delete_category(self):
+        """Test that a category goes with its notes, bodies, revisions and statistics"""
+        with CaptureQueriesContext(connection) as queries:
+            delete_category(self.work, chunk_size=3)
+
+        self.assertFalse(Category.objects.filter(pk=self.work.pk).exists())
+        self.assertEqual(Note.objects.filter(user=self.user).count(), 4)
+        self.assertEqual(NoteBody.objects.count(), 8)
+        self.assertEqual(NoteRevision.objects.count(), 2)
+        self.assertFalse(NoteStatsBucket.objects.filter(category_id=self.work.pk).exists())
+        self.assertEqual(check_stats(), [])
+        # Notes are never loaded
+        self.assertFalse([q for q in queries if '"title"' in q['sql'] and q['sql'].startswith('SELECT')])
+
+    def test_delete_category_api(self):
+        response = self.client.delete(reverse('category-detail', kwargs={'pk': self.work.pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Note.objects.filter(category_id=self.work.pk).exists())
+
+        response = self.client.delete(reverse('category-detail', kwargs={'pk': self.other_category.pk}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_user(self):
+        call_command('delete_user', '--email', self.user.email, '--chunk-size', '2', stdout=StringIO())
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Category.objects.filter(user_id=self.user.pk).exists())
+        self.assertFalse(NoteActivity.objects.filter(user_id=self.user.pk).exists())
+        self.assertEqual(Note.objects.count(), 4)
+        self.assertEqual(NoteBody.objects.count(), 4)
+        self.assertEqual(check_stats(), [])
+
+    def test_other_receivers_fall_back_to_collector(self):
+        deleted = []
+
+        def on_delete(sender, instance, **kwargs):
+            deleted.append(instance.pk)
+
+        post_delete.connect(on_delete, sender=NoteBody)
+        try:
+            self.assertFalse(can_delete_set_based(Category))
+            delete_category(self.home)
+        finally:
+            post_delete.disconnect(on_delete, sender=NoteBody)
+        self.assertEqual(len(deleted), 4)
+        self.assertFalse(Note.objects.filter(category_id=self.home.pk).exists())
+        self.assertEqual(check_stats(), [])
+
+
+@override_settings(FAST_DELETE_BACKGROUND_THRESHOLD=5)
+class BackgroundDeletionTests(TestCase):
+    def test_large_category_is_deleted_by_a_job(self):
+        user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        category = Category.objects.create(name="Big", colour="#FF5733", user=user)
+        create_notes(category, 12)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+
+        response = client.delete(reverse('category-detail', kwargs={'pk': category.pk}))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], Job.QUEUED)
+        self.assertTrue(Category.objects.filter(pk=category.pk).exists())
+
+        self.assertTrue(Worker().run_once())
+        self.assertFalse(Category.objects.filter(pk=category.pk).exists())
+        self.assertFalse(Note.objects.exists())
+
+        response = client.get(response['Location'])
+        self.assertEqual(response.data['status'], Job.SUCCEEDED)
+        self.assertEqual(response.data['result'], {'deleted': 12 * 3 + 1 + 12})
+
+
+class DeletionBenchmarkTests(TestCase):
+    def test_against_collector(self):
+        """Compare the set-based path with Model.delete() on a large category"""
+        user = User.objects.create_user(username='bench@example.com', email='bench@example.com')
+        notes = scaled(2000)
+
+        def prepare():
+            category = Category.objects.create(name="Big", colour="#000000", user=user)
+            create_notes(category, notes, edits=notes // 10)
+            return category
+
+        category = prepare()
+        collector = timed(lambda: category.delete())
+        self.assertFalse(Note.objects.exists())
+
+        category = prepare()
+        with CaptureQueriesContext(connection) as queries:
+            fast = timed(lambda: delete_category(category))
+        self.assertFalse(Note.objects.exists())
+        self.assertEqual(check_stats(), [])
+
+        report(
+            'category_delete', notes=notes, collector_ms=collector * 1000, fast_ms=fast * 1000,
+            speedup=collector / fast, fast_queries=len(queries),
+        )
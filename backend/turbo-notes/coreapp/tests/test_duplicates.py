@@ -0,0 +1,207 @@
+import random
+import string
+from datetime import timedelta
+from io import StringIO
+from itertools import combinations
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp import duplicates
+from coreapp.archive import archive_user_notes, restore_note
+from coreapp.models import Category, Note, NoteFingerprint
+
+from .benchmark import report, scaled, timed
+
+RECIPE = (
+    "Preheat the oven to 220 degrees. Mix the flour, water, salt and starter, then leave the dough "
+    "to rise overnight in the fridge. Shape it in the morning, score the top and bake for forty minutes "
+    "with steam, then twenty more without until the crust is deep brown."
+)
+TRIP = (
+    "Flights to Rome on Friday morning, hotel near Termini for three nights. Book the Vatican museums "
+    "for Saturday and the Colosseum for Sunday, dinner in Trastevere, train to the airport on Monday."
+)
+
+
+def brute_force(signatures):
+    """The pairs of near-duplicates found by comparing every pair"""
+    return {
+        (first, second)
+        for (first, first_values), (second, second_values) in combinations(signatures, 2)
+        if duplicates.similarity(first_values, second_values) >= duplicates.SIMILARITY
+    }
+
+
+def random_signature(rng):
+    return tuple(rng.getrandbits(32) for _ in range(duplicates.HASHES))
+
+
+def changed(rng, signature, count):
+    """A copy of a signature with `count` of its values changed"""
+    values = list(signature)
+    for position in rng.sample(range(duplicates.HASHES), count):
+        values[position] = rng.getrandbits(32)
+    return tuple(values)
+
+
+class FingerprintTests(SimpleTestCase):
+    def test_signature(self):
+        signature = duplicates.signature(RECIPE)
+        self.assertEqual(len(signature), duplicates.HASHES)
+        self.assertEqual(signature, duplicates.signature(RECIPE.upper()))
+        self.assertGreaterEqual(duplicates.similarity(signature, duplicates.signature(RECIPE + " Enjoy!")), 0.8)
+        self.assertLess(duplicates.similarity(signature, duplicates.signature(TRIP)), 0.2)
+        self.assertEqual(duplicates.signature(" ... "), ())
+        self.assertEqual(duplicates.unpack(duplicates.pack(signature)), signature)
+
+    def test_clusters(self):
+        rng = random.Random(1)
+        base = random_signature(rng)
+        signatures = [
+            (1, base), (2, changed(rng, base, 2)), (3, random_signature(rng)), (4, changed(rng, base, 20)),
+            (5, base), (6, ()),
+        ]
+        self.assertEqual(duplicates.clusters(signatures), [[1, 2, 5]])
+        self.assertEqual(duplicates.clusters([(4, base), (9, random_signature(rng))]), [])
+
+    def test_clusters_find_the_pairs_found_by_comparing_all(self):
+        rng = random.Random(3)
+        signatures = []
+        for pk in range(300):
+            if pk % 3 and signatures:
+                signatures.append((pk, changed(rng, rng.choice(signatures)[1], rng.randint(0, 6))))
+            else:
+                signatures.append((pk, random_signature(rng)))
+        found = {pk: group[0] for group in duplicates.clusters(signatures) for pk in group}
+        pairs = brute_force(signatures)
+        missed = [pair for pair in pairs if found.get(pair[0], -1) != found.get(pair[1], -2)]
+        self.assertLess(len(missed), len(pairs) * 0.02)
+
+
+class DuplicatesAPITests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.recipe = self.create_note("Sourdough", RECIPE)
+        self.copy = self.create_note("Sourdough (copy)", RECIPE + " Enjoy!")
+        self.trip = self.create_note("Rome", TRIP)
+        self.empty = self.create_note("Empty", "")
+        self.other_empty = self.create_note("Also empty", "  ")
+
+    def create_note(self, title, content, user=None):
+        user = user or self.user
+        category = self.category if user == self.user else Category.objects.create(
+            name="Other", colour="#000000", user=user
+        )
+        return Note.objects.create(title=title, content=content, date='2024-01-01', category=category, user=user)
+
+    def duplicates(self, **params):
+        response = self.client.get(reverse('note-duplicates'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        return [[note['title'] for note in cluster['notes']] for cluster in response.json()['results']]
+
+    def test_duplicates(self):
+        self.assertEqual(self.duplicates(), [["Sourdough", "Sourdough (copy)"]])
+        self.create_note("Rome again", TRIP.replace("three", "four"))
+        self.create_note("Rome, final", TRIP)
+        self.assertEqual(self.duplicates(), [["Rome", "Rome again", "Rome, final"], ["Sourdough", "Sourdough (copy)"]])
+        self.assertEqual(self.duplicates(limit=1), [["Rome", "Rome again", "Rome, final"]])
+        response = self.client.get(reverse('note-duplicates'), {'limit': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_other_users_notes_are_not_duplicates(self):
+        other = User.objects.create_user(username='other@example.com', email='other@example.com')
+        self.create_note("Mine", TRIP, user=other)
+        self.assertEqual(self.duplicates(), [["Sourdough", "Sourdough (copy)"]])
+
+    def test_fingerprint_follows_the_content(self):
+        self.copy.content = TRIP
+        self.copy.save()
+        fingerprint = NoteFingerprint.objects.get(note=self.copy)
+        self.assertEqual(duplicates.unpack(fingerprint.signature), duplicates.signature(TRIP))
+        self.assertEqual(self.duplicates(), [["Sourdough (copy)", "Rome"]])
+        self.assertIsNone(NoteFingerprint.objects.get(note=self.empty).band0)
+
+        self.copy.delete()
+        self.assertFalse(NoteFingerprint.objects.filter(note_id=self.copy.pk).exists())
+
+    def test_only_candidates_are_read(self):
+        self.assertEqual(
+            set(NoteFingerprint.objects.filter(shared=True).values_list('note_id', flat=True)),
+            {self.recipe.pk, self.copy.pk},
+        )
+        # Authentication, the candidates and the titles
+        with self.assertNumQueries(3):
+            self.duplicates()
+
+        # Still a candidate once its copy changed, but not a duplicate
+        self.copy.content = TRIP
+        self.copy.save()
+        self.assertTrue(NoteFingerprint.objects.get(note=self.recipe).shared)
+        self.assertEqual(self.duplicates(), [["Sourdough (copy)", "Rome"]])
+
+    def test_bulk_created_notes_are_fingerprinted(self):
+        Note.objects.bulk_create([
+            Note(title="Imported", content=TRIP, date='2024-01-01', category=self.category, user=self.user),
+            Note(title="Imported again", content=TRIP, date='2024-01-01', category=self.category, user=self.user),
+        ])
+        self.assertEqual(NoteFingerprint.objects.count(), 7)
+        self.assertEqual(
+            self.duplicates(), [["Rome", "Imported", "Imported again"], ["Sourdough", "Sourdough (copy)"]]
+        )
+
+    def test_restored_notes_are_fingerprinted(self):
+        Note.objects.filter(pk=self.copy.pk).update(updated_at=timezone.now() - timedelta(days=400))
+        archive_user_notes(self.user.pk)
+        self.assertEqual(self.duplicates(), [])
+        self.assertTrue(restore_note(self.user, self.copy.pk))
+        self.assertEqual(self.duplicates(), [["Sourdough", "Sourdough (copy)"]])
+
+    def test_backfill_command(self):
+        NoteFingerprint.objects.all().delete()
+        out = StringIO()
+        self.assertEqual(self.duplicates(), [])
+        call_command('fingerprint_notes', stdout=out)
+        self.assertIn('Fingerprinted 5 notes', out.getvalue())
+        self.assertEqual(NoteFingerprint.objects.count(), 5)
+        self.assertEqual(self.duplicates(), [["Sourdough", "Sourdough (copy)"]])
+        call_command('fingerprint_notes', '--email', 'testuser@example.com', stdout=out)
+        self.assertIn('Fingerprinted 0 notes', out.getvalue())
+
+
+class DuplicatesBenchmarkTests(SimpleTestCase):
+    def test_banded_lookup(self):
+        """Clustering signatures by their bands, against comparing every pair"""
+        rng = random.Random(7)
+        for count in (scaled(1000), scaled(10000)):
+            signatures = []
+            for pk in range(count):
+                if pk % 10 == 0 and signatures:
+                    signatures.append((pk, changed(rng, rng.choice(signatures)[1], 2)))
+                else:
+                    signatures.append((pk, random_signature(rng)))
+            found = []
+            banded_seconds = timed(lambda: found.extend(duplicates.clusters(signatures)))
+            # Extrapolated from the first 1000 notes
+            pairwise_seconds = timed(lambda: brute_force(signatures[:1000])) * (count / 1000) ** 2
+            with mock.patch.object(duplicates, 'similarity', wraps=duplicates.similarity) as similarity:
+                duplicates.clusters(signatures)
+            report(
+                'duplicates', notes=count, clusters=len(found), banded_ms=banded_seconds * 1000,
+                pairwise_ms=pairwise_seconds * 1000, compared=similarity.call_count,
+            )
+            # Fewer pairs compared than there are notes, against count² / 2 pairwise
+            self.assertLess(similarity.call_count, count)
+
+        content = ' '.join(''.join(rng.choices(string.ascii_lowercase, k=6)) for _ in range(300))
+        report('duplicates_signature', words=300, signature_ms=timed(lambda: duplicates.signature(content)) * 1000)
@@ -0,0 +1,143 @@
+import pickle
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp import fragments
+from coreapp.fragments import ENTRY_OVERHEAD, Fragment
+from coreapp.models import Category, Note
+from coreapp.renderers import ORJSONRenderer
+from coreapp.serializers import NoteSerializer
+
+from .benchmark import report, scaled, timed
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.other = Category.objects.create(name="Home", colour="#000000", user=self.user)
+        self.notes = [
+            Note.objects.create(title=f"Note {n}", content=f"Content {n} ✓ ", date=f'2024-01-0{n + 1}',
+                                category=self.other if n == 2 else self.category, user=self.user)
+            for n in range(3)
+        ]
+        self.list_url = reverse('note-list')
+        fragments.fragments.clear()
+        fragments.stats.reset()
+        self.addCleanup(fragments.fragments.clear)
+
+    def get(self, **params):
+        response = self.client.get(self.list_url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_list_reuses_rendered_notes(self):
+        first = self.get().content
+        self.assertEqual((fragments.stats.hits, fragments.stats.misses), (0, 3))
+        response = self.get()
+        self.assertEqual((fragments.stats.hits, fragments.stats.misses), (3, 3))
+        self.assertEqual(response.content, first)
+        with override_settings(NOTE_FRAGMENT_CACHE_BYTES=0):
+            self.assertEqual(self.get().content, first)
+        # Streamed pages splice the same fragments
+        with override_settings(LIST_STREAMING_THRESHOLD=2):
+            self.assertEqual(b''.join(self.get(page_size=10).streaming_content), first)
+        self.assertEqual(fragments.stats.hits, 6)
+
+        # Read as dicts by the code that is not rendering
+        self.assertEqual([note['title'] for note in response.data['results']], ["Note 2", "Note 1", "Note 0"])
+        fragment = response.data['results'][0]
+        self.assertIsInstance(fragment, Fragment)
+        self.assertEqual(pickle.loads(pickle.dumps(fragment)).content, fragment.content)
+
+    def test_changes_are_served(self):
+        self.get()
+        response = self.client.patch(
+            reverse('note-detail', kwargs={'pk': self.notes[0].pk}), {'title': "Renamed"}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        fragments.stats.reset()
+        self.assertEqual([note['title'] for note in self.get().json()['results']], ["Note 2", "Note 1", "Renamed"])
+        self.assertEqual((fragments.stats.hits, fragments.stats.misses), (2, 1))
+
+        response = self.client.patch(
+            reverse('category-detail', kwargs={'pk': self.category.pk}), {'colour': "#123456"}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(fragments.fragments.entries), {self.notes[2].pk})
+        results = self.get().json()['results']
+        self.assertEqual([note['category']['colour'] for note in results], ["#000000", "#123456", "#123456"])
+
+    def test_buffered_notes_are_not_cached(self):
+        notes = list(Note.objects.filter(user=self.user).select_related('category').with_content())
+        notes[0].title = "Buffered"
+        notes[0]._buffered = True
+        rendered = NoteSerializer(notes, many=True).data
+        self.assertEqual(rendered[0]['title'], "Buffered")
+        self.assertNotIn(notes[0].pk, fragments.fragments.entries)
+        self.assertEqual(len(fragments.fragments.entries), 2)
+
+    def test_least_recently_used_notes_are_evicted(self):
+        self.get()
+        sizes = [len(entry[2].content) + ENTRY_OVERHEAD for entry in fragments.fragments.entries.values()]
+        self.assertEqual(fragments.fragments.size, sum(sizes))
+        self.client.patch(reverse('note-detail', kwargs={'pk': self.notes[2].pk}), {'title': "Note 9"}, format='json')
+        with override_settings(NOTE_FRAGMENT_CACHE_BYTES=sum(sizes) - min(sizes)):
+            # Notes 1 and 0 are hits, which leaves note 1 the least recently used
+            self.get()
+        self.assertEqual(list(fragments.fragments.entries), [self.notes[0].pk, self.notes[2].pk])
+        self.assertLessEqual(fragments.fragments.size, sum(sizes) - min(sizes))
+        self.assertEqual(
+            dict(fragments.fragments.by_category),
+            {self.category.pk: {self.notes[0].pk}, self.other.pk: {self.notes[2].pk}},
+        )
+
+
+class FragmentCacheBenchmarkTests(TestCase):
+    def test_page_render_time(self):
+        """Rendering a page of notes with a share of them cached, against serializing them all"""
+        user = User.objects.create_user(username='bench@example.com', email='bench@example.com')
+        category = Category.objects.create(name="Work", colour="#000000", user=user)
+        count = scaled(200)
+        Note.objects.bulk_create([
+            Note(title=f"Note {n}", content="Lorem ipsum dolor sit amet " * 40, date='2024-01-01',
+                 category=category, user=user)
+            for n in range(count)
+        ])
+        notes = list(Note.objects.filter(user=user).select_related('category').with_content())
+        renderer = ORJSONRenderer()
+        self.addCleanup(fragments.fragments.clear)
+
+        def page():
+            return renderer.render({'results': NoteSerializer(notes, many=True).data})
+
+        with override_settings(NOTE_FRAGMENT_CACHE_BYTES=0):
+            uncached = page()
+            uncached_seconds = timed(page, repeat=3)
+        results = {}
+        for ratio in (0, 0.5, 0.9, 1):
+            # The best of three pages rendered with the same share of the notes cached
+            seconds = []
+            for _ in range(3):
+                fragments.fragments.clear()
+                NoteSerializer(notes[:int(count * ratio)], many=True).data
+                seconds.append(timed(lambda: self.assertEqual(page(), uncached)))
+            results[ratio] = min(seconds)
+            # Only the notes not cached are serialized
+            cached = int(count * ratio)
+            fragments.fragments.clear()
+            NoteSerializer(notes[:cached], many=True).data
+            fragments.stats.reset()
+            page()
+            self.assertEqual((fragments.stats.hits, fragments.stats.misses), (cached, count - cached))
+        report(
+            'fragments', notes=count, uncached_ms=uncached_seconds * 1000,
+            **{f'hits_{int(ratio * 100)}_ms': seconds * 1000 for ratio, seconds in results.items()},
+        )
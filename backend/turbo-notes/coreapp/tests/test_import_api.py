@@ -0,0 +1,246 @@
+import json
+from datetime import date
+from io import StringIO
+from tempfile import NamedTemporaryFile
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.importers import import_notes, iter_lines, parse_markdown
+from coreapp.models import Category, Note
+
+from .benchmark import report, scaled, timed
+
+
+class NoteImportAPITests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser@example.com',
+            email='testuser@example.com',
+            password='testpass123'
+        )
+        self.other_user = User.objects.create_user(
+            username='otheruser@example.com',
+            email='otheruser@example.com',
+            password='testpass456'
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        )
+
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.other_user_category = Category.objects.create(
+            name="Other User Category", colour="#CCCCCC", user=self.other_user
+        )
+        self.import_url = reverse('note-import-notes')
+
+    def upload(self, name, content, **data):
+        data['file'] = SimpleUploadedFile(name, content.encode('utf-8'))
+        return self.client.post(self.import_url, data=data, format='multipart')
+
+    def test_import_ndjson(self):
+        """Test importing notes from newline-delimited JSON"""
+        lines = [
+            {'title': 'One', 'content': 'First', 'date': '2024-01-01', 'category_id': self.category.id},
+            {'title': 'Two', 'content': 'Second', 'date': '2024-01-02', 'category': 'Work'},
+            {'title': 'Three', 'content': 'Third', 'date': '2024-01-03', 'category': 'Ideas'},
+        ]
+        response = self.upload('notes.ndjson', '\n'.join(json.dumps(line) for line in lines))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(response.data['failed'], 0)
+        self.assertEqual(response.data['categories_created'], 1)
+
+        notes = Note.objects.filter(user=self.user)
+        self.assertEqual(notes.count(), 3)
+        self.assertEqual(notes.get(title='Two').category, self.category)
+        ideas = Category.objects.get(user=self.user, name='Ideas')
+        self.assertEqual(notes.get(title='Three').category, ideas)
+
+    def test_import_csv(self):
+        """Test importing notes from CSV, including multi-line content"""
+        content = (
+            'title,content,date,category\n'
+            'Groceries,"milk\neggs",2024-02-01,Work\n'
+            'Reading,Dune,2024-02-02,Books\n'
+        )
+        response = self.upload('notes.csv', content)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(Note.objects.get(title='Groceries').content, 'milk\neggs')
+
+    def test_import_markdown(self):
+        """Test importing notes from a Markdown document"""
+        content = (
+            '# Meeting\n'
+            'date: 2024-03-01\n'
+            'category: Work\n'
+            '\n'
+            'Discussed the roadmap.\n'
+            '## Actions\n'
+            '- ship it\n'
+            '# Journal\n'
+            'date: 2024-03-02\n'
+            'category: Personal\n'
+            'Good day.\n'
+        )
+        response = self.upload('notes.md', content)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        meeting = Note.objects.get(title='Meeting')
+        self.assertEqual(meeting.date, date(2024, 3, 1))
+        self.assertEqual(meeting.content, 'Discussed the roadmap.\n## Actions\n- ship it')
+        self.assertEqual(Note.objects.get(title='Journal').category.name, 'Personal')
+
+    def test_import_keeps_unicode_line_separators(self):
+        """Test that U+2028 and other separators inside a record do not split it, in every format"""
+        content = 'Line\u2028separated\x0c# not a heading'
+        record = {'title': 'Separated', 'content': content, 'date': '2024-01-01', 'category': 'Work'}
+        uploads = {
+            'notes.ndjson': json.dumps(record, ensure_ascii=False) + '\n',
+            'notes.csv': f'title,content,date,category\nSeparated,"{content}",2024-01-01,Work\n',
+            'notes.md': f'# Separated\ndate: 2024-01-01\ncategory: Work\n\n{content}\n',
+        }
+        for name, upload in uploads.items():
+            with self.subTest(name):
+                response = self.upload(name, upload)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual((response.data['created'], response.data['failed']), (1, 0), response.data)
+                note = Note.objects.get(user=self.user)
+                self.assertEqual(note.content, content)
+                note.delete()
+
+    def test_import_reports_row_errors(self):
+        """Test that invalid rows are reported while valid rows are imported"""
+        lines = [
+            json.dumps({'title': 'Good', 'content': 'Fine', 'date': '2024-01-01', 'category': 'Work'}),
+            json.dumps({'title': '', 'content': 'No title', 'date': '2024-01-01', 'category': 'Work'}),
+            '{not json',
+            json.dumps({'title': 'Bad date', 'content': 'x', 'date': 'yesterday', 'category': 'Work'}),
+            json.dumps({'title': 'Stolen', 'content': 'x', 'date': '2024-01-01',
+                        'category_id': self.other_user_category.id}),
+            json.dumps({'title': 'No category', 'content': 'x', 'date': '2024-01-01'}),
+        ]
+        response = self.upload('notes.jsonl', '\n'.join(lines))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rows'], 6)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['failed'], 5)
+
+        errors = {error['row']: error['errors'] for error in response.data['errors']}
+        self.assertIn('title', errors[2])
+        self.assertIn('non_field_errors', errors[3])
+        self.assertIn('date', errors[4])
+        self.assertIn('category_id', errors[5])
+        self.assertIn('category_id', errors[6])
+
+        # Nothing was written to the other user's category
+        self.assertFalse(Note.objects.filter(category=self.other_user_category).exists())
+
+    def test_import_small_batches(self):
+        """Test that results are the same when the upload spans many batches"""
+        lines = '\n'.join(
+            json.dumps({'title': f'Note {i}', 'content': 'x', 'date': '2024-01-01',
+                        'category': f'Category {i % 3}'})
+            for i in range(25)
+        )
+        result = import_notes(self.user, [lines.encode()], 'ndjson', batch_size=4)
+        self.assertEqual(result.created, 25)
+        self.assertEqual(result.categories_created, 3)
+        self.assertEqual(Category.objects.filter(user=self.user, name__startswith='Category').count(), 3)
+
+    def test_batches_are_committed_on_their_own(self):
+        """Test that the batches written before a decoding error are kept"""
+        lines = ''.join(
+            json.dumps({'title': f'Note {i}', 'content': 'x', 'date': '2024-01-01', 'category': 'Work'}) + '\n'
+            for i in range(6)
+        )
+        with self.assertRaises(UnicodeDecodeError):
+            import_notes(self.user, [lines.encode(), b'\xff'], 'ndjson', batch_size=4)
+        self.assertEqual(Note.objects.filter(user=self.user).count(), 4)
+
+    def test_import_rejects_surrogate_characters(self):
+        """Test that content is held to the same character rules as the API"""
+        lines = json.dumps({'title': 'Odd', 'content': 'bad \ud800 char', 'date': '2024-01-01',
+                            'category': 'Work'})
+        result = import_notes(self.user, [lines.encode()], 'ndjson')
+        self.assertEqual(result.created, 0)
+        self.assertIn('content', result.errors[0]['errors'])
+
+    def test_import_requires_format(self):
+        """Test that an unknown file type is rejected"""
+        response = self.upload('notes.txt', 'whatever')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('format', response.data)
+
+    def test_import_requires_authentication(self):
+        """Test that unauthenticated imports are rejected"""
+        self.client.credentials()
+        response = self.upload('notes.ndjson', '')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_import_command(self):
+        """Test the import_notes management command"""
+        with NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            handle.write('title,content,date,category\nFrom CLI,Body,2024-05-05,Work\n')
+
+        out = StringIO()
+        call_command('import_notes', handle.name, email=self.user.email, stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['created'], 1)
+        self.assertTrue(Note.objects.filter(user=self.user, title='From CLI').exists())
+
+
+class ImportParsingTests(TestCase):
+    def test_lines_split_across_chunks(self):
+        """Test that lines and multi-byte characters can span chunk boundaries"""
+        data = 'first line\r\nsecond – line\nthird'.encode('utf-8')
+        chunks = [data[i:i + 3] for i in range(0, len(data), 3)]
+        self.assertEqual(
+            list(iter_lines(chunks)),
+            ['first line\r\n', 'second – line\n', 'third']
+        )
+
+    def test_lines_only_end_with_newlines(self):
+        """Test that line and paragraph separators, form feeds and the like stay inside their line"""
+        text = 'one\u2028two\u2029\x0b\x0c\x1c\x1d\x1e\x85three\r\nfour\rfive\n'
+        self.assertEqual(list(iter_lines([text.encode('utf-8')])), [
+            'one\u2028two\u2029\x0b\x0c\x1c\x1d\x1e\x85three\r\n', 'four\rfive\n',
+        ])
+
+    def test_markdown_ignores_preamble(self):
+        """Test that text before the first heading is skipped"""
+        records = list(parse_markdown(['intro\n', '# Title\n', 'body\n']))
+        self.assertEqual(records, [{'title': 'Title', 'content': 'body'}])
+
+
+class NoteImportBenchmark(TestCase):
+    def test_import_throughput(self):
+        """Benchmark NDJSON import throughput"""
+        user = User.objects.create_user(username='bench@example.com', email='bench@example.com')
+        rows = scaled(5000)
+        payload = '\n'.join(
+            json.dumps({
+                'title': f'Imported note {i}',
+                'content': 'Lorem ipsum dolor sit amet. ' * 10,
+                'date': '2024-01-01',
+                'category': f'Category {i % 20}',
+            })
+            for i in range(rows)
+        ).encode('utf-8')
+        chunks = [payload[i:i + 65536] for i in range(0, len(payload), 65536)]
+
+        elapsed = timed(lambda: import_notes(user, chunks, 'ndjson'))
+
+        self.assertEqual(Note.objects.filter(user=user).count(), rows)
+        report('import ndjson', rows=rows, seconds=elapsed, notes_per_second=rows / elapsed)
@@ -0,0 +1,191 @@
+import logging
+import threading
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.jobs import Worker, claim_job, enqueue, finish_job, requeue_stale_jobs, task
+from coreapp.models import Job
+
+from .benchmark import report, scaled, timed
+
+calls = []
+calls_lock = threading.Lock()
+
+
+@task('test_record')
+def record(n):
+    with calls_lock:
+        calls.append(n)
+    return {'n': n}
+
+
+@task('test_fail')
+def fail():
+    raise RuntimeError("Boom")
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_unknown_task(self):
+        with self.assertRaises(KeyError):
+            enqueue('no_such_task')
+
+    def test_priority_then_fifo(self):
+        low = enqueue('test_record', {'n': 1})
+        high = enqueue('test_record', {'n': 2}, priority=5)
+        low2 = enqueue('test_record', {'n': 3})
+        enqueue('test_record', {'n': 4}, delay=60)
+
+        order = [claim_job('w').pk for _ in range(3)]
+        self.assertEqual(order, [high.pk, low.pk, low2.pk])
+        # The delayed job is not due yet
+        self.assertIsNone(claim_job('w'))
+
+    def test_success(self):
+        job = enqueue('test_record', {'n': 7})
+        self.assertTrue(Worker(name='w').run_once())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result, {'n': 7})
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(calls, [7])
+        self.assertFalse(Worker(name='w').run_once())
+
+    @override_settings(JOB_BACKOFF_BASE=10)
+    def test_retries_with_backoff(self):
+        """Test that failures are retried later until max_attempts is used up"""
+        job = enqueue('test_fail', max_attempts=3)
+        worker = Worker(name='w')
+        for attempt in (1, 2):
+            with self.assertLogs('coreapp.jobs', logging.ERROR) as logs:
+                self.assertTrue(worker.run_once())
+            self.assertIn('Traceback', logs.output[0])
+            job.refresh_from_db()
+            self.assertEqual(job.status, Job.QUEUED)
+            self.assertEqual(job.attempts, attempt)
+            # Without the traceback, which is only logged
+            self.assertEqual(job.error, "RuntimeError: Boom")
+            delay = (job.run_at - timezone.now()).total_seconds()
+            self.assertGreater(delay, 10 * 2 ** (attempt - 1) * 0.5 - 1)
+            self.assertFalse(worker.run_once())
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+
+        with self.assertLogs('coreapp.jobs', logging.ERROR):
+            self.assertTrue(worker.run_once())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 3)
+
+    @override_settings(JOB_STALE_AFTER=60)
+    def test_stale_jobs_are_requeued(self):
+        job = enqueue('test_record', {'n': 1})
+        claimed = claim_job('dead-worker')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(requeue_stale_jobs(), 1)
+
+        self.assertTrue(Worker(name='live-worker').run_once())
+        # The worker that lost the job cannot overwrite the outcome
+        finish_job(claimed, 'dead-worker', error="Late failure")
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_worker_command(self):
+        for n in range(3):
+            enqueue('test_record', {'n': n})
+        call_command('run_worker', '--burst', '--poll-interval', '0', stdout=StringIO())
+        self.assertEqual(sorted(calls), [0, 1, 2])
+        self.assertEqual(Job.objects.filter(status=Job.SUCCEEDED).count(), 3)
+
+
+class JobAPITests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.other_user = User.objects.create_user(username='otheruser@example.com', email='otheruser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.job = enqueue('test_record', {'n': 1}, user=self.user)
+        self.other_job = enqueue('test_record', {'n': 2}, user=self.other_user)
+
+    def test_list_own_jobs(self):
+        response = self.client.get(reverse('job-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([job['id'] for job in response.data['results']], [self.job.pk])
+
+    def test_poll_status(self):
+        url = reverse('job-detail', kwargs={'pk': self.job.pk})
+        self.assertEqual(self.client.get(url).data['status'], Job.QUEUED)
+        Worker().run(exit_when_empty=True)
+        response = self.client.get(url)
+        self.assertEqual(response.data['status'], Job.SUCCEEDED)
+        self.assertEqual(response.data['result'], {'n': 1})
+
+    def test_other_users_job_is_hidden(self):
+        response = self.client.get(reverse('job-detail', kwargs={'pk': self.other_job.pk}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_jobs_are_read_only(self):
+        response = self.client.post(reverse('job-list'), {'name': 'test_record'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class ConcurrentWorkerTests(TransactionTestCase):
+    def setUp(self):
+        calls.clear()
+        # SQLite test databases answer concurrent writers with lock errors,
+        # which the workers log and retry
+        logger = logging.getLogger('coreapp.jobs')
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.ERROR)
+
+    def run_workers(self, count):
+        workers = [Worker(name=f'worker-{n}', poll_interval=0.01) for n in range(count)]
+
+        def work(worker):
+            try:
+                worker.run(exit_when_empty=True)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(worker,)) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return workers
+
+    def test_throughput(self):
+        """Test that concurrent workers run every job exactly once, and measure jobs per second"""
+        jobs = scaled(200)
+        results = {}
+        for count in (1, 4):
+            calls.clear()
+            Job.objects.all().delete()
+            Job.objects.bulk_create([
+                Job(name='test_record', payload={'n': n}, run_at=timezone.now()) for n in range(jobs)
+            ])
+            workers = []
+            elapsed = timed(lambda: workers.extend(self.run_workers(count)))
+
+            self.assertEqual(sorted(calls), list(range(jobs)))
+            self.assertEqual(Job.objects.filter(status=Job.SUCCEEDED, attempts=1).count(), jobs)
+            self.assertEqual(sum(worker.processed for worker in workers), jobs)
+            results[count] = jobs / elapsed
+
+        report(
+            'job_queue', jobs=jobs, vendor=connection.vendor,
+            one_worker_per_s=results[1], four_workers_per_s=results[4],
+        )
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.servers.basehttp import WSGIServer
+from django.test import LiveServerTestCase, SimpleTestCase, override_settings
+from django.test.testcases import LiveServerThread, QuietWSGIRequestHandler
+
+from coreapp.loadtest import Connection, ProtocolError, latency_summary, parse_mix
+
+
+class HelperTests(SimpleTestCase):
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('list=3, create=1'), {'list': 3.0, 'create': 1.0})
+        for text in ('browse=1', 'list=x', 'list=-1', 'list=0'):
+            with self.assertRaises(ValueError):
+                parse_mix(text)
+
+    def test_latency_summary(self):
+        summary = latency_summary([n / 1000 for n in range(1, 101)])
+        self.assertEqual((summary['p50'], summary['p99'], summary['max']), (50, 99, 100))
+        self.assertAlmostEqual(summary['mean'], 50.5)
+        self.assertEqual(latency_summary([]), {})
+
+    def test_retries(self):
+        async def serve(reader, writer):
+            # Answers the first request of each connection, then closes it on the next
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+            await writer.drain()
+            await reader.readuntil(b'\r\n\r\n')
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(serve, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            connection = Connection('127.0.0.1', port)
+            try:
+                self.assertEqual((await connection.request('GET', '/'))[0], 200)
+                # An idempotent request is sent again on a new connection
+                self.assertEqual((await connection.request('GET', '/'))[0], 200)
+                # Another might have had its effect
+                with self.assertRaises(ProtocolError):
+                    await connection.request('POST', '/')
+            finally:
+                connection.close()
+                server.close()
+                await server.wait_closed()
+
+        asyncio.run(run())
+
+
+class SingleThreadedServerThread(LiveServerThread):
+    # The test database is one SQLite connection, which concurrent requests
+    # cannot share. Django closes the connection after each response then
+    def _create_server(self, connections_override=None):
+        return WSGIServer((self.host, self.port), QuietWSGIRequestHandler, allow_reuse_address=False)
+
+
+# Writes of many virtual users from one address would hit the rate limits
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], REST_FRAMEWORK={
+    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'PAGE_SIZE': 10,
+    'DEFAULT_AUTHENTICATION_CLASSES': ('rest_framework_simplejwt.authentication.JWTAuthentication',),
+    'DEFAULT_THROTTLE_CLASSES': (),
+})
+class LoadTestCommandTests(LiveServerTestCase):
+    server_thread_class = SingleThreadedServerThread
+
+    def run_loadtest(self, *args):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            out = StringIO()
+            call_command(
+                'loadtest', '--url', self.live_server_url, '--users', '2', '--duration', '0.5', '--seed', '1',
+                '--output', path, *args, stdout=out,
+            )
+            with open(path) as results:
+                return json.load(results), out.getvalue()
+
+    def test_closed_loop(self):
+        results, out = self.run_loadtest('--mix', 'list=2,filter=1,create=2,update=1,delete=1')
+        self.assertEqual(results['mode'], 'closed')
+        self.assertGreater(results['requests'], 0)
+        self.assertEqual(results['errors'], 0, results['statuses'])
+        self.assertEqual(set(results['operations']), {'list', 'filter', 'create', 'update', 'delete'})
+        self.assertLessEqual(results['latency_ms']['p50'], results['latency_ms']['p99'])
+        self.assertIn('Statuses:', out)
+        # The virtual users were created with the registration's categories
+        self.assertEqual(User.objects.filter(email__startswith='loadtest-').count(), 2)
+        self.assertGreater(results['operations']['create']['statuses']['201'], 0)
+
+    def test_open_loop_with_logins(self):
+        results, _ = self.run_loadtest('--mode', 'open', '--rate', '40', '--mix', 'list=5,login=1')
+        self.assertEqual(results['mode'], 'open')
+        self.assertEqual(results['rate'], 40)
+        self.assertGreater(results['operations']['list']['requests'], 0)
+        self.assertEqual(results['operations']['list']['errors'], 0)
+
+    def test_unreachable_server(self):
+        with self.assertRaises(CommandError):
+            call_command('loadtest', '--url', 'http://127.0.0.1:9', '--users', '1', '--duration', '0.1',
+                         stdout=StringIO())
@@ -0,0 +1,169 @@
+import io
+import json
+import logging
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.logs import BackgroundHandler, JSONFormatter, RequestIDFilter, SamplingFilter, request_logger
+
+from .benchmark import report, scaled, timed
+
+
+class SlowStream(io.StringIO):
+    """A stream taking `delay` seconds per write, and blocked while `paused` is clear"""
+
+    def __init__(self, delay=0):
+        super().__init__()
+        self.delay = delay
+        self.paused = threading.Event()
+        self.paused.set()
+
+    def write(self, text):
+        self.paused.wait()
+        if self.delay:
+            time.sleep(self.delay)
+        return super().write(text)
+
+
+def lines(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+class LoggerTestMixin:
+    def make_logger(self, handler, name='coreapp.tests.logs'):
+        logger = logging.getLogger(name)
+        self.addCleanup(setattr, logger, 'handlers', logger.handlers)
+        self.addCleanup(setattr, logger, 'propagate', logger.propagate)
+        self.addCleanup(logger.setLevel, logger.level)
+        self.addCleanup(handler.close)
+        logger.handlers, logger.propagate = [handler], False
+        logger.setLevel(logging.INFO)
+        return logger
+
+
+class BackgroundHandlerTests(LoggerTestMixin, SimpleTestCase):
+    def test_json_records(self):
+        stream = io.StringIO()
+        handler = BackgroundHandler(stream)
+        logger = self.make_logger(handler)
+        values = {'note_id': 3}
+        logger.info('Saved %s', 'note', extra={'fields': values, 'at': time})
+        # Changed after the call, the record keeps the message
+        values['note_id'] = 4
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception('Failed')
+        handler.flush()
+
+        saved, failed = lines(stream)
+        self.assertEqual(saved['message'], 'Saved note')
+        self.assertEqual((saved['level'], saved['logger']), ('INFO', 'coreapp.tests.logs'))
+        self.assertIn('fields', saved)
+        self.assertIn("module 'time'", saved['at'])
+        self.assertIn('ZeroDivisionError', failed['exception'])
+        self.assertNotIn('request_id', failed)
+
+    def test_records_are_dropped_when_the_output_falls_behind(self):
+        stream = SlowStream()
+        stream.paused.clear()
+        handler = BackgroundHandler(stream, maxsize=10)
+        logger = self.make_logger(handler)
+        start = time.perf_counter()
+        for n in range(30):
+            logger.info('Record %s', n)
+        self.assertLess(time.perf_counter() - start, 1)
+
+        stream.paused.set()
+        handler.flush()
+        logger.info('Caught up')
+        handler.flush()
+        records = lines(stream)
+        # The listener holds one record while the queue fills up
+        self.assertIn(len(records), (11, 12, 13))
+        dropped = [record for record in records if record['message'].startswith('Dropped')]
+        self.assertEqual(len(dropped), 1)
+        self.assertEqual(records[-1]['message'], 'Caught up')
+
+    def test_sampling(self):
+        sampler = SamplingFilter(rate=0)
+        info = logging.makeLogRecord({'levelno': logging.INFO})
+        warning = logging.makeLogRecord({'levelno': logging.WARNING})
+        self.assertFalse(sampler.filter(info))
+        self.assertTrue(sampler.filter(warning))
+        self.assertTrue(SamplingFilter(rate=1).filter(info))
+
+
+class RequestLogTests(LoggerTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.stream = io.StringIO()
+        self.handler = BackgroundHandler(self.stream)
+        self.handler.addFilter(RequestIDFilter())
+        self.make_logger(self.handler, request_logger.name)
+
+    def test_request_id(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        response = self.client.get(reverse('category-list'), HTTP_X_REQUEST_ID='abc-123')
+        self.assertEqual(response['X-Request-ID'], 'abc-123')
+        generated = self.client.get(reverse('category-list'), HTTP_X_REQUEST_ID='no spaces allowed')['X-Request-ID']
+        self.assertRegex(generated, r'^[0-9a-f]{32}$')
+        self.handler.flush()
+
+        first, second = lines(self.stream)
+        self.assertEqual(first['request_id'], 'abc-123')
+        self.assertEqual(second['request_id'], generated)
+        self.assertEqual(
+            {key: first[key] for key in ('method', 'path', 'status', 'user_id')},
+            {'method': 'GET', 'path': '/api/categories/', 'status': 200, 'user_id': self.user.pk},
+        )
+        self.assertEqual(first['level'], 'INFO')
+
+    def test_client_errors_are_logged_once(self):
+        # By the request record, not by Django too
+        self.assertFalse(logging.getLogger('django.request').isEnabledFor(logging.WARNING))
+        # Or above, with a higher LOG_LEVEL
+        self.assertEqual(
+            logging.getLogger('django.request').level, max(logging.ERROR, logging.getLogger().level)
+        )
+        self.assertEqual(logging.getLogger('django').handlers, [])
+
+    def test_registration_errors_are_logged(self):
+        with self.assertLogs('coreapp.views', logging.INFO) as logs:
+            response = self.client.post(reverse('register'), {'email': 'not an email'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('email', logs.records[0].errors)
+
+
+class LoggingBenchmarkTests(LoggerTestMixin, SimpleTestCase):
+    def test_cost_per_record(self):
+        """Time spent in the logging call with a slow output, written synchronously and in the background"""
+        count = scaled(500)
+
+        def cost(handler, stream):
+            logger = self.make_logger(handler)
+            seconds = timed(lambda: [
+                logger.info('GET %s 200', '/api/notes/', extra={'status': 200, 'duration_ms': 3.5})
+                for _ in range(count)
+            ])
+            handler.flush()
+            self.assertEqual(len(stream.getvalue().splitlines()), count)
+            return seconds / count
+
+        stream = SlowStream(delay=0.0001)
+        synchronous = logging.StreamHandler(stream)
+        synchronous.setFormatter(JSONFormatter())
+        synchronous_seconds = cost(synchronous, stream)
+        stream = SlowStream(delay=0.0001)
+        background_seconds = cost(BackgroundHandler(stream, maxsize=count), stream)
+        report(
+            'logging', records=count, synchronous_us=synchronous_seconds * 1e6,
+            background_us=background_seconds * 1e6,
+        )
@@ -0,0 +1,227 @@
+import json
+import random
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.models import BODY_PLAIN, BODY_ZLIB, Category, Note, NoteBody
+
+from .benchmark import report, scaled, timed
+
+
+class NoteBodyStorageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+
+    def create_note(self, content, **kwargs):
+        return Note.objects.create(
+            title="A note", content=content, date=date(2024, 1, 1),
+            category=self.category, user=self.user, **kwargs
+        )
+
+    def test_small_bodies_are_stored_plain(self):
+        """Test that short bodies are not compressed"""
+        note = self.create_note("Short and sweet ✓")
+        body = NoteBody.objects.get(note=note)
+        self.assertEqual(body.codec, BODY_PLAIN)
+        self.assertEqual(body.text, "Short and sweet ✓")
+        self.assertEqual(body.size, len("Short and sweet ✓".encode('utf-8')))
+
+    def test_large_bodies_are_compressed(self):
+        """Test that bodies above the threshold are stored compressed"""
+        content = "Repetitive meeting notes. " * 200
+        note = self.create_note(content)
+        body = NoteBody.objects.get(note=note)
+        self.assertEqual(body.codec, BODY_ZLIB)
+        self.assertLess(len(body.data), body.size)
+        self.assertEqual(Note.objects.get(pk=note.pk).content, content)
+
+    @override_settings(NOTE_BODY_COMPRESSION_THRESHOLD=10)
+    def test_threshold_is_configurable(self):
+        note = self.create_note("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa")
+        self.assertEqual(NoteBody.objects.get(note=note).codec, BODY_ZLIB)
+
+    def test_content_is_loaded_lazily(self):
+        """Test that metadata queries never read the body table"""
+        note = self.create_note("Lazy body")
+
+        with self.assertNumQueries(1):
+            loaded = Note.objects.get(pk=note.pk)
+            self.assertEqual(loaded.title, "A note")
+        with self.assertNumQueries(1):
+            self.assertEqual(loaded.content, "Lazy body")
+        with self.assertNumQueries(0):
+            self.assertEqual(loaded.content, "Lazy body")
+        with self.assertNumQueries(1):
+            self.assertEqual(Note.objects.with_content().get(pk=note.pk).content, "Lazy body")
+
+        sql = str(Note.objects.filter(user=self.user).values('id', 'title', 'date').query)
+        self.assertNotIn('notebody', sql.lower())
+
+    def test_updating_content(self):
+        """Test that saving a note rewrites its body, and only when changed"""
+        note = self.create_note("Before")
+        note.content = "After"
+        note.save()
+        self.assertEqual(NoteBody.objects.get(note=note).text, "After")
+
+        note = Note.objects.get(pk=note.pk)
+        note.title = "Renamed"
+        # The note row and the user's last activity, never the body
+        with self.assertNumQueries(2):
+            note.save(update_fields=['title'])
+
+        note.content = "Only the body"
+        note.save(update_fields=['content'])
+        note.refresh_from_db()
+        self.assertEqual(note.title, "Renamed")
+        self.assertEqual(note.content, "Only the body")
+
+    def test_refresh_from_db_reloads_content(self):
+        note = self.create_note("Original")
+        other = Note.objects.get(pk=note.pk)
+        other.content = "Changed elsewhere"
+        other.save()
+
+        note.refresh_from_db(fields=['content'])
+        self.assertEqual(note.content, "Changed elsewhere")
+
+    def test_bulk_create_writes_bodies(self):
+        """Test that bulk_create stores the bodies of the created notes"""
+        notes = Note.objects.bulk_create([
+            Note(title=f"Bulk {i}", content=f"Body {i}", date=date(2024, 1, 1),
+                 category=self.category, user=self.user)
+            for i in range(5)
+        ])
+        self.assertEqual(NoteBody.objects.filter(note__in=notes).count(), 5)
+        self.assertEqual(Note.objects.get(title="Bulk 3").content, "Body 3")
+
+    def test_deleting_note_deletes_body(self):
+        note = self.create_note("Gone soon")
+        note.delete()
+        self.assertFalse(NoteBody.objects.exists())
+
+
+class NoteBodyAPITests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+
+    def test_api_contract_is_unchanged(self):
+        """Test that notes are created and returned with an inline content field and its metadata"""
+        content = "Long body." * 500
+        response = self.client.post(reverse('note-list'), data=json.dumps({
+            'title': 'Big', 'content': content, 'date': '2024-01-01', 'category_id': self.category.id,
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['content'], content)
+
+        response = self.client.get(reverse('note-detail', kwargs={'pk': response.data['id']}))
+        self.assertEqual(response.data['content'], content)
+        self.assertEqual(
+            list(response.data.keys()),
+            [
+                'id', 'title', 'content', 'date', 'category', 'version', 'created_at', 'updated_at',
+                'char_count', 'word_count', 'preview', 'content_hash', 'has_checklist',
+            ]
+        )
+
+    def test_blank_content_is_rejected(self):
+        response = self.client.post(reverse('note-list'), data=json.dumps({
+            'title': 'Empty', 'content': '', 'date': '2024-01-01', 'category_id': self.category.id,
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('content', response.data)
+
+    def test_list_query_count_is_constant(self):
+        """Test that listing notes loads bodies and categories without N+1 queries"""
+        Note.objects.bulk_create([
+            Note(title=f"Note {i}", content=f"Body {i}", date=date(2024, 1, 1),
+                 category=self.category, user=self.user)
+            for i in range(10)
+        ])
+        self.client.get(reverse('note-list'))  # Warm up the user and token lookups
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('note-list'))
+        self.assertEqual(len(response.data['results']), 10)
+
+
+class NoteBodyBenchmark(TestCase):
+    def test_table_size_and_metadata_queries(self):
+        """Benchmark the note table size and metadata query time against inline bodies"""
+        user = User.objects.create_user(username='bench@example.com', email='bench@example.com')
+        category = Category.objects.create(name="Work", colour="#FF5733", user=user)
+        rng = random.Random(0)
+        words = 'the quick brown fox jumps over lazy dog notes meeting plan idea'.split()
+        count = scaled(500)
+        notes = Note.objects.bulk_create([
+            Note(
+                title=f"Note {i}",
+                content=' '.join(rng.choices(words, k=rng.randint(50, 2000))),
+                date=date(2024, 1, 1),
+                category=category,
+                user=user,
+            )
+            for i in range(count)
+        ])
+
+        # The pre-NoteBody layout, with the body stored inline
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE bench_inline_note (id integer PRIMARY KEY, title varchar(200), '
+                'content text, date date, user_id integer)'
+            )
+            cursor.executemany(
+                'INSERT INTO bench_inline_note (id, title, content, date, user_id) VALUES (%s, %s, %s, %s, %s)',
+                [(note.pk, note.title, note.content, note.date, user.pk) for note in notes]
+            )
+
+        def metadata(table):
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT id, title, date FROM {table} WHERE user_id = %s', [user.pk])
+                return cursor.fetchall()
+
+        inline_ms = timed(lambda: metadata('bench_inline_note'), repeat=5) * 1000
+        split_ms = timed(lambda: metadata(Note._meta.db_table), repeat=5) * 1000
+
+        raw = sum(NoteBody.objects.values_list('size', flat=True))
+        stored = sum(len(data) for data in NoteBody.objects.values_list('data', flat=True))
+        self.assertLess(stored, raw)
+
+        sizes = {}
+        for table in ('bench_inline_note', Note._meta.db_table, NoteBody._meta.db_table):
+            sizes[table] = self.table_size(table)
+
+        report(
+            'note body storage',
+            notes=count,
+            raw_body_bytes=raw,
+            stored_body_bytes=stored,
+            inline_table_bytes=sizes['bench_inline_note'],
+            note_table_bytes=sizes[Note._meta.db_table],
+            body_table_bytes=sizes[NoteBody._meta.db_table],
+            inline_metadata_ms=inline_ms,
+            split_metadata_ms=split_ms,
+        )
+
+    def table_size(self, table):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT pg_total_relation_size(%s)', [table])
+            elif connection.vendor == 'sqlite':
+                try:
+                    cursor.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = %s', [table])
+                except Exception:
+                    return None
+            else:
+                return None
+            return cursor.fetchone()[0]
@@ -0,0 +1,201 @@
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.filters import MAX_IDS, filter_notes
+from coreapp.models import Category, Note
+
+
+class NoteFilterAPITests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.other_user = User.objects.create_user(username='otheruser@example.com', email='otheruser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.list_url = reverse('note-list')
+
+        self.work = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.home = Category.objects.create(name="Home", colour="#33FF57", user=self.user)
+        self.ideas = Category.objects.create(name="Ideas", colour="#3357FF", user=self.user)
+        self.other_category = Category.objects.create(name="Other", colour="#000000", user=self.other_user)
+
+        self.notes = []
+        for day, (title, category) in enumerate([
+            ("Alpha", self.work), ("Bravo", self.home), ("Charlie", self.ideas),
+            ("Delta", self.work), ("Echo", self.home),
+        ], start=1):
+            self.notes.append(Note.objects.create(
+                title=title, content=f"{title} content", date=date(2024, 1, day),
+                category=category, user=self.user
+            ))
+        self.other_note = Note.objects.create(
+            title="Foxtrot", content="Other content", date=date(2024, 1, 3),
+            category=self.other_category, user=self.other_user
+        )
+
+    def titles(self, params):
+        response = self.client.get(self.list_url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return [note['title'] for note in response.data['results']]
+
+    def test_default_ordering(self):
+        self.assertEqual(self.titles({}), ["Echo", "Delta", "Charlie", "Bravo", "Alpha"])
+
+    def test_single_category(self):
+        self.assertEqual(self.titles({'category': self.work.id}), ["Delta", "Alpha"])
+
+    def test_multiple_categories(self):
+        """Test that categories can be repeated or comma separated"""
+        expected = ["Echo", "Delta", "Bravo", "Alpha"]
+        self.assertEqual(self.titles({'category': [self.work.id, self.home.id]}), expected)
+        self.assertEqual(self.titles({'category': f'{self.work.id},{self.home.id}'}), expected)
+
+    def test_other_users_category_matches_nothing(self):
+        self.assertEqual(self.titles({'category': self.other_category.id}), [])
+
+    def test_date_range(self):
+        self.assertEqual(self.titles({'date_from': '2024-01-02', 'date_to': '2024-01-04'}), ["Delta", "Charlie", "Bravo"])
+        self.assertEqual(self.titles({'date_from': '2024-01-04'}), ["Echo", "Delta"])
+        self.assertEqual(self.titles({'date_to': '2024-01-01'}), ["Alpha"])
+
+    def test_updated_since(self):
+        old = timezone.now() - timedelta(days=10)
+        Note.objects.filter(pk__in=[note.pk for note in self.notes[:3]]).update(updated_at=old)
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        self.assertEqual(self.titles({'updated_since': since}), ["Echo", "Delta"])
+
+    def test_ids(self):
+        ids = f'{self.notes[0].id},{self.notes[2].id},{self.other_note.id}'
+        self.assertEqual(self.titles({'ids': ids}), ["Charlie", "Alpha"])
+
+    def test_ordering(self):
+        self.assertEqual(self.titles({'ordering': 'title'}), ["Alpha", "Bravo", "Charlie", "Delta", "Echo"])
+        self.assertEqual(self.titles({'ordering': '-title'}), ["Echo", "Delta", "Charlie", "Bravo", "Alpha"])
+        self.assertEqual(self.titles({'ordering': 'date'}), ["Alpha", "Bravo", "Charlie", "Delta", "Echo"])
+
+    def test_combined_filters(self):
+        params = {'category': f'{self.work.id},{self.ideas.id}', 'date_from': '2024-01-02', 'ordering': 'title'}
+        self.assertEqual(self.titles(params), ["Charlie", "Delta"])
+
+    def test_invalid_parameters(self):
+        """Test that malformed parameters are rejected before querying"""
+        for params in (
+            {'category': 'abc'},
+            {'category': '0'},
+            {'ids': '1,x'},
+            {'ids': ','.join(str(n) for n in range(1, MAX_IDS + 2))},
+            {'date_from': '2024-13-01'},
+            {'date_from': '2024-01-05', 'date_to': '2024-01-01'},
+            {'updated_since': 'yesterday'},
+            {'ordering': 'content'},
+            {'ordering': 'user'},
+            {'min_words': '-1'},
+            {'min_words': '9', 'max_words': '3'},
+            {'has_checklist': 'maybe'},
+            {'content_hash': 'abc'},
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.list_url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+            self.assertFalse([q for q in queries if Note._meta.db_table in q['sql']], params)
+
+    def test_filters_ignored_on_detail(self):
+        url = reverse('note-detail', kwargs={'pk': self.notes[0].pk})
+        response = self.client.get(url, {'category': self.home.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class NoteFilterQueryPlanTests(TestCase):
+    """
+    Check that every supported filter combination is answered from an index.
+
+    Each combination lists the indexes that can serve it; the planner may
+    prefer the one matching the ordering over the one matching a filter.
+    """
+
+    COMBINATIONS = [
+        ({}, {'note_user_date_idx'}),
+        ({'ordering': 'date'}, {'note_user_date_idx'}),
+        ({'ordering': '-updated_at'}, {'note_user_updated_idx'}),
+        ({'ordering': 'title'}, {'note_user_title_idx'}),
+        ({'category': '1'}, {'note_user_category_idx'}),
+        ({'category': '1,2,3'}, {'note_user_category_idx', 'note_user_date_idx'}),
+        ({'category': '1', 'ordering': 'title'}, {'note_user_category_idx', 'note_user_title_idx'}),
+        ({'date_from': '2024-01-01'}, {'note_user_date_idx'}),
+        ({'date_from': '2024-01-01', 'date_to': '2024-02-01'}, {'note_user_date_idx'}),
+        ({'category': '1,2', 'date_from': '2024-01-01', 'date_to': '2024-02-01'},
+         {'note_user_category_idx', 'note_user_date_idx'}),
+        ({'updated_since': '2024-01-01T00:00:00Z'}, {'note_user_updated_idx'}),
+        ({'updated_since': '2024-01-01T00:00:00Z', 'ordering': '-updated_at'}, {'note_user_updated_idx'}),
+        ({'updated_since': '2024-01-01T00:00:00Z', 'category': '1'},
+         {'note_user_updated_idx', 'note_user_category_idx'}),
+        ({'updated_since': '2024-01-01T00:00:00Z', 'date_from': '2024-01-01'},
+         {'note_user_updated_idx', 'note_user_date_idx'}),
+        ({'ids': '1,2,3'}, {'primary key'}),
+        ({'ids': '1,2,3', 'category': '1'}, {'primary key', 'note_user_category_idx'}),
+        ({'ordering': '-word_count'}, {'note_user_words_idx'}),
+        ({'ordering': 'char_count'}, {'note_user_chars_idx'}),
+        ({'min_words': '5', 'max_words': '50'}, {'note_user_words_idx'}),
+        ({'has_checklist': 'true'}, {'note_user_checklist_idx', 'note_user_date_idx'}),
+        ({'content_hash': '0' * 64}, {'note_user_content_hash_idx', 'note_user_date_idx'}),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        categories = [
+            Category.objects.create(name=f"Category {n}", colour="#FF5733", user=cls.user)
+            for n in range(3)
+        ]
+        Note.objects.bulk_create([
+            Note(
+                title=f"Note {n}", content="", date=date(2024, 1, 1) + timedelta(days=n % 90),
+                category=categories[n % 3], user=cls.user
+            )
+            for n in range(300)
+        ])
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # Small tables are cheaper to scan, make the planner show its
+            # index choice anyway
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def plan(self, params):
+        queryset = Note.objects.filter(user=self.user).select_related('category').with_content()
+        return filter_notes(queryset, QueryDict(urlencode(params))).explain()
+
+    def note_access(self, plan):
+        """Return the plan lines reading the note table"""
+        table = Note._meta.db_table
+        if connection.vendor == 'sqlite':
+            return [line for line in plan.splitlines() if f' {table} ' in f'{line} ']
+        return [line for line in plan.splitlines() if f' on {table} ' in f'{line} ' or 'Bitmap Index Scan on note_' in line]
+
+    def test_filter_combinations_use_indexes(self):
+        for params, indexes in self.COMBINATIONS:
+            with self.subTest(params=params):
+                plan = self.plan(params)
+                lines = self.note_access(plan)
+                self.assertTrue(lines, plan)
+                for line in lines:
+                    self.assertNotIn('Seq Scan', line, plan)
+                    if connection.vendor == 'sqlite':
+                        # A bare SCAN reads the whole table
+                        self.assertFalse(line.strip().endswith(f'SCAN {Note._meta.db_table}'), plan)
+                used = {
+                    index for index in indexes
+                    if index in plan or (index == 'primary key' and ('PRIMARY KEY' in plan or 'pkey' in plan))
+                }
+                self.assertTrue(used, plan)
@@ -0,0 +1,182 @@
+import hashlib
+from importlib import import_module
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.archive import archive_user_notes
+from coreapp.jobs import Worker
+from coreapp.models import METADATA_FIELDS, PREVIEW_LENGTH, ArchivedNote, Category, Job, Note, content_metadata
+
+from .benchmark import report, scaled, timed
+
+CHECKLIST = "# Groceries\n\n- [ ] **Milk**\n- [x] Eggs\n\nAsk `Sam` about bread"
+
+
+class ContentMetadataTests(TestCase):
+    def test_content_metadata(self):
+        metadata = content_metadata(CHECKLIST)
+        self.assertEqual(metadata['char_count'], len(CHECKLIST))
+        self.assertEqual(metadata['word_count'], 13)
+        self.assertEqual(metadata['preview'], "Groceries Milk Eggs Ask Sam about bread")
+        self.assertEqual(metadata['content_hash'], hashlib.sha256(CHECKLIST.encode()).hexdigest())
+        self.assertTrue(metadata['has_checklist'])
+        self.assertFalse(content_metadata("I [x] marked it")['has_checklist'])
+
+        preview = content_metadata("lorem " * 100)['preview']
+        self.assertLessEqual(len(preview), PREVIEW_LENGTH)
+        self.assertTrue(preview.endswith("lorem…"))
+
+
+class NoteMetadataTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.list_url = reverse('note-list')
+
+    def create_note(self, title, content):
+        return Note.objects.create(title=title, content=content, date='2024-01-01', category=self.category,
+                                   user=self.user)
+
+    def assertMetadata(self, note, content):
+        note = Note.objects.get(pk=note.pk)
+        self.assertEqual({field: getattr(note, field) for field in METADATA_FIELDS}, content_metadata(content))
+
+    def test_computed_when_the_content_is_saved(self):
+        note = self.create_note("List", CHECKLIST)
+        self.assertMetadata(note, CHECKLIST)
+        note.content = "Just two"
+        note.save(update_fields=['content'])
+        self.assertMetadata(note, "Just two")
+
+        note.title = "Renamed"
+        with self.assertNumQueries(2):
+            note.save(update_fields=['title'])
+        self.assertMetadata(note, "Just two")
+
+        notes = Note.objects.bulk_create([
+            Note(title="Bulk", content=CHECKLIST, date='2024-01-01', category=self.category, user=self.user)
+        ])
+        self.assertMetadata(notes[0], CHECKLIST)
+
+    def test_served_without_reading_the_bodies(self):
+        self.create_note("List", CHECKLIST)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.list_url, {'has_checklist': 'true', 'ordering': '-word_count'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        note = response.json()['results'][0]
+        self.assertEqual(note['preview'], "Groceries Milk Eggs Ask Sam about bread")
+        self.assertEqual((note['word_count'], note['has_checklist']), (13, True))
+        listing = [query['sql'] for query in queries.captured_queries if 'ORDER BY' in query['sql']][-1]
+        self.assertIn('word_count', listing)
+
+    def test_read_only(self):
+        note = self.create_note("Note", "One two three")
+        response = self.client.patch(
+            reverse('note-detail', kwargs={'pk': note.pk}), {'word_count': 99, 'content': "One two"}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['word_count'], 2)
+
+    def test_filters_and_ordering(self):
+        short = self.create_note("Short", "One two")
+        long = self.create_note("Long", "One two three four five six")
+        checklist = self.create_note("List", CHECKLIST)
+
+        def titles(params):
+            response = self.client.get(self.list_url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+            return [note['title'] for note in response.json()['results']]
+
+        self.assertEqual(titles({'ordering': 'word_count'}), ["Short", "Long", "List"])
+        self.assertEqual(titles({'ordering': '-char_count'}), ["List", "Long", "Short"])
+        self.assertEqual(titles({'min_words': 3, 'max_words': 10}), ["Long"])
+        self.assertEqual(titles({'has_checklist': 'false', 'ordering': 'title'}), ["Long", "Short"])
+        self.assertEqual(titles({'content_hash': short.content_hash}), ["Short"])
+
+        # The archived notes keep theirs
+        Note.objects.filter(pk__in=[long.pk, checklist.pk]).update(updated_at=timezone.now() - timedelta(days=400))
+        archive_user_notes(self.user.pk)
+        self.assertEqual(ArchivedNote.objects.get(pk=checklist.pk).word_count, 13)
+        self.assertEqual(titles({'include_archived': 'true', 'ordering': 'word_count'}), ["Short", "Long", "List"])
+        self.assertEqual(titles({'include_archived': 'true', 'has_checklist': 'true'}), ["List"])
+        response = self.client.patch(reverse('note-detail', kwargs={'pk': long.pk}), {'title': "Restored"},
+                                     format='json')
+        self.assertEqual(response.json()['word_count'], 6)
+
+    def test_backfill(self):
+        notes = [self.create_note(f"Note {n}", "Some words " * n) for n in range(5)]
+        Note.objects.update(char_count=0, word_count=0, preview='', content_hash='', has_checklist=False)
+        Note.objects.filter(pk=notes[0].pk).update(updated_at=timezone.now() - timedelta(days=400))
+        archive_user_notes(self.user.pk)
+        updated_at = Note.objects.get(pk=notes[1].pk).updated_at
+
+        out = StringIO()
+        call_command('backfill_note_metadata', stdout=out)
+        self.assertEqual(Job.objects.filter(name='backfill_note_metadata').count(), 1)
+        self.assertTrue(Worker(name='w').run_once())
+        self.assertEqual(Job.objects.get(name='backfill_note_metadata').result, {'updated': 5, 'remaining': False})
+        for note in notes[1:]:
+            self.assertMetadata(note, "Some words " * notes.index(note))
+        self.assertEqual(ArchivedNote.objects.get(pk=notes[0].pk).content_hash, content_metadata('')['content_hash'])
+        self.assertEqual(Note.objects.get(pk=notes[1].pk).updated_at, updated_at)
+
+        call_command('backfill_note_metadata', '--now', stdout=out)
+        self.assertIn('Updated 0 notes', out.getvalue())
+
+    def test_migration_queues_the_backfill(self):
+        migration = import_module('coreapp.migrations.0014_queue_note_metadata_backfill')
+        # All the function reads of the schema editor
+        schema_editor = SimpleNamespace(connection=connection)
+        migration.queue_backfill(apps, schema_editor)
+        self.assertFalse(Job.objects.exists())
+
+        self.create_note("Note", "Some words")
+        Note.objects.update(content_hash='')
+        migration.queue_backfill(apps, schema_editor)
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.payload), ('backfill_note_metadata', {'shard': 'default'}))
+
+
+class NoteMetadataBenchmarkTests(TestCase):
+    def test_sorting_by_word_count(self):
+        """Sorting notes by word count, from the stored column and from the bodies"""
+        user = User.objects.create_user(username='bench@example.com', email='bench@example.com')
+        category = Category.objects.create(name="Work", colour="#000000", user=user)
+        count = scaled(2000)
+        Note.objects.bulk_create([
+            Note(title=f"Note {n}", content="Lorem ipsum dolor sit amet " * (n % 50), date='2024-01-01',
+                 category=category, user=user)
+            for n in range(count)
+        ])
+        notes = Note.objects.filter(user=user)
+
+        def from_bodies():
+            return sorted(notes.with_content(), key=lambda note: len(note.content.split()))[-20:]
+
+        def from_column():
+            return list(notes.order_by('-word_count', '-id')[:20])
+
+        bodies_seconds = timed(from_bodies, repeat=3)
+        column_seconds = timed(from_column, repeat=3)
+        report('note_metadata', notes=count, bodies_ms=bodies_seconds * 1000, column_ms=column_seconds * 1000)
+        # Sorted in one query on the indexed column, no body read
+        with CaptureQueriesContext(connection) as queries:
+            from_column()
+        self.assertEqual(len(queries), 1)
+        self.assertIn('word_count', queries[0]['sql'])
+        self.assertNotIn('coreapp_notebody', queries[0]['sql'])
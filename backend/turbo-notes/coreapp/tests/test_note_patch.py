@@ -0,0 +1,145 @@
+import json
+import random
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.models import Category, Note
+from coreapp.textpatch import PatchError, apply_patch
+
+from .benchmark import report, scaled, timed
+
+
+class ApplyPatchTests(TestCase):
+    def test_operations(self):
+        """Test retain, insert and delete operations"""
+        self.assertEqual(apply_patch('hello world', [6, -5, 'there']), 'hello there')
+        self.assertEqual(apply_patch('hello', ['>> ']), '>> hello')
+        self.assertEqual(apply_patch('hello', [5, '!']), 'hello!')
+        self.assertEqual(apply_patch('hello', [-5]), '')
+        self.assertEqual(apply_patch('hello', []), 'hello')
+        self.assertEqual(apply_patch('naïve 🎉 text', [8, -4, 'words']), 'naïve 🎉 words')
+
+    def test_invalid_patches(self):
+        """Test that patches reaching past the end or with bad operations are rejected"""
+        for ops in ([6, 1], [-6], [3, -3], [0], [''], [1.5], [True], [None], 'abc'):
+            with self.assertRaises(PatchError, msg=ops):
+                apply_patch('hello', ops)
+
+
+class NotePatchAPITests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.other_user = User.objects.create_user(username='otheruser@example.com', email='otheruser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.note = Note.objects.create(
+            title="Draft", content="The quick brown fox", date=date(2024, 1, 1),
+            category=self.category, user=self.user
+        )
+        self.url = reverse('note-detail', kwargs={'pk': self.note.pk})
+
+    def patch(self, url, data):
+        return self.client.patch(url, data=json.dumps(data), content_type='application/json')
+
+    def test_new_notes_start_at_version_one(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['version'], 1)
+
+    def test_apply_patch(self):
+        """Test that a patch against the current version is applied"""
+        response = self.patch(self.url, {'base_version': 1, 'ops': [10, -5, 'red']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], 2)
+        self.assertEqual(response.data['id'], self.note.pk)
+        self.assertNotIn('content', response.data)
+
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.content, "The quick red fox")
+        self.assertEqual(self.note.version, 2)
+
+        response = self.patch(self.url, {'base_version': 2, 'ops': [17, ' jumps ']})
+        self.assertEqual(response.data['version'], 3)
+        self.note.refresh_from_db()
+        # Whitespace typed at the end is kept, so client and server agree
+        self.assertEqual(self.note.content, "The quick red fox jumps ")
+
+    def test_stale_base_version_conflicts(self):
+        """Test that a patch against an old version is rejected with 409"""
+        self.patch(self.url, {'base_version': 1, 'ops': ['A: ']})
+        response = self.patch(self.url, {'base_version': 1, 'ops': ['B: ']})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['version'], 2)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.content, "A: The quick brown fox")
+
+    def test_invalid_patch(self):
+        """Test that malformed patches are rejected without changing the note"""
+        for data in (
+            {'base_version': 1, 'ops': [100]},
+            {'base_version': 1, 'ops': [{'insert': 'x'}]},
+            {'base_version': 1, 'ops': [-19]},
+            {'ops': ['x']},
+        ):
+            response = self.patch(self.url, data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.content, "The quick brown fox")
+        self.assertEqual(self.note.version, 1)
+
+    def test_cannot_patch_other_users_note(self):
+        other_category = Category.objects.create(name="Other", colour="#CCCCCC", user=self.other_user)
+        other_note = Note.objects.create(
+            title="Theirs", content="Private", date=date(2024, 1, 1),
+            category=other_category, user=self.other_user
+        )
+        url = reverse('note-detail', kwargs={'pk': other_note.pk})
+        response = self.patch(url, {'base_version': 1, 'ops': ['x']})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_full_updates_bump_the_version(self):
+        """Test that PUT content changes and plain PATCH keep versions consistent"""
+        response = self.client.put(self.url, data=json.dumps({
+            'title': 'Draft', 'content': 'Rewritten', 'date': '2024-01-01', 'category_id': self.category.id,
+        }), content_type='application/json')
+        self.assertEqual(response.data['version'], 2)
+
+        response = self.patch(self.url, {'title': 'Renamed'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], 2)
+
+        response = self.patch(self.url, {'base_version': 2, 'ops': [9, '!']})
+        self.assertEqual(response.data['version'], 3)
+
+
+class PatchBenchmark(TestCase):
+    def test_patch_apply_throughput(self):
+        """Benchmark applying patches to large documents"""
+        rng = random.Random(0)
+        for size in (200_000, scaled(2_000_000)):
+            text = ''.join(rng.choices('abcdefghij klmnop\n', k=size))
+
+            # A single keystroke in the middle, as sent by autosave
+            keystroke = [size // 2, 'x']
+            # Many scattered edits
+            scattered = []
+            for _ in range(200):
+                scattered += [size // 250, 'edit', -3]
+
+            for name, ops in (('keystroke', keystroke), ('scattered', scattered)):
+                repeat = 50
+                elapsed = timed(lambda: [apply_patch(text, ops) for _ in range(repeat)])
+                report(
+                    f'apply patch {name}',
+                    doc_chars=size,
+                    ops=len(ops),
+                    us_per_patch=elapsed / repeat * 1e6,
+                    mb_per_s=size * repeat / elapsed / 1e6,
+                )
@@ -0,0 +1,217 @@
+import random
+from datetime import date, timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.importers import import_notes
+from coreapp.models import Category, Note, NoteActivity, NoteStatsBucket
+from coreapp.stats import check_stats, rebuild_stats
+
+from .benchmark import report, scaled, timed
+
+
+class NoteStatsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.other_user = User.objects.create_user(username='otheruser@example.com', email='otheruser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.stats_url = reverse('note-stats')
+
+        self.work = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.home = Category.objects.create(name="Home", colour="#33FF57", user=self.user)
+        self.other_category = Category.objects.create(name="Other", colour="#000000", user=self.other_user)
+
+    def create(self, category, day, user=None):
+        return Note.objects.create(
+            title="Note", content="Content", date=day, category=category, user=user or self.user
+        )
+
+    def buckets(self, user=None):
+        return {
+            (category_id, day): count
+            for category_id, day, count in NoteStatsBucket.objects.filter(user=user or self.user, count__gt=0)
+            .values_list('category_id', 'day', 'count')
+        }
+
+    def test_create_update_delete(self):
+        """Test that buckets follow notes through their lifecycle"""
+        note = self.create(self.work, date(2024, 1, 5))
+        self.create(self.work, date(2024, 1, 5))
+        self.assertEqual(self.buckets(), {(self.work.id, date(2024, 1, 5)): 2})
+
+        note.category = self.home
+        note.save()
+        self.assertEqual(self.buckets(), {
+            (self.work.id, date(2024, 1, 5)): 1,
+            (self.home.id, date(2024, 1, 5)): 1,
+        })
+
+        note.date = date(2024, 2, 1)
+        note.title = "Moved"
+        note.save()
+        self.assertEqual(self.buckets(), {
+            (self.work.id, date(2024, 1, 5)): 1,
+            (self.home.id, date(2024, 2, 1)): 1,
+        })
+
+        Note.objects.get(pk=note.pk).delete()
+        self.assertEqual(self.buckets(), {(self.work.id, date(2024, 1, 5)): 1})
+        self.assertEqual(check_stats(), [])
+
+    def test_api_writes(self):
+        response = self.client.post(reverse('note-list'), {
+            'title': "New", 'content': "Body", 'date': '2024-03-01', 'category_id': self.work.id,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        url = reverse('note-detail', kwargs={'pk': response.data['id']})
+
+        response = self.client.patch(url, {'category_id': self.home.id, 'date': '2024-03-02'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.buckets(), {(self.home.id, date(2024, 3, 2)): 1})
+
+        self.client.delete(url)
+        self.assertEqual(self.buckets(), {})
+        self.assertEqual(check_stats(), [])
+
+    def test_saving_a_deferred_note(self):
+        note = self.create(self.work, date(2024, 1, 5))
+        deferred = Note.objects.only('id', 'title').get(pk=note.pk)
+        deferred.category = self.home
+        deferred.save()
+        self.assertEqual(self.buckets(), {(self.home.id, date(2024, 1, 5)): 1})
+
+    def test_category_and_user_deletion(self):
+        self.create(self.work, date(2024, 1, 5))
+        self.create(self.home, date(2024, 1, 5))
+        self.work.delete()
+        self.assertEqual(self.buckets(), {(self.home.id, date(2024, 1, 5)): 1})
+
+        self.user.delete()
+        self.assertFalse(NoteStatsBucket.objects.exists())
+        self.assertFalse(NoteActivity.objects.exists())
+
+    def test_bulk_import_is_counted(self):
+        lines = [
+            f'{{"title": "T{n}", "content": "C", "date": "2024-01-0{n % 3 + 1}", "category": "Work"}}\n'
+            for n in range(10)
+        ]
+        report = import_notes(self.user, [''.join(lines).encode()], 'ndjson', batch_size=4)
+        self.assertEqual(report.created, 10)
+        self.assertEqual(self.buckets(), {
+            (self.work.id, date(2024, 1, 1)): 4,
+            (self.work.id, date(2024, 1, 2)): 3,
+            (self.work.id, date(2024, 1, 3)): 3,
+        })
+        self.assertEqual(check_stats(), [])
+
+    def test_endpoint(self):
+        self.create(self.work, date(2024, 1, 5))
+        self.create(self.work, date(2024, 1, 5))
+        self.create(self.home, date(2024, 1, 20))
+        self.create(self.home, date(2024, 2, 3))
+        self.create(self.other_category, date(2024, 1, 5), user=self.other_user)
+
+        response = self.client.get(self.stats_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], 4)
+        self.assertIsNotNone(response.data['last_activity'])
+        self.assertEqual(
+            [(c['name'], c['count']) for c in response.data['categories']],
+            [("Home", 2), ("Work", 2)],
+        )
+        self.assertEqual(
+            [(m['month'], m['count']) for m in response.data['months']],
+            [('2024-01', 3), ('2024-02', 1)],
+        )
+        self.assertEqual(
+            [(d['date'], d['count']) for d in response.data['days']],
+            [('2024-01-05', 2), ('2024-01-20', 1), ('2024-02-03', 1)],
+        )
+
+    def test_endpoint_without_notes(self):
+        response = self.client.get(self.stats_url)
+        self.assertEqual(response.data['total'], 0)
+        self.assertIsNone(response.data['last_activity'])
+        self.assertEqual([c['count'] for c in response.data['categories']], [0, 0])
+
+    def test_query_count_does_not_grow_with_notes(self):
+        Note.objects.bulk_create([
+            Note(title="Bulk", content="", date=date(2024, 1, 1), category=self.work, user=self.user)
+            for _ in range(50)
+        ])
+        # Authentication, buckets, categories and activity
+        with self.assertNumQueries(4):
+            response = self.client.get(self.stats_url)
+        self.assertEqual(response.data['total'], 50)
+
+    def test_check_and_rebuild(self):
+        """Test that drift from unsignalled writes is detected and repaired"""
+        note = self.create(self.work, date(2024, 1, 5))
+        self.create(self.home, date(2024, 1, 6))
+        Note.objects.filter(pk=note.pk).update(category=self.home)
+
+        self.assertEqual(len(check_stats()), 2)
+        with self.assertRaises(CommandError):
+            call_command('check_note_stats', stdout=StringIO())
+
+        out = StringIO()
+        call_command('check_note_stats', '--fix', stdout=out)
+        self.assertIn('Rebuilt', out.getvalue())
+        self.assertEqual(check_stats(), [])
+        self.assertEqual(self.buckets(), {
+            (self.home.id, date(2024, 1, 5)): 1,
+            (self.home.id, date(2024, 1, 6)): 1,
+        })
+
+    def test_rebuild_command(self):
+        self.create(self.work, date(2024, 1, 5))
+        NoteStatsBucket.objects.all().delete()
+        call_command('rebuild_note_stats', '--email', self.user.email, stdout=StringIO())
+        self.assertEqual(self.buckets(), {(self.work.id, date(2024, 1, 5)): 1})
+
+
+class NoteStatsBenchmarkTests(TestCase):
+    def test_buckets_against_group_by(self):
+        """Compare reading the buckets with grouping over the notes table"""
+        user = User.objects.create_user(username='bench@example.com', email='bench@example.com')
+        categories = [Category.objects.create(name=f"C{n}", colour="#000000", user=user) for n in range(10)]
+        rng = random.Random(4)
+        notes = scaled(5000)
+        Note.objects.bulk_create([
+            Note(
+                title="N", content="", date=date(2023, 1, 1) + timedelta(days=rng.randrange(365)),
+                category=rng.choice(categories), user=user
+            )
+            for _ in range(notes)
+        ], batch_size=1000)
+        self.assertEqual(check_stats(), [])
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        url = reverse('note-stats')
+        self.assertEqual(client.get(url).data['total'], notes)
+
+        def group_by():
+            mine = Note.objects.filter(user=user).order_by()
+            list(mine.values('category_id').annotate(count=Count('id')))
+            list(mine.annotate(month=TruncMonth('date')).values('month').annotate(count=Count('id')))
+            list(mine.values('date').annotate(count=Count('id')))
+
+        endpoint = timed(lambda: client.get(url), repeat=5)
+        grouping = timed(group_by, repeat=5)
+        rebuild = timed(lambda: rebuild_stats([user.id]))
+        report(
+            'note_stats', notes=notes, buckets=NoteStatsBucket.objects.filter(user=user).count(),
+            endpoint_ms=endpoint * 1000, group_by_ms=grouping * 1000, rebuild_ms=rebuild * 1000,
+        )
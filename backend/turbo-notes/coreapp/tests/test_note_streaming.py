@@ -0,0 +1,124 @@
+import tracemalloc
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.archive import archive_user_notes
+from coreapp.models import Category, Note
+
+from .benchmark import report, scaled
+
+
+def body(response):
+    if response.streaming:
+        return b''.join(response.streaming_content)
+    return response.content
+
+
+class NoteStreamingTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.work = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.home = Category.objects.create(name="Home", colour="#000000", user=self.user)
+        Note.objects.bulk_create([
+            Note(title=f"Note {n}   é", content=f"Body {n}", date=f'2024-01-{n % 28 + 1:02}',
+                 category=self.work if n % 3 else self.home, user=self.user)
+            for n in range(30)
+        ])
+
+    def get_both(self, query):
+        """The streamed and the paginated responses to the same request"""
+        url = f'{reverse("note-list")}?{query}'
+        with self.settings(LIST_STREAMING_THRESHOLD=5, LIST_STREAMING_CHUNK_SIZE=4):
+            streamed = self.client.get(url)
+        paginated = self.client.get(url)
+        return streamed, paginated
+
+    def assertSameOutput(self, query):
+        streamed, paginated = self.get_both(query)
+        self.assertEqual(streamed.status_code, status.HTTP_200_OK)
+        self.assertTrue(streamed.streaming)
+        self.assertFalse(paginated.streaming)
+        self.assertEqual(streamed['Content-Type'], paginated['Content-Type'])
+        self.assertEqual(body(streamed), body(paginated))
+        return paginated.json()
+
+    def test_same_output_as_paginated(self):
+        data = self.assertSameOutput('page_size=12')
+        self.assertEqual((data['count'], len(data['results'])), (30, 12))
+        self.assertIn('page=2', data['next'])
+        data = self.assertSameOutput('page_size=12&page=3&ordering=title')
+        self.assertEqual(len(data['results']), 6)
+        self.assertSameOutput(f'page_size=10&category={self.home.pk}&ordering=-updated_at')
+        # Chunks of exactly the chunk size, and an empty page
+        self.assertSameOutput('page_size=8')
+        self.assertSameOutput('page_size=8&date_from=2030-01-01')
+
+    def test_same_output_with_archived_notes(self):
+        Note.objects.filter(title__startswith="Note 1").update(updated_at=timezone.now() - timedelta(days=400))
+        archive_user_notes(self.user.pk)
+        data = self.assertSameOutput('page_size=20&include_archived=true&ordering=title')
+        self.assertEqual(data['count'], 30)
+
+    def test_invalid_page(self):
+        streamed, paginated = self.get_both('page_size=12&page=9')
+        self.assertEqual(streamed.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(paginated.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(LIST_STREAMING_THRESHOLD=11)
+    def test_small_pages_and_browsable_api_are_not_streamed(self):
+        self.assertFalse(self.client.get(reverse('note-list')).streaming)
+        response = self.client.get(f'{reverse("note-list")}?page_size=12', HTTP_ACCEPT='text/html')
+        self.assertFalse(response.streaming)
+
+    @override_settings(NOTES_MAX_PAGE_SIZE=20)
+    def test_page_size_is_capped(self):
+        response = self.client.get(f'{reverse("note-list")}?page_size=25')
+        self.assertEqual(len(response.json()['results']), 20)
+
+
+class NoteStreamingBenchmarkTests(TestCase):
+    def test_peak_memory_per_request(self):
+        """Peak memory of one request for a large page, built in memory and streamed"""
+        user = User.objects.create_user(username='bench@example.com', email='bench@example.com')
+        category = Category.objects.create(name="Work", colour="#000000", user=user)
+        count = scaled(2000)
+        Note.objects.bulk_create([
+            Note(title=f"Note {n}", content="Lorem ipsum dolor sit amet " * 20, date='2024-01-01',
+                 category=category, user=user)
+            for n in range(count)
+        ])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        url = f'{reverse("note-list")}?page_size={count}'
+
+        def peak(streaming):
+            threshold = count if streaming else count + 1
+            with self.settings(LIST_STREAMING_THRESHOLD=threshold, LIST_STREAMING_CHUNK_SIZE=200):
+                tracemalloc.start()
+                try:
+                    response = client.get(url)
+                    size = 0
+                    # Sent as it is produced, like a WSGI server does
+                    for chunk in (response.streaming_content if response.streaming else [response.content]):
+                        size += len(chunk)
+                    return tracemalloc.get_traced_memory()[1], size
+                finally:
+                    tracemalloc.stop()
+
+        paginated_peak, paginated_size = peak(streaming=False)
+        streamed_peak, streamed_size = peak(streaming=True)
+        report(
+            'list_streaming', notes=count, response_kb=paginated_size / 1024,
+            paginated_peak_kb=paginated_peak / 1024, streamed_peak_kb=streamed_peak / 1024,
+        )
+        self.assertEqual(streamed_size, paginated_size)
+        self.assertLess(streamed_peak, paginated_peak)
@@ -0,0 +1,192 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.models import Category
+from coreapp.ratelimit import CacheBackend, LocalBackend, Rate, parse_rate
+
+from .benchmark import report, scaled, timed
+
+TEST_RATES = {
+    **settings.REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {'auth': '3/min', 'write': '5/min', 'import': '1/hour'},
+}
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class BackendTestMixin:
+    def make_backend(self, clock):
+        raise NotImplementedError
+
+    def test_burst_then_pace(self):
+        """Test that a full burst passes, then requests pass at the permitted pace"""
+        clock = Clock()
+        backend = self.make_backend(clock)
+        rate = Rate(5, 60)
+        for _ in range(5):
+            self.assertEqual(backend.hit('client', rate), (True, None))
+
+        allowed, retry_after = backend.hit('client', rate)
+        self.assertFalse(allowed)
+        self.assertGreater(retry_after, 0)
+        self.assertLessEqual(retry_after, 60)
+
+        clock.now += retry_after + 0.001
+        self.assertTrue(backend.hit('client', rate)[0])
+
+    def test_clients_are_independent(self):
+        clock = Clock()
+        backend = self.make_backend(clock)
+        rate = Rate(1, 60)
+        self.assertTrue(backend.hit('a', rate)[0])
+        self.assertFalse(backend.hit('a', rate)[0])
+        self.assertTrue(backend.hit('b', rate)[0])
+
+    def test_rejected_requests_do_not_count(self):
+        clock = Clock()
+        backend = self.make_backend(clock)
+        rate = Rate(2, 10)
+        backend.hit('client', rate)
+        backend.hit('client', rate)
+        for _ in range(50):
+            backend.hit('client', rate)
+        clock.now += 20
+        self.assertTrue(backend.hit('client', rate)[0])
+
+
+class LocalBackendTests(BackendTestMixin, SimpleTestCase):
+    def make_backend(self, clock):
+        return LocalBackend(clock=clock)
+
+    def test_exact_retry_after(self):
+        clock = Clock()
+        backend = LocalBackend(clock=clock)
+        rate = Rate(3, 30)
+        for _ in range(3):
+            backend.hit('client', rate)
+        # One request is let through every 10 seconds
+        self.assertEqual(backend.hit('client', rate), (False, 10.0))
+        clock.now += 4
+        self.assertEqual(backend.hit('client', rate), (False, 6.0))
+
+    def test_memory_is_bounded(self):
+        backend = LocalBackend(max_keys=100)
+        for n in range(1000):
+            backend.hit(f'client-{n}', Rate(1, 60))
+        self.assertEqual(len(backend.arrivals), 100)
+        self.assertIn('client-999', backend.arrivals)
+
+
+class CacheBackendTests(BackendTestMixin, SimpleTestCase):
+    def make_backend(self, clock):
+        backend = CacheBackend(clock=clock)
+        self.addCleanup(backend.cache.clear)
+        return backend
+
+    def test_shared_between_instances(self):
+        """Test that two backends on the same cache, like two workers, share limits"""
+        clock = Clock()
+        first, second = self.make_backend(clock), self.make_backend(clock)
+        rate = Rate(2, 60)
+        self.assertTrue(first.hit('client', rate)[0])
+        self.assertTrue(second.hit('client', rate)[0])
+        self.assertFalse(first.hit('client', rate)[0])
+
+
+class ParseRateTests(SimpleTestCase):
+    def test_formats(self):
+        self.assertEqual(parse_rate('10/min'), Rate(10, 60))
+        self.assertEqual(parse_rate('5/s'), Rate(5, 1))
+        self.assertEqual(parse_rate('100/hour'), Rate(100, 3600))
+        self.assertEqual(parse_rate('1000/day'), Rate(1000, 86400))
+
+
+@override_settings(REST_FRAMEWORK=TEST_RATES, RATE_LIMIT_BACKEND='coreapp.ratelimit.LocalBackend')
+class ThrottledEndpointTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='testuser@example.com', email='testuser@example.com', password='testpass123'
+        )
+        self.other_user = User.objects.create_user(username='otheruser@example.com', email='otheruser@example.com')
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+
+    def login(self, **extra):
+        return self.client.post(
+            reverse('token_obtain_pair'),
+            {'email': 'testuser@example.com', 'password': 'wrong'},
+            format='json', **extra
+        )
+
+    def test_auth_is_limited_per_ip(self):
+        for _ in range(3):
+            self.assertEqual(self.login().status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.login()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # One attempt is let through every 20 seconds
+        self.assertIn(response['Retry-After'], ('19', '20'))
+
+        # Registration shares the scope
+        response = self.client.post(reverse('register'), {'email': 'new@example.com', 'password': 'x'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        # Another client address has its own allowance
+        self.assertEqual(self.login(REMOTE_ADDR='10.0.0.2').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(
+            self.login(HTTP_X_FORWARDED_FOR='10.0.0.3').status_code, status.HTTP_401_UNAUTHORIZED
+        )
+
+    def test_writes_are_limited_per_user(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        data = {'title': "Note", 'content': "Body", 'date': '2024-01-01', 'category_id': self.category.id}
+        for _ in range(5):
+            response = self.client.post(reverse('note-list'), data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(reverse('note-list'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+
+        # Reads stay available
+        self.assertEqual(self.client.get(reverse('note-list')).status_code, status.HTTP_200_OK)
+
+        # Other users are not affected
+        other_category = Category.objects.create(name="Other", colour="#000000", user=self.other_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.other_user).access_token}')
+        response = self.client.post(reverse('note-list'), {**data, 'category_id': other_category.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class RateLimitBenchmarkTests(SimpleTestCase):
+    def test_cost_per_check(self):
+        """Measure the time of one check with each backend"""
+        checks = scaled(20000)
+        rate = parse_rate('1000000/min')
+        local = LocalBackend()
+        cache = CacheBackend()
+        self.addCleanup(cache.cache.clear)
+        keys = [f'user:{n % 1000}' for n in range(checks)]
+
+        def run(backend):
+            for key in keys:
+                backend.hit(key, rate)
+
+        local_time = timed(lambda: run(local), repeat=3)
+        cache_time = timed(lambda: run(cache), repeat=3)
+        report(
+            'rate_limit', checks=checks,
+            local_us=local_time / checks * 1e6,
+            cache_us=cache_time / checks * 1e6,
+            cache=type(caches['default']).__name__,
+        )
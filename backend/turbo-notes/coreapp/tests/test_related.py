@@ -0,0 +1,204 @@
+import random
+import string
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp import related
+from coreapp.archive import archive_user_notes
+from coreapp.models import Category, Note, NoteTerms
+
+from .benchmark import report, scaled, timed
+
+
+class RelatedIndexTests(SimpleTestCase):
+    def documents(self):
+        return [
+            (1, related.document_counts("Sourdough bread", related.content_counts("flour water salt starter dough"))),
+            (2, related.document_counts("Pizza dough", related.content_counts("flour water yeast dough oven"))),
+            (3, related.document_counts("Trip to Rome", related.content_counts("flights hotel museum rome"))),
+            (4, related.document_counts("Rome museums", related.content_counts("museum tickets rome vatican"))),
+        ]
+
+    def test_content_counts(self):
+        counts = related.content_counts("The cat and the other CAT sat on 2 mats, café café")
+        self.assertEqual(counts, {'cat': 2, 'café': 2, 'sat': 1, 'mats': 1})
+        many = ' '.join(f'word{letter}{other}' for letter in string.ascii_lowercase for other in string.ascii_lowercase)
+        self.assertEqual(len(related.content_counts(many.replace('word', 'w'))), related.MAX_TERMS)
+        self.assertEqual(related.document_counts("Cat photos", counts)['cat'], 2 + related.TITLE_WEIGHT)
+
+    def test_similar(self):
+        documents = dict(self.documents())
+        index = related.RelatedIndex(documents.items())
+        ranked = index.similar(documents[1], exclude=1)
+        self.assertEqual([pk for pk, _ in ranked], [2])
+        self.assertEqual([pk for pk, _ in index.similar(documents[3], exclude=3)], [4])
+        self.assertTrue(all(0 < score <= 1 for _, score in ranked))
+        self.assertEqual(index.similar({'unknown': 1}), [])
+        self.assertEqual(index.similar({}), [])
+
+    def test_incremental_updates_match_a_rebuild(self):
+        documents = self.documents()
+        index = related.RelatedIndex(documents)
+        bread = related.document_counts("Rye bread", related.content_counts("rye flour water starter"))
+        index.add(5, bread)
+        index.add(3, related.document_counts("Rome", {}))
+        index.remove(4)
+        index.remove(99)
+        rebuilt = related.RelatedIndex([(1, documents[0][1]), (2, documents[1][1]), (3, {'rome': 2}), (5, bread)])
+        self.assertEqual(index.postings, rebuilt.postings)
+        index.refresh_norms()
+        self.assertEqual(index.similar(bread, exclude=5), rebuilt.similar(bread, exclude=5))
+
+
+class RelatedAPITests(TestCase):
+    def setUp(self):
+        cache.clear()
+        related.indexes.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.bread = self.create_note("Sourdough bread", "Feed the starter, mix flour and water, shape the dough")
+        self.pizza = self.create_note("Pizza night", "Dough with flour, water and yeast, hot oven")
+        self.rome = self.create_note("Trip to Rome", "Book flights and a hotel near the museum")
+        self.museums = self.create_note("Museums", "Vatican museum tickets, Rome pass")
+
+    def create_note(self, title, content, user=None):
+        user = user or self.user
+        category = self.category if user == self.user else Category.objects.create(
+            name="Other", colour="#000000", user=user
+        )
+        return Note.objects.create(title=title, content=content, date='2024-01-01', category=category, user=user)
+
+    def related(self, note, **params):
+        response = self.client.get(reverse('note-related', kwargs={'pk': note.pk}), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        return [result['title'] for result in response.json()['results']]
+
+    def test_related_notes(self):
+        self.assertEqual(self.related(self.bread), ["Pizza night"])
+        self.assertEqual(self.related(self.museums), ["Trip to Rome"])
+        result = self.client.get(reverse('note-related', kwargs={'pk': self.rome.pk})).json()['results'][0]
+        self.assertEqual(set(result), {'id', 'title', 'score'})
+
+    def test_other_users_notes_are_not_related(self):
+        other = User.objects.create_user(username='other@example.com', email='other@example.com')
+        note = self.create_note("Bread", "Sourdough starter flour water dough", user=other)
+        self.assertEqual(self.related(self.bread), ["Pizza night"])
+        response = self.client.get(reverse('note-related', kwargs={'pk': note.pk}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_limit(self):
+        self.create_note("Focaccia", "Flour, water, olive oil and a long rise of the dough")
+        self.assertEqual(len(self.related(self.bread, limit=1)), 1)
+        response = self.client.get(reverse('note-related', kwargs={'pk': self.bread.pk}), {'limit': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_term_counts_are_stored_on_save(self):
+        self.assertEqual(NoteTerms.objects.get(note=self.rome).counts['museum'], 1)
+        self.rome.content = "Colosseum tickets"
+        self.rome.save()
+        self.assertEqual(NoteTerms.objects.get(note=self.rome).counts, {'colosseum': 1, 'tickets': 1})
+
+    def test_index_is_built_from_the_stored_terms(self):
+        with CaptureQueriesContext(connection) as queries:
+            related.indexes.get(self.user.pk)
+        self.assertFalse([query for query in queries.captured_queries if 'coreapp_notebody' in query['sql']])
+
+    def test_saves_update_the_loaded_index(self):
+        self.assertEqual(self.related(self.rome), ["Museums"])
+        index = related.indexes.indexes[self.user.pk]
+        url = reverse('note-detail', kwargs={'pk': self.pizza.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'content': "Rome hotel and museum pass"}, format='json')
+        self.assertIs(related.indexes.indexes[self.user.pk], index)
+        self.assertEqual(self.related(self.rome, limit=2), ["Pizza night", "Museums"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'title': "Rome museum"}, format='json')
+        self.assertTrue(index.terms[self.pizza.pk].keys() >= {'rome', 'museum', 'hotel'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(url)
+        self.assertIs(related.indexes.indexes[self.user.pk], index)
+        self.assertEqual(self.related(self.rome), ["Museums"])
+
+    def test_bulk_created_notes_are_backfilled(self):
+        self.related(self.bread)
+        with self.captureOnCommitCallbacks(execute=True):
+            Note.objects.bulk_create([
+                Note(title="Bagels", content="Boiled dough, flour and water", date='2024-01-01',
+                     category=self.category, user=self.user)
+            ])
+        self.assertIn("Bagels", self.related(self.bread, limit=2))
+        self.assertEqual(NoteTerms.objects.filter(note__user=self.user).count(), 5)
+
+    def test_archived_notes(self):
+        Note.objects.filter(pk=self.rome.pk).update(updated_at=timezone.now() - timedelta(days=400))
+        archive_user_notes(self.user.pk)
+        # Served without restoring the note
+        self.assertEqual(self.related(self.rome), ["Museums"])
+        self.assertFalse(Note.objects.filter(pk=self.rome.pk).exists())
+        self.assertNotIn("Trip to Rome", self.related(self.museums))
+
+
+@override_settings(RELATED_INDEX_SYNC_NOTES=1)
+class BackgroundIndexTests(TransactionTestCase):
+    def test_large_indexes_are_built_in_the_background(self):
+        cache.clear()
+        related.indexes.clear()
+        self.addCleanup(related.indexes.clear)
+        user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        category = Category.objects.create(name="Work", colour="#FF5733", user=user)
+        bread, _ = [
+            Note.objects.create(title=title, content=content, date='2024-01-01', category=category, user=user)
+            for title, content in (("Sourdough bread", "Starter, flour and water"), ("Pizza", "Dough of flour and water"))
+        ]
+
+        self.assertEqual(related.related_notes(user, bread), [])
+        for thread in list(related.indexes.building.values()):
+            thread.join()
+        self.assertEqual([note['title'] for note in related.related_notes(user, bread)], ["Pizza"])
+        self.assertEqual(related.indexes.building, {})
+
+
+def random_document(rng, vocabulary):
+    # Zipf-like word frequencies, like real text
+    words = rng.choices(vocabulary, weights=[1 / (rank + 1) for rank in range(len(vocabulary))], k=rng.randint(20, 80))
+    return ' '.join(words[:4]), ' '.join(words)
+
+
+class RelatedBenchmarkTests(SimpleTestCase):
+    def test_index_build_and_lookup(self):
+        """Building the index from stored term counts, looking up related notes and updating one note"""
+        rng = random.Random(5)
+        vocabulary = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))) for _ in range(20000)]
+        for count in (scaled(1000), scaled(10000)):
+            documents = []
+            for pk in range(count):
+                title, content = random_document(rng, vocabulary)
+                documents.append((pk, related.document_counts(title, related.content_counts(content))))
+            index = None
+
+            def build():
+                nonlocal index
+                index = related.RelatedIndex(documents)
+
+            build_seconds = timed(build)
+            queries = [documents[rng.randrange(count)] for _ in range(200)]
+            lookup_seconds = timed(lambda: [index.similar(counts, exclude=pk) for pk, counts in queries])
+            update_seconds = timed(lambda: [index.add(pk, counts) for pk, counts in queries])
+            report(
+                'related', notes=count, terms=len(index.postings), build_ms=build_seconds * 1000,
+                lookup_ms=lookup_seconds / len(queries) * 1000, update_us=update_seconds / len(queries) * 1e6,
+            )
@@ -0,0 +1,182 @@
+import datetime
+import decimal
+import io
+import uuid
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from coreapp.models import Category, Note
+from coreapp.parsers import ORJSONParser
+from coreapp.renderers import ORJSONRenderer
+from coreapp.serializers import NoteSerializer
+
+from .benchmark import report, scaled, timed
+
+
+def note_page(user, count):
+    """Build a paginated payload the way the notes list endpoint does"""
+    category = Category.objects.create(name="Work – ünïcode", colour="#FF5733", user=user)
+    Note.objects.bulk_create([
+        Note(
+            title=f'Note {i} ✓',
+            content=('Line with "quotes", tabs\tand emoji 🎉\n' * 50) + ' separator',
+            date=date(2024, 1, 1) + datetime.timedelta(days=i),
+            category=category,
+            user=user,
+        )
+        for i in range(count)
+    ])
+    request = RequestFactory().get('/api/notes/')
+    request.user = user
+    notes = Note.objects.filter(user=user).select_related('category')
+    return {
+        'count': count,
+        'next': 'http://testserver/api/notes/?page=2',
+        'previous': None,
+        'results': NoteSerializer(notes, many=True, context={'request': request}).data,
+    }
+
+
+class ORJSONRendererTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+
+    def assertSameOutput(self, data, accepted_media_type=None, renderer_context=None):
+        expected = JSONRenderer().render(data, accepted_media_type, renderer_context)
+        actual = ORJSONRenderer().render(data, accepted_media_type, renderer_context)
+        self.assertEqual(actual, expected)
+
+    def test_note_page_matches_json_renderer(self):
+        """Test that a realistic notes page renders to identical bytes"""
+        self.assertSameOutput(note_page(self.user, 20))
+
+    def test_python_types_match_json_renderer(self):
+        """Test that types orjson does not handle natively are encoded like DRF does"""
+        aware = timezone.make_aware(datetime.datetime(2024, 5, 6, 7, 8, 9, 123456), datetime.timezone.utc)
+        self.assertSameOutput({
+            'aware': aware,
+            'naive': datetime.datetime(2024, 5, 6, 7, 8, 9),
+            'offset': aware.astimezone(datetime.timezone(datetime.timedelta(hours=2))),
+            'date': date(2024, 5, 6),
+            'time': datetime.time(7, 8, 9, 500),
+            'delta': datetime.timedelta(minutes=90),
+            'decimal': decimal.Decimal('12.50'),
+            'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'lazy': gettext_lazy('Hello'),
+            'bytes': b'raw',
+            'set': {1},
+            'int_keys': {1: 'one', 2: 'two'},
+            'nested': [{'a': (1, 2, None, True, False, 0.5)}],
+            'control': 'null\x00 bell\x07 del\x7f separators   ',
+            'queryset': Category.objects.none(),
+        })
+
+    def test_validation_errors_match_json_renderer(self):
+        """Test that ErrorDetail strings render the same"""
+        error = ValidationError({'title': ['This field may not be blank.'], 'date': ['Bad – date']})
+        self.assertSameOutput(error.detail)
+
+    def test_floats_match_json_renderer(self):
+        """Test that floats are written like Python does, wherever they are"""
+        for value in (0.5, 1e-05, 1e16, 1.2345678901234568e17, -0.0, 1e22, 123456789.123):
+            with self.subTest(value):
+                self.assertSameOutput({'score': value})
+                self.assertSameOutput({'results': [{'id': 1, 'scores': (1, value)}]})
+                self.assertSameOutput({value: 'key'})
+                self.assertSameOutput({'set': {value}})
+                self.assertSameOutput([decimal.Decimal(repr(value))])
+
+    def test_non_finite_floats_are_rejected(self):
+        """Test that NaN and infinities raise like they do with DRF's strict JSON"""
+        for value in (float('nan'), float('inf'), float('-inf')):
+            for data in ({'score': value}, [{'scores': [value]}]):
+                with self.subTest(data=data), self.assertRaises(ValueError):
+                    JSONRenderer().render(data)
+                with self.subTest(data=data), self.assertRaises(ValueError):
+                    ORJSONRenderer().render(data)
+
+    def test_large_integers_fall_back(self):
+        """Test that integers beyond 64 bits still render"""
+        self.assertSameOutput({'big': 2 ** 70})
+
+    def test_indent_falls_back(self):
+        """Test that indented output requested by the client matches"""
+        self.assertSameOutput({'a': [1, 2]}, 'application/json; indent=4')
+        self.assertSameOutput({'a': [1, 2]}, renderer_context={'indent': 2})
+
+    def test_none_renders_empty(self):
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+
+class ORJSONParserTests(TestCase):
+    def parse_both(self, body, encoding='utf-8'):
+        context = {'encoding': encoding}
+        results = []
+        for parser in (JSONParser(), ORJSONParser()):
+            try:
+                results.append(parser.parse(io.BytesIO(body), parser_context=context))
+            except ParseError as exc:
+                results.append(('error', str(exc.detail)))
+        return results
+
+    def test_parses_like_json_parser(self):
+        """Test that valid bodies parse to identical data"""
+        bodies = [
+            '{"title": "Café ✓", "content": "a\\nb", "date": "2024-01-01", "category_id": 3}',
+            '[1, 2.5, -3e-7, true, false, null, "\\u2028"]',
+            '{"big": 123456789012345678901234567890}',
+        ]
+        for body in bodies:
+            expected, actual = self.parse_both(body.encode('utf-8'))
+            self.assertEqual(actual, expected)
+            self.assertEqual([type(v) for v in actual], [type(v) for v in expected])
+
+    def test_errors_like_json_parser(self):
+        """Test that invalid bodies raise the same parse errors"""
+        for body in [b'', b'{"a": ', b'{"a": NaN}', b'\xff\xfe', b'{"a": 1} trailing']:
+            expected, actual = self.parse_both(body)
+            self.assertEqual(actual, expected)
+
+    def test_other_encodings(self):
+        """Test that non UTF-8 request bodies are still decoded"""
+        body = '{"title": "Café"}'.encode('latin-1')
+        expected, actual = self.parse_both(body, encoding='latin-1')
+        self.assertEqual(actual, {'title': 'Café'})
+        self.assertEqual(actual, expected)
+
+
+class RendererBenchmark(TestCase):
+    def test_render_and_parse_note_page(self):
+        """Benchmark rendering and parsing a page of notes"""
+        user = User.objects.create_user(username='bench@example.com', email='bench@example.com')
+        page = note_page(user, scaled(100))
+        repeat = 20
+
+        stdlib_render = timed(lambda: JSONRenderer().render(page), repeat)
+        orjson_render = timed(lambda: ORJSONRenderer().render(page), repeat)
+        body = JSONRenderer().render(page)
+        stdlib_parse = timed(lambda: JSONParser().parse(io.BytesIO(body)), repeat)
+        orjson_parse = timed(lambda: ORJSONParser().parse(io.BytesIO(body)), repeat)
+
+        self.assertEqual(ORJSONRenderer().render(page), body)
+        report(
+            'render note page',
+            notes=len(page['results']),
+            bytes=len(body),
+            json_ms=stdlib_render * 1000,
+            orjson_ms=orjson_render * 1000,
+            speedup=stdlib_render / orjson_render,
+        )
+        report(
+            'parse note page',
+            json_ms=stdlib_parse * 1000,
+            orjson_ms=orjson_parse * 1000,
+            speedup=stdlib_parse / orjson_parse,
+        )
@@ -0,0 +1,231 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp import caching
+from coreapp.deletion import delete_category
+from coreapp.models import Category, Note
+
+from .benchmark import report, scaled, timed
+
+
+def note_queries(queries):
+    return [query['sql'] for query in queries if 'coreapp_' in query['sql']]
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        # Primary keys are reused between tests on SQLite
+        cache.clear()
+        caching.stats.reset()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.other_user = User.objects.create_user(username='otheruser@example.com', email='otheruser@example.com')
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.note = Note.objects.create(
+            title="First", content="Body", date='2024-01-01', category=self.category, user=self.user
+        )
+        self.login(self.user)
+
+    def login(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+
+    def assertCached(self, url):
+        """Request `url` twice and check that the second response comes from the cache"""
+        first = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(url)
+        self.assertEqual(note_queries(queries.captured_queries), [])
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.json(), first.json())
+        return second.json()
+
+    def test_reads_are_cached(self):
+        self.assertCached(reverse('category-list'))
+        self.assertCached(reverse('note-list'))
+        self.assertCached(reverse('note-list') + '?ordering=title')
+        self.assertCached(reverse('note-detail', kwargs={'pk': self.note.pk}))
+        self.assertEqual((caching.stats.hits, caching.stats.misses), (4, 4))
+
+    def test_query_strings_are_cached_apart(self):
+        self.client.get(reverse('note-list'))
+        response = self.client.get(reverse('note-list'), {'category': 999})
+        self.assertEqual(response.json()['count'], 0)
+
+    def test_users_are_cached_apart(self):
+        self.assertCached(reverse('note-list'))
+        self.login(self.other_user)
+        self.assertEqual(self.client.get(reverse('note-list')).json()['count'], 0)
+        self.assertEqual(
+            self.client.get(reverse('note-detail', kwargs={'pk': self.note.pk})).status_code,
+            status.HTTP_404_NOT_FOUND
+        )
+
+    def test_errors_are_not_cached(self):
+        url = reverse('note-detail', kwargs={'pk': 999999})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('note-list'), {'ordering': 'bogus'}).status_code, 400)
+        self.assertEqual(caching.stats.hits, 0)
+
+    def test_api_writes_invalidate(self):
+        list_url = reverse('note-list')
+        detail_url = reverse('note-detail', kwargs={'pk': self.note.pk})
+        self.assertCached(list_url)
+        self.assertCached(detail_url)
+        self.assertCached(reverse('category-list'))
+
+        self.client.patch(detail_url, {'title': "Renamed"}, format='json')
+        self.assertEqual(self.client.get(detail_url).json()['title'], "Renamed")
+        self.assertEqual(self.client.get(list_url).json()['results'][0]['title'], "Renamed")
+
+        self.client.post(
+            list_url, {'title': "Second", 'content': "x", 'date': '2024-01-02', 'category_id': self.category.pk},
+            format='json'
+        )
+        self.assertEqual(self.client.get(list_url).json()['count'], 2)
+        self.assertEqual(self.client.get(reverse('category-list')).json()['results'][0]['notes_count'], 2)
+
+        self.client.delete(detail_url)
+        self.assertEqual(self.client.get(detail_url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(list_url).json()['count'], 1)
+
+    def test_content_patch_invalidates(self):
+        detail_url = reverse('note-detail', kwargs={'pk': self.note.pk})
+        self.assertCached(detail_url)
+        response = self.client.patch(detail_url, {'base_version': 1, 'ops': [4, "!"]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(detail_url).json()['content'], "Body!")
+
+    def test_category_rename_invalidates_notes(self):
+        self.assertCached(reverse('note-list'))
+        self.category.name = "Job"
+        self.category.save()
+        self.assertEqual(self.client.get(reverse('note-list')).json()['results'][0]['category']['name'], "Job")
+
+    def test_set_based_writes_invalidate(self):
+        self.assertCached(reverse('note-list'))
+        self.client.post(
+            reverse('note-import-notes'),
+            {'file': SimpleUploadedFile(
+                'notes.ndjson', b'{"title": "Imported", "content": "x", "date": "2024-01-03", "category": "Work"}\n'
+            )},
+            format='multipart'
+        )
+        self.assertEqual(self.client.get(reverse('note-list')).json()['count'], 2)
+
+        self.assertCached(reverse('category-list'))
+        delete_category(self.category)
+        self.assertEqual(self.client.get(reverse('note-list')).json()['count'], 0)
+        self.assertEqual(self.client.get(reverse('category-list')).json()['count'], 0)
+
+    def test_invalidated_again_on_commit(self):
+        """Test that the version moves on commit too, past entries cached by concurrent readers"""
+        version = caching.user_version(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.note.title = "Changed"
+            self.note.save()
+            self.assertEqual(caching.user_version(self.user.pk), version + 1)
+        self.assertEqual(caching.user_version(self.user.pk), version + 2)
+
+    @override_settings(RESPONSE_CACHE_ENABLED=False)
+    def test_disabled(self):
+        self.client.get(reverse('note-list'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('note-list'))
+        self.assertNotEqual(note_queries(queries.captured_queries), [])
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class StampedeTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_one_request_computes(self):
+        """Test that concurrent misses on the same key run the computation once"""
+        request = SimpleNamespace(
+            user=SimpleNamespace(pk=1), build_absolute_uri=lambda: 'http://testserver/api/notes/'
+        )
+        computed = []
+
+        def compute():
+            computed.append(1)
+            time.sleep(0.1)
+            return Response({'count': 1})
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(caching.cached_response(request, 'note-list', compute).data))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(computed), 1)
+        self.assertEqual(results, [{'count': 1}] * 8)
+
+    def test_waiters_compute_when_the_holder_stores_nothing(self):
+        request = SimpleNamespace(
+            user=SimpleNamespace(pk=1), build_absolute_uri=lambda: 'http://testserver/api/notes/1/'
+        )
+        key = caching.entry_key(request, 'note-detail', caching.user_version(1))
+        cache.add(f'{key}:lock', 1)
+        threading.Timer(0.05, cache.delete, args=[f'{key}:lock']).start()
+
+        start = time.monotonic()
+        response = caching.cached_response(request, 'note-detail', lambda: Response({'detail': 'Not found.'}, status=404))
+        self.assertEqual(response.status_code, 404)
+        self.assertLess(time.monotonic() - start, 1)
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class ResponseCacheBenchmarkTests(TestCase):
+    def test_hit_ratio_and_latency(self):
+        """Replay a read-mostly workload with and without the cache"""
+        cache.clear()
+        user = User.objects.create_user(username='bench@example.com', email='bench@example.com')
+        categories = [Category.objects.create(name=f"Category {n}", colour="#000000", user=user) for n in range(5)]
+        Note.objects.bulk_create([
+            Note(title=f"Note {n}", content="Lorem ipsum " * 50, date='2024-01-01',
+                 category=categories[n % 5], user=user)
+            for n in range(200)
+        ])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        note = Note.objects.filter(user=user).first()
+        urls = [reverse('category-list'), reverse('note-detail', kwargs={'pk': note.pk})] + [
+            f'{reverse("note-list")}?page={page}' for page in range(1, 4)
+        ]
+        requests = scaled(200)
+
+        def workload():
+            for n in range(requests):
+                # One write for every 20 reads
+                if n % 20 == 19:
+                    client.patch(reverse('note-detail', kwargs={'pk': note.pk}), {'title': f"Edit {n}"}, format='json')
+                else:
+                    client.get(urls[n % len(urls)])
+
+        with override_settings(RESPONSE_CACHE_ENABLED=False):
+            uncached = timed(workload)
+        caching.stats.reset()
+        cached = timed(workload)
+        report(
+            'response_cache', requests=requests, hit_ratio=caching.stats.ratio,
+            uncached_ms=uncached / requests * 1000, cached_ms=cached / requests * 1000,
+            speedup=uncached / cached,
+        )
+        self.assertGreater(caching.stats.ratio, 0.5)
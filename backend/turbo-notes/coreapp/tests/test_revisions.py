@@ -0,0 +1,238 @@
+import random
+from datetime import date, timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.models import Category, Note, NoteRevision
+from coreapp.revisions import compact_revisions, get_revision_content, prune_revisions
+from coreapp.textpatch import apply_patch, make_patch
+
+from .benchmark import report, scaled, timed
+
+WORDS = 'alpha beta gamma delta epsilon zeta eta theta iota kappa lambda'.split()
+
+
+def random_edit(rng, text):
+    """Insert, delete or replace a few words somewhere in ``text``"""
+    position = rng.randrange(len(text) + 1)
+    action = rng.choice(('insert', 'delete', 'replace', 'newline'))
+    if action == 'insert':
+        return text[:position] + ' ' + ' '.join(rng.choices(WORDS, k=3)) + text[position:]
+    if action == 'delete':
+        return text[:position] + text[position + rng.randint(1, 20):]
+    if action == 'replace':
+        return text[:position] + rng.choice(WORDS) + text[position + 5:]
+    return text[:position] + '\n' + text[position:]
+
+
+class MakePatchTests(TestCase):
+    def test_round_trip(self):
+        """Test that make_patch produces a patch turning the old text into the new one"""
+        rng = random.Random(1)
+        text = '\n'.join(' '.join(rng.choices(WORDS, k=8)) for _ in range(40))
+        for _ in range(200):
+            new = random_edit(rng, text)
+            self.assertEqual(apply_patch(text, make_patch(text, new)), new)
+            text = new
+
+    def test_edge_cases(self):
+        self.assertEqual(make_patch('same', 'same'), [])
+        self.assertEqual(make_patch('', 'new'), ['new'])
+        self.assertEqual(make_patch('old', ''), [-3])
+        self.assertEqual(make_patch('hello world', 'hello there world'), [6, 'there '])
+
+
+@override_settings(NOTE_REVISIONS={'SNAPSHOT_INTERVAL': 5, 'PRUNE_EVERY': 0})
+class RevisionStorageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.note = Note.objects.create(
+            title="Draft", content="version 1", date=date(2024, 1, 1),
+            category=self.category, user=self.user
+        )
+
+    def edit(self, content):
+        self.note.content = content
+        self.note.save()
+
+    def test_edit_records_revision(self):
+        """Test that changing the content stores the replaced version"""
+        self.edit("version 2")
+        self.assertEqual(self.note.version, 2)
+        revision = NoteRevision.objects.get(note=self.note)
+        self.assertEqual(revision.version, 1)
+        self.assertEqual(get_revision_content(self.note, 1), "version 1")
+
+    def test_unchanged_content_records_nothing(self):
+        self.edit("version 1")
+        self.note.title = "Renamed"
+        self.note.save()
+        self.assertEqual(self.note.version, 1)
+        self.assertFalse(NoteRevision.objects.exists())
+
+    def test_rebuild_every_version(self):
+        """Test that every version is rebuilt exactly across deltas and snapshots"""
+        rng = random.Random(2)
+        contents = ["version 1"]
+        text = '\n'.join(' '.join(rng.choices(WORDS, k=8)) for _ in range(20))
+        for _ in range(30):
+            text = random_edit(rng, text)
+            contents.append(text)
+            self.edit(text)
+
+        self.assertEqual(self.note.version, len(contents))
+        for version, content in enumerate(contents, start=1):
+            self.assertEqual(get_revision_content(self.note, version), content, msg=version)
+
+        # With an interval of 5, no more than 4 deltas ever separate a
+        # version from a snapshot or the current content
+        kinds = list(NoteRevision.objects.filter(note=self.note).order_by('-version').values_list('kind', flat=True))
+        run = longest = 0
+        for kind in kinds:
+            run = run + 1 if kind == NoteRevision.DELTA else 0
+            longest = max(longest, run)
+        self.assertLess(longest, 5)
+        self.assertIn(NoteRevision.DELTA, kinds)
+
+    def test_missing_versions(self):
+        self.edit("version 2")
+        for version in (0, 3, 99):
+            with self.assertRaises(NoteRevision.DoesNotExist):
+                get_revision_content(self.note, version)
+
+    @override_settings(NOTE_REVISIONS={'SNAPSHOT_INTERVAL': 5, 'PRUNE_EVERY': 0, 'MAX_REVISIONS': 4})
+    def test_prune_keeps_newest(self):
+        """Test that pruning drops the oldest revisions and the rest still rebuild"""
+        contents = [f"version {n} " + 'text ' * n for n in range(1, 13)]
+        for content in contents[1:]:
+            self.edit(content)
+
+        self.assertEqual(prune_revisions(self.note), 7)
+        versions = list(NoteRevision.objects.filter(note=self.note).values_list('version', flat=True))
+        self.assertEqual(sorted(versions), [8, 9, 10, 11])
+        for version in (8, 9, 10, 11, 12):
+            self.assertEqual(get_revision_content(self.note, version), contents[version - 1])
+        with self.assertRaises(NoteRevision.DoesNotExist):
+            get_revision_content(self.note, 7)
+
+    @override_settings(NOTE_REVISIONS={'SNAPSHOT_INTERVAL': 5, 'PRUNE_EVERY': 5, 'MAX_REVISIONS': 3})
+    def test_prune_on_save(self):
+        for n in range(2, 12):
+            self.edit(f"version {n}")
+        self.assertLessEqual(NoteRevision.objects.filter(note=self.note).count(), 3 + 5)
+
+    def test_compact_keeps_last_revision_per_day(self):
+        """Test that old history is thinned to one revision per day"""
+        contents = ["version 1"]
+        for n in range(2, 11):
+            contents.append(contents[-1] + f" edit {n}")
+            self.edit(contents[-1])
+
+        # Versions 1-3 on one old day, 4-6 on the next, 7-9 recent
+        old = timezone.now() - timedelta(days=60)
+        for version in range(1, 10):
+            if version <= 3:
+                saved_at = old + timedelta(minutes=version)
+            elif version <= 6:
+                saved_at = old + timedelta(days=1, minutes=version)
+            else:
+                saved_at = timezone.now() - timedelta(minutes=10 - version)
+            NoteRevision.objects.filter(note=self.note, version=version).update(saved_at=saved_at)
+
+        self.assertEqual(compact_revisions(self.note), 4)
+        versions = sorted(NoteRevision.objects.filter(note=self.note).values_list('version', flat=True))
+        self.assertEqual(versions, [3, 6, 7, 8, 9])
+        for version in versions + [10]:
+            self.assertEqual(get_revision_content(self.note, version), contents[version - 1])
+
+    def test_prune_command(self):
+        for n in range(2, 6):
+            self.edit(f"version {n}")
+        with override_settings(NOTE_REVISIONS={'MAX_REVISIONS': 2}):
+            call_command('prune_revisions', stdout=StringIO())
+        self.assertEqual(NoteRevision.objects.filter(note=self.note).count(), 2)
+
+
+class RevisionAPITests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.other_user = User.objects.create_user(username='otheruser@example.com', email='otheruser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.note = Note.objects.create(
+            title="Draft", content="first", date=date(2024, 1, 1),
+            category=self.category, user=self.user
+        )
+        for content in ("second", "third"):
+            self.note.content = content
+            self.note.save()
+
+    def test_list_revisions(self):
+        response = self.client.get(reverse('note-revisions', kwargs={'pk': self.note.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['version'] for item in response.data['results']], [2, 1])
+        self.assertEqual(response.data['results'][0]['size'], len("second"))
+
+    def test_get_revision(self):
+        for version, content in ((1, "first"), (2, "second"), (3, "third")):
+            url = reverse('note-revision', kwargs={'pk': self.note.pk, 'version': version})
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['version'], version)
+            self.assertEqual(response.data['content'], content)
+
+    def test_unknown_revision(self):
+        url = reverse('note-revision', kwargs={'pk': self.note.pk, 'version': 9})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_other_users_history_is_hidden(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.other_user).access_token}')
+        response = self.client.get(reverse('note-revisions', kwargs={'pk': self.note.pk}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        url = reverse('note-revision', kwargs={'pk': self.note.pk, 'version': 1})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(NOTE_REVISIONS={'MAX_REVISIONS': None, 'PRUNE_EVERY': 0})
+class RevisionBenchmarkTests(TestCase):
+    def test_storage_and_rebuild(self):
+        """Measure history size and rebuild time over many small edits of a large note"""
+        user = User.objects.create_user(username='bench@example.com', email='bench@example.com')
+        category = Category.objects.create(name="Bench", colour="#000000", user=user)
+        rng = random.Random(3)
+        text = '\n'.join(' '.join(rng.choices(WORDS, k=10)) for _ in range(500))
+        note = Note.objects.create(title="Big", content=text, date=date(2024, 1, 1), category=category, user=user)
+
+        edits = scaled(300)
+        contents = [text]
+        for _ in range(edits):
+            text = random_edit(rng, text)
+            contents.append(text)
+            note.content = text
+            note.save()
+
+        stored = sum(len(data) for data in NoteRevision.objects.filter(note=note).values_list('data', flat=True))
+        full_copies = sum(len(content.encode('utf-8')) for content in contents[:-1])
+
+        versions = rng.sample(range(1, edits + 1), 20)
+        for version in versions[:3]:
+            self.assertEqual(get_revision_content(note, version), contents[version - 1])
+        elapsed = timed(lambda: [get_revision_content(note, version) for version in versions])
+
+        report(
+            'revisions', edits=edits, note_chars=len(text),
+            stored_kb=stored / 1024, full_copies_kb=full_copies / 1024,
+            ratio=full_copies / stored, rebuild_ms=elapsed * 1000 / len(versions),
+        )
+        self.assertLess(stored, full_copies / 5)
@@ -0,0 +1,213 @@
+from collections import Counter
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp.deletion import delete_user
+from coreapp.jobs import Worker
+from coreapp.models import Category, Note, NoteActivity, NoteBody, NoteRevision, NoteStatsBucket, UserShard
+from coreapp.sharding import HashRing, allocator, ensure_user, locate, move_user, sync_user
+
+# The test databases declared in the settings
+SHARDS = [DEFAULT_DB_ALIAS, 'shard_a', 'shard_b']
+
+
+def place(user, alias):
+    """Put a user on a shard, whatever the ring says"""
+    ensure_user(user.pk, alias)
+    UserShard.objects.create(user=user, shard=alias)
+
+
+def user_rows(user, alias):
+    """The rows of a user on a shard, per model"""
+    return {
+        model.__name__: sorted(
+            model._base_manager.using(alias).filter(**{lookup: user.pk}).values_list(*fields)
+        )
+        for model, lookup, fields in (
+            (Category, 'user_id', ('id', 'name', 'updated_at')),
+            (Note, 'user_id', ('id', 'title', 'version', 'category_id', 'created_at', 'updated_at')),
+            (NoteBody, 'note__user_id', ('note_id', 'codec', 'data')),
+            (NoteRevision, 'note__user_id', ('note_id', 'version', 'kind', 'data', 'saved_at')),
+            (NoteStatsBucket, 'user_id', ('category_id', 'day', 'count')),
+            (NoteActivity, 'user_id', ('last_activity',)),
+        )
+    }
+
+
+class HashRingTests(TestCase):
+    def test_spread_and_stability(self):
+        ring = HashRing(['a', 'b', 'c'])
+        placements = {user_id: ring.get(user_id) for user_id in range(3000)}
+        counts = Counter(placements.values())
+        self.assertEqual(set(counts), {'a', 'b', 'c'})
+        self.assertGreater(min(counts.values()), 600)
+
+        # A fourth shard takes about a quarter of the users, from all shards,
+        # and nobody moves between the old ones
+        grown = HashRing(['a', 'b', 'c', 'd'])
+        moved = [user_id for user_id, shard in placements.items() if grown.get(user_id) != shard]
+        self.assertTrue(all(grown.get(user_id) == 'd' for user_id in moved))
+        self.assertLess(len(moved), 3000 * 0.4)
+
+
+@override_settings(SHARDS=SHARDS, SHARD_MOVE_GRACE=0)
+class ShardingTests(TestCase):
+    databases = set(SHARDS)
+
+    def setUp(self):
+        allocator.reset()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice@example.com', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob@example.com', email='bob@example.com')
+        place(self.alice, 'shard_a')
+        place(self.bob, 'shard_b')
+
+    def login(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+
+    def create_notes(self, user, count=2):
+        self.login(user)
+        category = self.client.post(reverse('category-list'), {'name': "Work", 'colour': "#FF5733"}, format='json')
+        self.assertEqual(category.status_code, status.HTTP_201_CREATED)
+        notes = []
+        for n in range(count):
+            response = self.client.post(reverse('note-list'), {
+                'title': f"Note {n}", 'content': f"Body {n}", 'date': '2024-01-01',
+                'category_id': category.data['id'],
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            notes.append(response.data['id'])
+        return category.data['id'], notes
+
+    def test_api_uses_the_users_shard(self):
+        category_id, note_ids = self.create_notes(self.alice)
+        self.assertEqual(Note.objects.using('shard_a').filter(user=self.alice).count(), 2)
+        self.assertFalse(Note.objects.using(DEFAULT_DB_ALIAS).exists())
+        self.assertFalse(Note.objects.using('shard_b').exists())
+        self.assertTrue(NoteBody.objects.using('shard_a').filter(note_id__in=note_ids).exists())
+        self.assertTrue(NoteStatsBucket.objects.using('shard_a').filter(user=self.alice).exists())
+
+        self.assertEqual(self.client.get(reverse('note-list')).data['count'], 2)
+        detail = reverse('note-detail', kwargs={'pk': note_ids[0]})
+        response = self.client.patch(detail, {'base_version': 1, 'ops': [6, "!"]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(detail).data['content'], "Body 0!")
+        self.assertEqual(NoteRevision.objects.using('shard_a').filter(note_id=note_ids[0]).count(), 1)
+        self.assertEqual(self.client.get(reverse('note-stats')).data['total'], 2)
+
+        # Bob's shard has none of it
+        self.login(self.bob)
+        self.assertEqual(self.client.get(reverse('note-list')).data['count'], 0)
+        self.assertEqual(self.client.get(detail).status_code, status.HTTP_404_NOT_FOUND)
+
+        self.login(self.alice)
+        response = self.client.delete(reverse('category-detail', kwargs={'pk': category_id}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Note.objects.using('shard_a').exists())
+
+    def test_ids_are_unique_across_shards(self):
+        alice_category, alice_notes = self.create_notes(self.alice)
+        bob_category, bob_notes = self.create_notes(self.bob)
+        self.assertNotEqual(alice_category, bob_category)
+        self.assertFalse(set(alice_notes) & set(bob_notes))
+
+    def test_new_users_are_placed_on_the_ring(self):
+        response = self.client.post(
+            reverse('register'), {'email': 'carol@example.com', 'password': 'Secret-pass-123'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        carol = User.objects.get(email='carol@example.com')
+        shard = locate(carol.pk).shard
+        self.assertEqual(Category.objects.using(shard).filter(user=carol).count(), 3)
+        for alias in set(SHARDS) - {shard}:
+            self.assertFalse(Category.objects.using(alias).filter(user=carol).exists())
+
+    def test_users_from_before_sharding_stay_on_default(self):
+        dave = User.objects.create_user(username='dave@example.com', email='dave@example.com')
+        with override_settings(SHARDS=[DEFAULT_DB_ALIAS]):
+            Category.objects.create(name="Old", colour="#000000", user=dave)
+        self.assertEqual(locate(dave.pk).shard, DEFAULT_DB_ALIAS)
+        self.login(dave)
+        self.assertEqual(self.client.get(reverse('category-list')).data['count'], 1)
+
+    def test_move_user(self):
+        _, note_ids = self.create_notes(self.alice, count=3)
+        self.client.patch(reverse('note-detail', kwargs={'pk': note_ids[0]}), {'content': "Changed"}, format='json')
+        before = user_rows(self.alice, 'shard_a')
+
+        self.assertGreater(move_user(self.alice.pk, 'shard_b', grace=0), 0)
+        self.assertEqual(locate(self.alice.pk), ('shard_b', False))
+        self.assertEqual(user_rows(self.alice, 'shard_b'), before)
+        self.assertFalse(any(user_rows(self.alice, 'shard_a').values()))
+
+        # Same ids through the API
+        response = self.client.get(reverse('note-detail', kwargs={'pk': note_ids[0]}))
+        self.assertEqual(response.data['content'], "Changed")
+        self.assertEqual(response.data['version'], 2)
+
+    def test_sync_copies_changes_made_during_the_copy(self):
+        _, note_ids = self.create_notes(self.alice, count=3)
+        sync_user(self.alice.pk, 'shard_a', 'shard_b')
+
+        # Made while the first copy ran
+        self.client.patch(reverse('note-detail', kwargs={'pk': note_ids[0]}), {'content': "Edited"}, format='json')
+        self.client.delete(reverse('note-detail', kwargs={'pk': note_ids[1]}))
+        self.create_notes(self.alice, count=1)
+
+        self.assertGreater(sync_user(self.alice.pk, 'shard_a', 'shard_b'), 0)
+        self.assertEqual(user_rows(self.alice, 'shard_b'), user_rows(self.alice, 'shard_a'))
+        self.assertEqual(sync_user(self.alice.pk, 'shard_a', 'shard_b'), 0)
+
+    def test_writes_are_refused_while_moving(self):
+        self.create_notes(self.alice, count=1)
+        UserShard.objects.filter(user=self.alice).update(locked=True)
+        response = self.client.post(reverse('category-list'), {'name': "New", 'colour': "#000000"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.client.get(reverse('note-list')).data['count'], 1)
+
+    def test_rebalance_command(self):
+        eve = User.objects.create_user(username='eve@example.com', email='eve@example.com')
+        # Placed on the ring, then misplaced
+        wanted = locate(eve.pk).shard
+        elsewhere = next(alias for alias in SHARDS if alias != wanted)
+        UserShard.objects.filter(user=eve).update(shard=elsewhere)
+        ensure_user(eve.pk, elsewhere)
+        self.create_notes(eve, count=2)
+        self.assertEqual(Note.objects.using(elsewhere).filter(user=eve).count(), 2)
+
+        out = StringIO()
+        call_command('rebalance_shards', '--dry-run', stdout=out)
+        self.assertIn(f'user {eve.pk}: {elsewhere} -> {wanted}', out.getvalue())
+        self.assertEqual(locate(eve.pk).shard, elsewhere)
+
+        call_command('rebalance_shards', '--email', 'eve@example.com', '--grace', '0', stdout=StringIO())
+        self.assertEqual(locate(eve.pk).shard, wanted)
+        self.assertEqual(Note.objects.using(wanted).filter(user=eve).count(), 2)
+
+        call_command('rebalance_shards', '--email', 'eve@example.com', '--to', elsewhere, '--grace', '0', stdout=StringIO())
+        self.assertEqual(locate(eve.pk).shard, elsewhere)
+        self.assertFalse(Note.objects.using(wanted).filter(user=eve).exists())
+
+    def test_delete_user(self):
+        self.create_notes(self.alice)
+        delete_user(self.alice)
+        self.assertFalse(User.objects.filter(email='alice@example.com').exists())
+        self.assertFalse(User.objects.using('shard_a').filter(email='alice@example.com').exists())
+        self.assertFalse(Note.objects.using('shard_a').exists())
+
+    @override_settings(FAST_DELETE_BACKGROUND_THRESHOLD=1)
+    def test_jobs_run_on_the_users_shard(self):
+        category_id, _ = self.create_notes(self.alice)
+        response = self.client.delete(reverse('category-detail', kwargs={'pk': category_id}))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(Worker(name='w').run_once())
+        self.assertFalse(Category.objects.using('shard_a').filter(pk=category_id).exists())
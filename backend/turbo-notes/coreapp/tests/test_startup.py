@@ -0,0 +1,100 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+
+from coreapp import startup
+from coreapp.sharding import allocator
+from coreapp.models import Category
+from coreapp.suggest import indexes, suggest_titles
+
+from .benchmark import report, scaled
+
+# Loads the WSGI application in a fresh interpreter and answers requests
+# that need no database, printing the timings as JSON
+FIRST_RESPONSE = textwrap.dedent('''
+    import io, json, sys, time
+    started = time.perf_counter()
+    from notes.wsgi import application
+    from coreapp import startup
+    loaded = time.perf_counter()
+
+    def request():
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': '/api/notes/', 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80', 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        }
+        start = time.perf_counter()
+        status = []
+        b''.join(application(environ, lambda code, headers: status.append(code)))
+        assert status[0].startswith('401'), status
+        return (time.perf_counter() - start) * 1000
+
+    first = request()
+    second = request()
+    # One write, not split by the log lines written meanwhile
+    sys.stdout.write(json.dumps({
+        'load_ms': (loaded - started) * 1000, 'first_ms': first, 'second_ms': second,
+        'warm_up_ms': startup.timings.get('warm_up', 0),
+    }) + '\\n')
+''')
+
+
+def first_response(warm_up):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path), STARTUP_WARM_UP='true' if warm_up else 'false')
+    output = subprocess.run(
+        [sys.executable, '-c', FIRST_RESPONSE], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    # Among the JSON log lines of the requests
+    return next(json.loads(line) for line in reversed(output.splitlines()) if '"load_ms"' in line)
+
+
+class WarmUpTests(SimpleTestCase):
+    def test_warm_up_needs_no_database(self):
+        # SimpleTestCase refuses queries
+        startup.warm_up()
+        self.assertIn('warm_up', startup.timings)
+
+    def test_every_serializer_is_warmed_up(self):
+        names = {serializer.__name__ for serializer in startup.serializer_classes()}
+        self.assertTrue({'NoteSerializer', 'CategorySerializer', 'SimpleEmailRegistrationSerializer'} <= names)
+
+
+class ForkTests(TestCase):
+    def test_after_fork_drops_inherited_state(self):
+        user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        Category.objects.create(name="Work", colour="#000000", user=user)
+        suggest_titles(user, "w")
+        # As reserved by the master when sharded
+        allocator.blocks[Category] = (1, 100)
+        self.assertTrue(indexes.indexes)
+
+        startup.after_fork()
+        self.assertFalse(allocator.blocks)
+        self.assertFalse(indexes.indexes)
+
+
+class StartupBenchmarkTests(SimpleTestCase):
+    def test_import_to_first_response(self):
+        """Time from importing the WSGI module to the first response, with and without warm-up"""
+        runs = max(1, scaled(3))
+        cold = [first_response(warm_up=False) for _ in range(runs)]
+        warm = [first_response(warm_up=True) for _ in range(runs)]
+
+        def best(results, key):
+            return min(result[key] for result in results)
+
+        report(
+            'startup', runs=runs,
+            cold_load_ms=best(cold, 'load_ms'), cold_first_ms=best(cold, 'first_ms'),
+            warm_load_ms=best(warm, 'load_ms'), warm_up_ms=best(warm, 'warm_up_ms'),
+            warm_first_ms=best(warm, 'first_ms'), second_ms=best(warm, 'second_ms'),
+        )
+        # Timings of separate processes are too noisy to compare: check that
+        # loading the application warmed it up only when enabled
+        self.assertTrue(all(result['warm_up_ms'] > 0 for result in warm))
+        self.assertEqual([result['warm_up_ms'] for result in cold], [0] * runs)
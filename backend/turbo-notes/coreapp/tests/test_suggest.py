@@ -0,0 +1,176 @@
+import random
+import string
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from coreapp import suggest
+from coreapp.deletion import delete_category
+from coreapp.models import Category, Note
+
+from .benchmark import report, scaled, timed
+
+
+class TitleIndexTests(SimpleTestCase):
+    def test_search(self):
+        index = suggest.TitleIndex([
+            (1, "Shopping list"), (2, "Meeting notes"), (3, "Project kickoff meeting"), (4, "shop  Hours"),
+        ])
+        self.assertEqual(index.search("shop"), [(4, "shop  Hours"), (1, "Shopping list")])
+        self.assertEqual(index.search("MEET"), [(3, "Project kickoff meeting"), (2, "Meeting notes")])
+        self.assertEqual(index.search("shop h"), [(4, "shop  Hours")])
+        self.assertEqual(index.search("shop", limit=1), [(4, "shop  Hours")])
+        self.assertEqual(index.search("zebra"), [])
+
+    def test_add_and_remove(self):
+        index = suggest.TitleIndex([(1, "Alpha beta"), (2, "Beta")])
+        index.add(3, "Beta gamma")
+        index.add(1, "Delta")
+        self.assertEqual(index.search("beta"), [(2, "Beta"), (3, "Beta gamma")])
+        self.assertEqual(index.search("delta"), [(1, "Delta")])
+        index.remove(2)
+        index.remove(99)
+        self.assertEqual(index.search("beta"), [(3, "Beta gamma")])
+        self.assertEqual(index.keys, sorted(index.keys))
+        rebuilt = suggest.TitleIndex(index.titles.items())
+        self.assertEqual((index.keys, sorted(index.ids)), (rebuilt.keys, sorted(rebuilt.ids)))
+
+    def test_long_prefixes(self):
+        long_title = "A rather long title about the quarterly planning meeting"
+        index = suggest.TitleIndex([(1, long_title), (2, "A rather long title about the quarterly budget")])
+        self.assertEqual(index.search("a rather long title about the quarterly p"), [(1, long_title)])
+        self.assertEqual(index.search("title about the quarterly planning"), [(1, long_title)])
+
+
+class SuggestAPITests(TestCase):
+    def setUp(self):
+        cache.clear()
+        suggest.indexes.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser@example.com', email='testuser@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.category = Category.objects.create(name="Work", colour="#FF5733", user=self.user)
+        self.note = self.create_note("Weekly report")
+        self.create_note("Reading list")
+
+    def create_note(self, title, user=None, category=None):
+        return Note.objects.create(
+            title=title, content="Body", date='2024-01-01',
+            category=category or self.category, user=user or self.user
+        )
+
+    def suggest(self, prefix, **params):
+        response = self.client.get(reverse('note-suggest'), {'prefix': prefix, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [note['title'] for note in response.data['results']]
+
+    def test_suggest(self):
+        self.assertEqual(self.suggest("re"), ["Reading list", "Weekly report"])
+        self.assertEqual(self.suggest("re", limit=1), ["Reading list"])
+        self.assertEqual(self.client.get(reverse('note-suggest')).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('note-suggest'), {'prefix': 're', 'limit': 1000})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_users_are_apart(self):
+        other = User.objects.create_user(username='other@example.com', email='other@example.com')
+        category = Category.objects.create(name="Work", colour="#FF5733", user=other)
+        self.create_note("Recipe", user=other, category=category)
+        self.assertEqual(self.suggest("rec"), [])
+
+    def test_lookups_after_the_first_do_not_query(self):
+        self.suggest("w")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.suggest("week"), ["Weekly report"])
+        self.assertFalse([query for query in queries.captured_queries if 'coreapp_note' in query['sql']])
+
+    def test_index_follows_writes(self):
+        self.suggest("w")
+        index = suggest.indexes.indexes[self.user.pk]
+        detail = reverse('note-detail', kwargs={'pk': self.note.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(detail, {'title': "Monthly report"}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('note-list'), {
+                'title': "Wish list", 'content': "x", 'date': '2024-01-02', 'category_id': self.category.pk,
+            }, format='json')
+        self.assertEqual(self.suggest("w"), ["Wish list"])
+        self.assertEqual(self.suggest("mon"), ["Monthly report"])
+        # Updated in place
+        self.assertIs(suggest.indexes.indexes[self.user.pk], index)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(detail)
+        self.assertEqual(self.suggest("mon"), [])
+        self.assertIs(suggest.indexes.indexes[self.user.pk], index)
+
+    def test_content_edits_leave_the_index(self):
+        self.suggest("w")
+        version = suggest.titles_version(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                reverse('note-detail', kwargs={'pk': self.note.pk}), {'base_version': 1, 'ops': [4, "!"]},
+                format='json'
+            )
+        self.assertEqual(suggest.titles_version(self.user.pk), version)
+
+    def test_changes_made_elsewhere_rebuild(self):
+        self.suggest("w")
+        # Another process renamed a note
+        Note.objects.filter(pk=self.note.pk).update(title="Daily report")
+        suggest.bump_titles_version(self.user.pk)
+        self.assertEqual(self.suggest("da"), ["Daily report"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_category(self.category)
+        self.assertEqual(self.suggest("r"), [])
+
+    @override_settings(SUGGEST_INDEX_USERS=2)
+    def test_least_recently_used_users_are_dropped(self):
+        users = [self.user] + [
+            User.objects.create_user(username=f'user{n}@example.com', email=f'user{n}@example.com')
+            for n in range(2)
+        ]
+        for user in users:
+            suggest.suggest_titles(user, "r")
+        self.assertEqual(list(suggest.indexes.indexes), [user.pk for user in users[1:]])
+
+
+def random_title(rng):
+    return ' '.join(
+        ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(rng.randint(1, 5))
+    ).capitalize()
+
+
+class SuggestBenchmarkTests(TestCase):
+    def test_lookup_latency(self):
+        """Prefix lookups from the index against an istartswith query"""
+        cache.clear()
+        suggest.indexes.clear()
+        rng = random.Random(4)
+        user = User.objects.create_user(username='bench@example.com', email='bench@example.com')
+        category = Category.objects.create(name="Work", colour="#000000", user=user)
+        count = scaled(5000)
+        Note.objects.bulk_create([
+            Note(title=random_title(rng), content="x", date='2024-01-01', category=category, user=user)
+            for _ in range(count)
+        ])
+        prefixes = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(1, 3))) for _ in range(scaled(500))]
+
+        build = timed(lambda: suggest.indexes.get(user.pk))
+        index_seconds = timed(lambda: [suggest.suggest_titles(user, prefix) for prefix in prefixes])
+        query_seconds = timed(lambda: [
+            list(Note.objects.filter(user=user, title__istartswith=prefix).order_by('title').values_list('id', 'title')[:10])
+            for prefix in prefixes
+        ])
+        index = suggest.indexes.indexes[user.pk]
+        report(
+            'suggest', notes=count, keys=len(index.keys), build_ms=build * 1000,
+            index_us=index_seconds / len(prefixes) * 1e6, query_us=query_seconds / len(prefixes) * 1e6,
+        )
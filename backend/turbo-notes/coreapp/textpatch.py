@@ -0,0 +1,145 @@
+"""
+Compact text patches.
+
+A patch is a list of operations applied from the start of the document:
+
+- a positive integer retains that many characters,
+- a negative integer deletes that many characters,
+- a string inserts itself.
+
+Whatever the patch leaves untouched at the end of the document is kept,
+so ``[120, "!"]`` appends an exclamation mark after the 120th character
+of any longer document. Lengths count Unicode code points.
+"""
+from difflib import SequenceMatcher
+
+
+class PatchError(ValueError):
+    pass
+
+
+def validate_ops(ops):
+    """Check the shape of a patch without applying it"""
+    if not isinstance(ops, list):
+        raise PatchError('A patch must be a list of operations.')
+    for op in ops:
+        # bool is an int subclass but never a meaningful operation
+        if isinstance(op, bool) or not isinstance(op, (int, str)):
+            raise PatchError('Operations must be integers or strings.')
+        if op == 0 or op == '':
+            raise PatchError('Operations must not be empty.')
+
+
+def apply_patch(text, ops):
+    """Return ``text`` with the patch ``ops`` applied"""
+    validate_ops(ops)
+    pieces = []
+    position = 0
+    length = len(text)
+
+    for op in ops:
+        if isinstance(op, str):
+            pieces.append(op)
+        elif op > 0:
+            end = position + op
+            if end > length:
+                raise PatchError(f'Cannot retain {op} characters at offset {position}, the text is {length} long.')
+            pieces.append(text[position:end])
+            position = end
+        else:
+            end = position - op
+            if end > length:
+                raise PatchError(f'Cannot delete {-op} characters at offset {position}, the text is {length} long.')
+            position = end
+
+    if position < length:
+        pieces.append(text[position:])
+    return ''.join(pieces)
+
+
+def common_prefix_length(a, b):
+    """Length of the common prefix, found by bisecting on slice comparisons"""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def common_suffix_length(a, b):
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:] == b[len(b) - middle:]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class PatchBuilder:
+    """Accumulate operations, merging neighbours of the same kind"""
+
+    def __init__(self):
+        self.ops = []
+
+    def retain(self, n):
+        if n:
+            if self.ops and isinstance(self.ops[-1], int) and self.ops[-1] > 0:
+                self.ops[-1] += n
+            else:
+                self.ops.append(n)
+
+    def delete(self, n):
+        if n:
+            if self.ops and isinstance(self.ops[-1], int) and self.ops[-1] < 0:
+                self.ops[-1] -= n
+            else:
+                self.ops.append(-n)
+
+    def insert(self, text):
+        if text:
+            if self.ops and isinstance(self.ops[-1], str):
+                self.ops[-1] += text
+            else:
+                self.ops.append(text)
+
+    def build(self):
+        # A trailing retain is implied
+        if self.ops and isinstance(self.ops[-1], int) and self.ops[-1] > 0:
+            self.ops.pop()
+        return self.ops
+
+
+def make_patch(old, new):
+    """
+    Return the operations turning ``old`` into ``new``.
+
+    The common prefix and suffix are trimmed first, which makes the usual
+    single edit cheap even on large documents. What remains is diffed line
+    by line.
+    """
+    builder = PatchBuilder()
+    prefix = common_prefix_length(old, new)
+    suffix = common_suffix_length(old[prefix:], new[prefix:])
+    old_middle = old[prefix:len(old) - suffix]
+    new_middle = new[prefix:len(new) - suffix]
+
+    builder.retain(prefix)
+    if old_middle and new_middle:
+        old_lines = old_middle.splitlines(keepends=True)
+        new_lines = new_middle.splitlines(keepends=True)
+        matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                builder.retain(sum(map(len, old_lines[i1:i2])))
+            else:
+                builder.delete(sum(map(len, old_lines[i1:i2])))
+                builder.insert(''.join(new_lines[j1:j2]))
+    else:
+        builder.delete(len(old_middle))
+        builder.insert(new_middle)
+    return builder.build()
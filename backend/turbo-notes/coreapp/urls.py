@@ -3,6 +3,8 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     CategoryViewSet, 
     NoteViewSet, 
+    JobViewSet,
+    BootstrapView,
     SimpleEmailRegistrationView, 
     EmailTokenObtainPairView
 )
@@ -11,10 +13,12 @@ from rest_framework_simplejwt.views import TokenRefreshView
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'notes', NoteViewSet, basename="note")
+router.register(r'jobs', JobViewSet, basename='job')
 
 urlpatterns = [
     path('register/', SimpleEmailRegistrationView.as_view(), name='register'),
     path('token/', EmailTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('bootstrap/', BootstrapView.as_view(), name='bootstrap'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,47 +1,375 @@
-from django.shortcuts import render
-from rest_framework import viewsets, status, permissions
+import logging
+
+from django.db import router, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.http import Http404, QueryDict
+from django.shortcuts import get_object_or_404, render
+from django.utils import timezone
+from rest_framework import generics, viewsets, status, permissions, serializers
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from django.db.models import Count
-from .models import Category, Note
-from .serializers import CategorySerializer, NoteSerializer, SimpleEmailRegistrationSerializer, EmailTokenObtainPairSerializer
+from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
-from rest_framework.permissions import AllowAny
-from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView
+
+from . import autosave
+from .archive import load_rows, restore_note, with_archived
+from .caching import cached_response
+from .deletion import delete_category, is_large
+from .duplicates import duplicate_notes
+from .filters import filter_notes, include_archived
+from .jobs import enqueue
+from .models import ArchivedNote, Category, Job, Note, NoteRevision
+from .pagination import NotePagination, should_stream, stream_page
+from .related import related_notes
+from .revisions import get_revision_content
+from .serializers import (
+    CategorySerializer,
+    NoteSerializer,
+    NoteContentPatchSerializer,
+    NoteSuggestQuerySerializer,
+    NoteSuggestionSerializer,
+    NoteDuplicatesQuerySerializer,
+    NoteRelatedQuerySerializer,
+    RelatedNoteSerializer,
+    DuplicateClusterSerializer,
+    NoteVersionSerializer,
+    NoteRevisionSerializer,
+    NoteRevisionDetailSerializer,
+    NoteStatsSerializer,
+    JobSerializer,
+    SimpleEmailRegistrationSerializer,
+    EmailTokenObtainPairSerializer,
+)
+from .sharding import ShardedViewMixin
+from .stats import user_stats
+from .suggest import suggest_titles
+from .textpatch import PatchError, apply_patch
+
+logger = logging.getLogger(__name__)
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+def with_note_counts(categories):
+    """Annotate categories with their number of notes, archived ones included, and of notes not archived"""
+    archived_count = ArchivedNote.objects.filter(category=OuterRef('pk')).order_by().values(
+        'category'
+    ).annotate(count=Count('id')).values('count')
+    return categories.annotate(hot_notes_count=Count('notes')).annotate(
+        notes_count=F('hot_notes_count') + Coalesce(Subquery(archived_count), 0)
+    )
+
+
+class CategoryViewSet(ShardedViewMixin, viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticated]
+
+    @property
+    def throttle_scope(self):
+        if self.action in ('create', 'update', 'partial_update', 'destroy'):
+            return 'write'
+        return None
     
     def get_queryset(self):
-        return Category.objects.filter(user=self.request.user).annotate(
-            notes_count=Count('notes')
-        ).order_by('name')
+        return with_note_counts(Category.objects.filter(user=self.request.user)).order_by('name')
     
+    def list(self, request, *args, **kwargs):
+        return cached_response(request, 'category-list', lambda: super(CategoryViewSet, self).list(request, *args, **kwargs))
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class NoteViewSet(viewsets.ModelViewSet):
+    def destroy(self, request, *args, **kwargs):
+        """
+        Delete the category and its notes with set-based SQL. Categories
+        with many notes are deleted by a background job, answering 202 with
+        the job to poll.
+        """
+        category = self.get_object()
+        if is_large(category.notes_count):
+            job = enqueue('delete_category', {'category_id': category.pk}, user=request.user, priority=10)
+            return Response(
+                JobSerializer(job).data,
+                status=status.HTTP_202_ACCEPTED,
+                headers={'Location': reverse('job-detail', kwargs={'pk': job.pk}, request=request)},
+            )
+        delete_category(category)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Status of the background jobs started by the user"""
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user).order_by('-created_at', '-id')
+
+class NoteViewSet(ShardedViewMixin, viewsets.ModelViewSet):
     serializer_class = NoteSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = NotePagination
+
+    @property
+    def throttle_scope(self):
+        # Reads are not rate limited
+        if self.action == 'import_notes':
+            return 'import'
+        if self.action == 'update' and autosave.is_enabled():
+            return 'autosave'
+        if self.action in ('create', 'update', 'partial_update', 'destroy'):
+            return 'write'
+        return None
     
     def get_queryset(self):
-        queryset = Note.objects.filter(user=self.request.user)
-        category_id = self.request.query_params.get('category', None)
-        
-        if category_id is not None:
-            queryset = queryset.filter(category_id=category_id)
-            
+        queryset = Note.objects.filter(user=self.request.user).select_related('category').with_content()
+        if self.action == 'list':
+            queryset = filter_notes(queryset, self.request.query_params)
         return queryset
+
+    def get_object(self):
+        """
+        Serve archived notes as they are, and restore them to the notes
+        table before anything else is done with them. Buffered autosaves
+        are shown by reads and written before other writes.
+        """
+        if autosave.is_enabled() and self.action in ('partial_update', 'destroy'):
+            if self.action == 'destroy':
+                autosave.discard(self.kwargs['pk'])
+            else:
+                autosave.flush(self.kwargs['pk'])
+        try:
+            note = super().get_object()
+        except Http404:
+            if self.action in ('retrieve', 'related'):
+                return generics.get_object_or_404(
+                    ArchivedNote.objects.filter(user=self.request.user).select_related('category'),
+                    pk=self.kwargs['pk']
+                )
+            if not restore_note(self.request.user, self.kwargs['pk']):
+                raise
+            note = super().get_object()
+        if self.action == 'retrieve':
+            autosave.overlay(note)
+        return note
+
+    def paginate_queryset(self, queryset):
+        return autosave.overlay_many(super().paginate_queryset(queryset))
+
+    def list(self, request, *args, **kwargs):
+        # Large pages are streamed, and not cached
+        if include_archived(request.query_params):
+            if should_stream(self, request):
+                return self.list_with_archived(request, stream=True)
+            return cached_response(request, 'note-list', lambda: self.list_with_archived(request))
+        if should_stream(self, request):
+            return stream_page(self, request, self.filter_queryset(self.get_queryset()))
+        return cached_response(request, 'note-list', lambda: super(NoteViewSet, self).list(request, *args, **kwargs))
+
+    def list_with_archived(self, request, stream=False):
+        """Page through the notes and archived notes merged in the requested order"""
+        notes = self.get_queryset()
+        archived = filter_notes(
+            ArchivedNote.objects.filter(user=request.user).select_related('category'), request.query_params
+        )
+        rows = with_archived(notes, archived)
+        if stream:
+            return stream_page(self, request, rows, load=lambda chunk: load_rows(chunk, notes, archived))
+        page = self.paginate_queryset(rows)
+        notes = autosave.overlay_many(load_rows(page, notes, archived))
+        return self.get_paginated_response(self.get_serializer(notes, many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        return cached_response(request, 'note-detail', lambda: super(NoteViewSet, self).retrieve(request, *args, **kwargs))
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def update(self, request, *args, **kwargs):
+        """
+        Replace the note. With autosave coalescing on, the data is buffered
+        and written once the saves of the window are over, see
+        coreapp.autosave.
+        """
+        if kwargs.get('partial') or not autosave.is_enabled():
+            return super().update(request, *args, **kwargs)
+        note = self.get_object()
+        serializer = self.get_serializer(note, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        note = autosave.buffer_update(note, serializer.validated_data)
+        return Response(self.get_serializer(note).data)
+
+    def partial_update(self, request, *args, **kwargs):
+        if 'ops' in request.data:
+            return self.patch_content(request)
+        return super().partial_update(request, *args, **kwargs)
+
+    def patch_content(self, request):
+        """
+        Apply a text patch to the content, provided the note is still at
+        `base_version`. Answers 409 with the current version otherwise.
+        """
+        patch = NoteContentPatchSerializer(data=request.data)
+        patch.is_valid(raise_exception=True)
+        autosave.flush(self.kwargs['pk'])
+
+        with transaction.atomic(using=router.db_for_write(Note)):
+            # Lock the row so the version check and the write are atomic
+            notes = Note.objects.select_for_update().filter(user=request.user)
+            try:
+                note = get_object_or_404(notes, pk=self.kwargs['pk'])
+            except Http404:
+                if not restore_note(request.user, self.kwargs['pk']):
+                    raise
+                note = get_object_or_404(notes, pk=self.kwargs['pk'])
+            if note.version != patch.validated_data['base_version']:
+                return Response(
+                    {'detail': 'The note was changed since the base version.', 'version': note.version},
+                    status=status.HTTP_409_CONFLICT
+                )
+
+            try:
+                content = apply_patch(note.content, patch.validated_data['ops'])
+            except PatchError as exc:
+                return Response({'ops': [str(exc)]}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Same rules as NoteSerializer, but without trimming whitespace
+            # so the client's copy and ours stay identical
+            try:
+                note.content = serializers.CharField(trim_whitespace=False).run_validation(content)
+            except serializers.ValidationError as exc:
+                return Response({'content': exc.detail}, status=status.HTTP_400_BAD_REQUEST)
+            note.save(update_fields=['content'])
+
+        return Response(NoteVersionSerializer(note).data)
+
+    @action(detail=True, methods=['get'])
+    def revisions(self, request, pk=None):
+        """List the stored past versions of a note, newest first"""
+        note = self.get_object()
+        queryset = NoteRevision.objects.filter(note=note).order_by('-version').only('version', 'size', 'saved_at')
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(NoteRevisionSerializer(page, many=True).data)
+
+    @action(detail=True, methods=['get'], url_path=r'revisions/(?P<version>[0-9]+)')
+    def revision(self, request, pk=None, version=None):
+        """Return the content of a note as it was at `version`"""
+        note = self.get_object()
+        version = int(version)
+        try:
+            content = get_revision_content(note, version)
+        except NoteRevision.DoesNotExist:
+            return Response({'detail': 'No such revision.'}, status=status.HTTP_404_NOT_FOUND)
+
+        if version == note.version:
+            revision = NoteRevision(version=version, size=len(content), saved_at=note.updated_at)
+        else:
+            revision = NoteRevision.objects.only('version', 'size', 'saved_at').get(note=note, version=version)
+        revision.content = content
+        return Response(NoteRevisionDetailSerializer(revision).data)
+
+    @action(detail=True, methods=['get'])
+    def related(self, request, pk=None):
+        """The notes most similar to this one by their words, best first, see coreapp.related"""
+        query = NoteRelatedQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        results = related_notes(request.user, self.get_object(), query.validated_data['limit'])
+        return Response({'results': RelatedNoteSerializer(results, many=True).data})
+
+    @action(detail=False, methods=['get'])
+    def duplicates(self, request):
+        """Clusters of near-duplicate notes, largest first, see coreapp.duplicates"""
+        query = NoteDuplicatesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        results = duplicate_notes(request.user, query.validated_data['limit'])
+        return Response({'results': DuplicateClusterSerializer(results, many=True).data})
+
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """Notes whose title or one of its words starts with `prefix`, for quick switchers"""
+        query = NoteSuggestQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        results = suggest_titles(request.user, query.validated_data['prefix'], query.validated_data['limit'])
+        return Response({'results': NoteSuggestionSerializer(results, many=True).data})
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Note counts per category, month and day, read from the precomputed buckets"""
+        return Response(NoteStatsSerializer(user_stats(request.user)).data)
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_notes(self, request):
+        """Bulk import notes from an uploaded NDJSON, CSV or Markdown file"""
+        # Only needed here, not by every worker on startup
+        from .importers import FORMATS, detect_format, import_notes
+
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        fmt = request.data.get('format') or detect_format(upload.name)
+        if fmt not in FORMATS:
+            return Response(
+                {'format': [f'Choose one of: {", ".join(FORMATS)}.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            report = import_notes(request.user, upload.chunks(), fmt)
+        except UnicodeDecodeError:
+            return Response({'file': ['File must be UTF-8 encoded.']}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+
+class BootstrapView(ShardedViewMixin, APIView):
+    """
+    Everything the app shows on startup in one response: the categories
+    with their note counts, the first page of notes as /api/notes/ returns
+    it, and `synced_at`, to pass as `updated_since` for the notes changed
+    since. Two queries after authentication, whatever the number of notes:
+    the note count of the page is summed from the category counts.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        # Left out of the cached body: it is only served while none of the
+        # user's notes changed since it was computed, which makes the time
+        # of this request as good
+        synced_at = timezone.now()
+        response = cached_response(request, 'bootstrap', lambda: self.bootstrap(request))
+        if response.status_code == status.HTTP_200_OK:
+            response.data = {**response.data, 'synced_at': synced_at}
+        return response
+
+    def bootstrap(self, request):
+        categories = list(with_note_counts(Category.objects.filter(user=request.user)).order_by('name'))
+        count = sum(category.hot_notes_count for category in categories)
+
+        page_size = api_settings.PAGE_SIZE
+        notes = filter_notes(
+            Note.objects.filter(user=request.user).select_related('category').with_content(), QueryDict()
+        )
+        notes_url = reverse('note-list', request=request)
+        return Response({
+            'categories': CategorySerializer(categories, many=True).data,
+            'notes': {
+                'count': count,
+                'next': replace_query_param(notes_url, 'page', 2) if count > page_size else None,
+                'previous': None,
+                'results': NoteSerializer(
+                    autosave.overlay_many(list(notes[:page_size])), many=True, context={'request': request}
+                ).data,
+            },
+        })
+
 
 class SimpleEmailRegistrationView(APIView):
     permission_classes = [AllowAny]
+    throttle_scope = 'auth'
     
     def post(self, request):
         serializer = SimpleEmailRegistrationSerializer(data=request.data)
@@ -74,8 +402,9 @@ class SimpleEmailRegistrationView(APIView):
                 }
             }, status=status.HTTP_201_CREATED)
 
-        print(serializer.errors)
+        logger.info('Registration rejected', extra={'errors': serializer.errors})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class EmailTokenObtainPairView(TokenObtainPairView):
-    serializer_class = EmailTokenObtainPairSerializer
\ No newline at end of file
+    serializer_class = EmailTokenObtainPairSerializer
+    throttle_scope = 'auth'
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""
+gunicorn settings, read from the environment.
+
+GUNICORN_PRELOAD=true loads and warms up the application once in the
+master, so workers start and restart from a ready copy instead of each
+importing Django (see coreapp.startup).
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:7000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 3))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'false').lower() in ('1', 'true', 'yes')
+
+
+def pre_fork(server, worker):
+    if server.cfg.preload_app:
+        from coreapp import startup
+
+        startup.before_fork()
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from coreapp import startup
+
+        startup.after_fork()
+
+
+def post_worker_init(worker):
+    from coreapp import startup
+
+    phases = ', '.join(f'{name} {ms:.0f} ms' for name, ms in startup.timings.items())
+    worker.log.info('Worker %s ready (%s)', worker.pid, phases)
+
+
+def worker_exit(server, worker):
+    from coreapp import autosave
+
+    written = autosave.flush_all()
+    if written:
+        worker.log.info('Worker %s wrote %s buffered autosaves on exit', worker.pid, written)
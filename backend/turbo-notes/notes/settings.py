@@ -1,4 +1,6 @@
+import logging
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 import dj_database_url
@@ -11,6 +13,9 @@ SECRET_KEY = os.environ.get('SECRET_KEY')
 
 DEBUG = False
 
+# Set by `manage.py test`
+TESTING = sys.argv[1:2] == ['test']
+
 ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS').split(',')
 ALLOWED_HOSTS = [host.strip() for host in ALLOWED_HOSTS]
 
@@ -34,7 +39,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'coreapp.logs.RequestLogMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'coreapp.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -86,6 +93,22 @@ DATABASES = {
 #     }
 # }
 
+# Extra databases holding users' categories and notes, as comma separated
+# alias=url pairs. The default database is a shard too and keeps the users
+# and the directory of which shard holds whose notes, see coreapp.sharding
+SHARD_DATABASE_URLS = [
+    pair.split('=', 1) for pair in os.environ.get('SHARD_DATABASE_URLS', '').split(',') if pair.strip()
+]
+for alias, url in SHARD_DATABASE_URLS:
+    DATABASES[alias.strip()] = dj_database_url.parse(url.strip())
+SHARDS = ['default'] + [alias.strip() for alias, _ in SHARD_DATABASE_URLS]
+if TESTING:
+    # Created by the test runner for the sharding tests, which spread users
+    # over them with SHARDS overridden. The other tests use one database
+    for alias in ('shard_a', 'shard_b'):
+        DATABASES.setdefault(alias, {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'})
+DATABASE_ROUTERS = ['coreapp.sharding.ShardRouter']
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -124,10 +147,149 @@ STATICFILES_DIRS = [
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+
+# Note bodies of at least this many bytes are stored zlib compressed
+NOTE_BODY_COMPRESSION_THRESHOLD = int(os.environ.get('NOTE_BODY_COMPRESSION_THRESHOLD', 1024))
+
+# Categories with at least this many notes are deleted in the background,
+# in transactions of FAST_DELETE_CHUNK_SIZE notes
+FAST_DELETE_BACKGROUND_THRESHOLD = int(os.environ.get('FAST_DELETE_BACKGROUND_THRESHOLD', 10000))
+FAST_DELETE_CHUNK_SIZE = int(os.environ.get('FAST_DELETE_CHUNK_SIZE', 1000))
+
+# Build URL resolvers, serializer fields and the like when the WSGI
+# application loads rather than on the first requests, see coreapp.startup
+STARTUP_WARM_UP = os.environ.get('STARTUP_WARM_UP', 'true').lower() in ('1', 'true', 'yes')
+
+# Notes not changed for ARCHIVE_AFTER_DAYS are moved to the archive table by
+# the archive_notes job, ARCHIVE_BATCH_SIZE notes per transaction, running
+# for up to ARCHIVE_JOB_SECONDS before queueing its continuation
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 180))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))
+ARCHIVE_JOB_SECONDS = int(os.environ.get('ARCHIVE_JOB_SECONDS', 60))
+
+# Title suggestion indexes kept in memory by each worker, see coreapp.suggest
+SUGGEST_INDEX_USERS = int(os.environ.get('SUGGEST_INDEX_USERS', 1000))
+SUGGEST_INDEX_MAX_AGE = int(os.environ.get('SUGGEST_INDEX_MAX_AGE', 300))
+
+# Related notes indexes kept in memory by each worker, see coreapp.related
+RELATED_INDEX_USERS = int(os.environ.get('RELATED_INDEX_USERS', 100))
+RELATED_INDEX_MAX_AGE = int(os.environ.get('RELATED_INDEX_MAX_AGE', 600))
+# Indexes of users with more notes are built in the background
+RELATED_INDEX_SYNC_NOTES = int(os.environ.get('RELATED_INDEX_SYNC_NOTES', 1000))
+
+# Set REDIS_URL (with the redis package installed) for a cache shared by
+# every gunicorn worker, each process caches on its own otherwise
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 10000))},
+        }
+    }
+
+# Category and note responses are cached per user (coreapp.caching). Writes
+# served by one worker must reach the copies of the others, so the cache is
+# only used by default when it is shared
+RESPONSE_CACHE_ENABLED = os.environ.get(
+    'RESPONSE_CACHE_ENABLED', 'true' if os.environ.get('REDIS_URL') else 'false'
+).lower() in ('1', 'true', 'yes')
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300))
+
+# Note list pages hold up to NOTES_MAX_PAGE_SIZE notes (`page_size`). Pages
+# of LIST_STREAMING_THRESHOLD notes or more are streamed, reading and
+# rendering LIST_STREAMING_CHUNK_SIZE notes at a time (coreapp.pagination)
+NOTES_MAX_PAGE_SIZE = int(os.environ.get('NOTES_MAX_PAGE_SIZE', 10000))
+LIST_STREAMING_THRESHOLD = int(os.environ.get('LIST_STREAMING_THRESHOLD', 500))
+LIST_STREAMING_CHUNK_SIZE = int(os.environ.get('LIST_STREAMING_CHUNK_SIZE', 500))
+
+# Autosaves (PUT) of a note within AUTOSAVE_COALESCE_WINDOW seconds are
+# merged into one write, see coreapp.autosave. Buffers are read by every
+# worker, so this is only on by default when the cache is shared; 0 disables
+AUTOSAVE_COALESCE_WINDOW = float(os.environ.get(
+    'AUTOSAVE_COALESCE_WINDOW', '2' if os.environ.get('REDIS_URL') else '0'
+))
+
+# Up to NOTE_FRAGMENT_CACHE_BYTES of rendered notes are kept by each process
+# and reused by the note lists, see coreapp.fragments. 0 turns it off
+NOTE_FRAGMENT_CACHE_BYTES = int(os.environ.get('NOTE_FRAGMENT_CACHE_BYTES', 32 * 1024 * 1024))
+
+# Logs are written to stdout as JSON lines by a background thread, see
+# coreapp.logs. Up to LOG_QUEUE_SIZE records wait to be written, more are
+# dropped. Only a LOG_REQUEST_SAMPLE_RATE share of the successful requests
+# is logged. Tests log nothing below CRITICAL unless LOG_LEVEL is set
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'CRITICAL' if TESTING else 'INFO')
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_REQUEST_SAMPLE_RATE = float(os.environ.get('LOG_REQUEST_SAMPLE_RATE', 1))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'coreapp.logs.RequestIDFilter'},
+        'sample_requests': {'()': 'coreapp.logs.SamplingFilter', 'rate': LOG_REQUEST_SAMPLE_RATE},
+    },
+    'handlers': {
+        'background': {
+            '()': 'coreapp.logs.BackgroundHandler',
+            'maxsize': LOG_QUEUE_SIZE,
+            'filters': ['request_id'],
+        },
+    },
+    'loggers': {
+        'coreapp.requests': {'filters': ['sample_requests']},
+        # Django's own console and mail_admins handlers would write its
+        # records a second time
+        'django': {'handlers': []},
+        # Client errors are in the request records already, server errors
+        # come with their traceback
+        'django.request': {'level': max(LOG_LEVEL, 'ERROR', key=logging.getLevelName)},
+    },
+    'root': {
+        'handlers': ['background'],
+        'level': LOG_LEVEL,
+    },
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'coreapp.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'coreapp.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'coreapp.ratelimit.RateLimitThrottle',
+    ),
+    # Requests per user, or per IP address for anonymous clients, of the
+    # views naming these scopes
+    'DEFAULT_THROTTLE_RATES': {
+        'auth': os.environ.get('THROTTLE_RATE_AUTH', '10/min'),
+        'write': os.environ.get('THROTTLE_RATE_WRITE', '120/min'),
+        # Note saves merged by autosave coalescing, which cost no write each
+        'autosave': os.environ.get('THROTTLE_RATE_AUTOSAVE', '600/min'),
+        'import': os.environ.get('THROTTLE_RATE_IMPORT', '10/hour'),
+    },
+    # nginx adds the client address to X-Forwarded-For
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 1)),
 }
+
+# coreapp.ratelimit.LocalBackend limits each gunicorn worker on its own,
+# coreapp.ratelimit.CacheBackend shares the limits through RATE_LIMIT_CACHE
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'coreapp.ratelimit.LocalBackend')
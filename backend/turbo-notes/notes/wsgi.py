@@ -8,9 +8,21 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 """
 
 import os
+import time
 
-from django.core.wsgi import get_wsgi_application
+started = time.perf_counter()
+
+from django.core.wsgi import get_wsgi_application  # noqa: E402
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'notes.settings')
 
 application = get_wsgi_application()
+
+from coreapp import autosave, startup  # noqa: E402
+
+startup.timings['load'] = (time.perf_counter() - started) * 1000
+if startup.is_enabled():
+    startup.warm_up()
+
+# Buffered autosaves are written by a background thread of the server process
+autosave.flusher.enable()